@@ -0,0 +1,33 @@
+"""
+スケジューラ ベンチマークスイート
+
+東京近郊の作業員（10〜5,000人）・既存ジョブ・新規予約を合成し、
+ScheduleOptimizer.optimize・スロット探索・スコア計算をそれぞれ計測する。
+結果は JSON で保存し、基準の結果と比べてしきい値を超えて悪化していれば
+終了コード 1 で終わる（CI の回帰ゲートに使う）。
+旧版の scheduler-service.py を --compare-service に渡すと、同じデータで optimize を
+計測して速度比を表示する。--jobs-per-worker で既存ジョブの密度を指定できる
+（500人 × 10件で 5,000件の日）。
+
+    cd benchmarks
+    python -m scheduler_bench --output results.json
+    python -m scheduler_bench --baseline baseline.json --threshold 0.2
+
+    git show <commit>:ai-automation/prototypes/scheduler-service.py > /tmp/old_service.py
+    python -m scheduler_bench --compare-service /tmp/old_service.py --scales 500 --jobs-per-worker 10
+"""
+
+from .generator import generate_bookings, generate_fleet, generate_jobs, generate_scenario
+from .runner import compare, load_service, run_scale, speedups, summarize
+
+__all__ = [
+    "compare",
+    "generate_bookings",
+    "generate_fleet",
+    "generate_jobs",
+    "generate_scenario",
+    "load_service",
+    "run_scale",
+    "speedups",
+    "summarize",
+]
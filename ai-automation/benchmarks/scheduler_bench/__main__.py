@@ -0,0 +1,111 @@
+"""
+python -m scheduler_bench のエントリポイント
+"""
+
+import argparse
+import json
+import platform
+import sys
+from datetime import datetime
+from pathlib import Path
+
+from . import __doc__ as PACKAGE_DOC
+from .runner import DEFAULT_SERVICE, STAGES, compare, load_service, run_scale, speedups
+
+DEFAULT_SCALES = [10, 100, 1000, 5000]
+
+
+def print_scale(result, label: str = ""):
+    print(f"{label}workers={result['workers']} jobs={result['jobs']} requests={result['requests']}  "
+          f"build {result['build_ms']:.0f} ms  warm-up {result['warmup_ms']:.0f} ms  "
+          f"peak {result['peak_memory_mb']:.1f} MB")
+    for stage in STAGES:
+        if stage not in result:
+            continue
+        stats = result[stage]
+        print(f"  {stage:>12}: {stats['throughput_per_s']:>10.1f} /s  "
+              f"p50 {stats['p50_ms']:9.4f} ms  p99 {stats['p99_ms']:9.4f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=PACKAGE_DOC.strip().splitlines()[0])
+    parser.add_argument("--service", type=Path, default=DEFAULT_SERVICE)
+    parser.add_argument("--scales", type=int, nargs="+", default=DEFAULT_SCALES,
+                        help="計測する作業員数")
+    parser.add_argument("--requests", type=int, default=200, help="規模ごとの新規予約数")
+    parser.add_argument("--load", type=float, default=0.5,
+                        help="既存ジョブの埋まり具合（1日の上限件数に対する割合）")
+    parser.add_argument("--jobs-per-worker", type=int, default=None,
+                        help="作業員ごとの既存ジョブ数（--load の代わり。500人 × 10件で 5,000件の日）")
+    parser.add_argument("--memory-requests", type=int, default=20,
+                        help="メモリ計測の回で実行する optimize の件数")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="各段階の繰り返し回数（指標ごとに最も良い値を採用）")
+    parser.add_argument("--date", default="2026-03-02")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--output", type=Path, default=None, help="結果の JSON を書き出す先")
+    parser.add_argument("--baseline", type=Path, default=None, help="比較する基準の結果（JSON）")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="p50・スループットの許容悪化率")
+    parser.add_argument("--p99-threshold", type=float, default=0.5, help="p99 の許容悪化率")
+    parser.add_argument("--memory-threshold", type=float, default=0.2,
+                        help="メモリ使用量のピークの許容増加率")
+    parser.add_argument("--compare-service", type=Path, default=None,
+                        help="比較する旧版の scheduler-service.py（同じデータで optimize の速度比を表示）")
+    args = parser.parse_args()
+    if args.jobs_per_worker is not None and args.jobs_per_worker < 1:
+        parser.error("--jobs-per-worker は1以上で指定してください")
+
+    module = load_service(args.service)
+    other = load_service(args.compare_service, "scheduler_bench_compare") if args.compare_service else None
+    # 旧版と比べるときは、どの版にもある optimize だけを計測する
+    stages = ("optimize",) if other is not None else STAGES
+
+    results = {
+        "meta": {
+            "service": str(args.service),
+            "date": args.date,
+            "load": args.load,
+            "jobs_per_worker": args.jobs_per_worker,
+            "seed": args.seed,
+            "repeat": args.repeat,
+            "compare_service": str(args.compare_service) if other is not None else None,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+        },
+        "scales": [],
+    }
+
+    for num_workers in args.scales:
+        result = run_scale(module, num_workers, args.requests, args.date, args.load,
+                           args.memory_requests, args.seed, args.repeat, stages, args.jobs_per_worker)
+        if other is None:
+            print_scale(result)
+        else:
+            before = run_scale(other, num_workers, args.requests, args.date, args.load,
+                               args.memory_requests, args.seed, args.repeat, stages, args.jobs_per_worker)
+            print_scale(result, "current  ")
+            print_scale(before, "compare  ")
+            result["speedup"] = speedups(result, before)
+            for stage, ratio in result["speedup"].items():
+                print(f"  {stage:>12}: {ratio:.1f}x（p50、旧版に対する速度比）")
+        results["scales"].append(result)
+
+    if args.output:
+        args.output.write_text(json.dumps(results, ensure_ascii=False, indent=2) + "\n")
+        print(f"結果を書き出しました: {args.output}")
+
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text())
+        regressions = compare(results, baseline, args.threshold, args.p99_threshold, args.memory_threshold)
+        for r in regressions:
+            print(f"REGRESSION workers={r['workers']} {r['stage']}.{r['metric']}: "
+                  f"{r['baseline']} -> {r['current']} ({r['change']:+.0%}, 許容 {r['threshold']:.0%})")
+        if regressions:
+            sys.exit(1)
+        print(f"基準との比較: 回帰なし（{args.baseline}）")
+
+
+if __name__ == "__main__":
+    main()
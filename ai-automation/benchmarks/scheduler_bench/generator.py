@@ -0,0 +1,190 @@
+"""
+合成データの生成
+
+東京近郊の拠点（ターミナル駅周辺）に作業員を配置し、シフト・1日の上限件数・
+既存ジョブ・新規予約を作る。どの版のサービスのモデルにも渡せるよう辞書で返す。
+同じ seed なら同じデータになる。
+"""
+
+import random
+from typing import Dict, List, Optional, Tuple
+
+# 作業員の拠点・予約が集まる地点（緯度, 経度, 住所, 重み）
+HUBS = [
+    (35.6896, 139.7006, "東京都新宿区", 3),
+    (35.6580, 139.7016, "東京都渋谷区", 3),
+    (35.7295, 139.7109, "東京都豊島区", 2),
+    (35.6284, 139.7387, "東京都港区", 2),
+    (35.7138, 139.7770, "東京都台東区", 2),
+    (35.6812, 139.7671, "東京都千代田区", 2),
+    (35.6197, 139.7790, "東京都江東区", 1),
+    (35.7497, 139.8066, "東京都足立区", 1),
+    (35.6987, 139.4137, "東京都立川市", 1),
+    (35.5418, 139.4462, "東京都町田市", 1),
+    (35.5308, 139.7029, "神奈川県川崎市", 1),
+    (35.4660, 139.6223, "神奈川県横浜市", 1),
+    (35.8617, 139.6455, "埼玉県さいたま市", 1),
+    (35.7075, 139.9592, "千葉県船橋市", 1),
+]
+
+# 拠点まわりのばらつき（度。緯度0.03度 ≒ 3km）
+HUB_SPREAD = 0.03
+
+# 拠点から離れた予約の範囲（首都圏をおおよそ覆う）
+AREA_LAT = (35.45, 35.90)
+AREA_LON = (139.35, 140.00)
+
+# シフト（開始時, 終了時, 重み）
+SHIFTS = [(8, 17, 2), (9, 18, 4), (10, 19, 2), (13, 22, 1)]
+
+# 予約の作業時間（分, 重み）と緊急度（重み）
+DURATIONS = [(60, 3), (90, 3), (120, 3), (180, 1)]
+URGENCIES = [("low", 3), ("medium", 5), ("high", 2)]
+
+# 希望時刻（時, 重み）。None は指定なし
+PREFERRED_HOURS = [(None, 5), (9, 2), (10, 4), (11, 3), (13, 4), (14, 4), (15, 3), (16, 2), (17, 1), (19, 1)]
+
+TRAVEL_BUFFER_MINUTES = 30
+
+# 1日の上限件数（基準の件数への上乗せ）
+EXTRA_JOBS = [0, 1, 1, 2, 3]
+
+
+def _pick(rnd: random.Random, choices):
+    """(値..., 重み) の一覧から重みに従って1つ選ぶ"""
+    return rnd.choices(choices, weights=[choice[-1] for choice in choices])[0]
+
+
+def _near_hub(rnd: random.Random, spread: float = HUB_SPREAD) -> Dict:
+    lat, lon, address, _ = _pick(rnd, HUBS)
+    return {
+        "latitude": rnd.gauss(lat, spread),
+        "longitude": rnd.gauss(lon, spread * 1.2),
+        "address": address,
+    }
+
+
+def _anywhere(rnd: random.Random) -> Dict:
+    return {
+        "latitude": rnd.uniform(*AREA_LAT),
+        "longitude": rnd.uniform(*AREA_LON),
+        "address": "首都圏",
+    }
+
+
+def _hhmm(minute: int) -> str:
+    return f"{minute // 60:02d}:{minute % 60:02d}"
+
+
+def generate_fleet(num_workers: int, seed: int = 0, jobs_per_worker: Optional[int] = None) -> List[Dict]:
+    """
+    拠点・シフト・1日の上限件数の異なる作業員を生成
+
+    上限件数は3〜6件。jobs_per_worker を指定した場合は jobs_per_worker〜jobs_per_worker+3 件
+    """
+    rnd = random.Random(seed)
+    base = 3 if jobs_per_worker is None else jobs_per_worker
+    workers = []
+    for w in range(num_workers):
+        start, end, _ = _pick(rnd, SHIFTS)
+        workers.append({
+            "worker_id": f"worker-{w:05d}",
+            "name": f"作業員{w}",
+            "current_location": _near_hub(rnd),
+            "available_from": f"{start:02d}:00",
+            "available_to": f"{end:02d}:00",
+            "max_jobs_per_day": base + rnd.choice(EXTRA_JOBS),
+        })
+    return workers
+
+
+def generate_jobs(
+    workers: List[Dict],
+    date: str,
+    load: float = 0.5,
+    seed: int = 0,
+    jobs_per_worker: Optional[int] = None
+) -> List[Dict]:
+    """
+    確定済みジョブを生成（作業員ごとに上限件数の約 load 割、シフト内で重ならないように配置）
+
+    jobs_per_worker を指定した場合は load の代わりに作業員ごとにちょうどその件数を置く。
+    シフトを件数で等分した枠に収まるよう、作業時間は枠に入るものだけから選ぶ
+    （入るものがなければ枠に入る15分単位の長さ）
+    """
+    rnd = random.Random(seed + 1)
+    jobs = []
+    for worker in workers:
+        shift_start = int(worker["available_from"][:2]) * 60
+        shift_end = int(worker["available_to"][:2]) * 60
+        if jobs_per_worker is None:
+            count = sum(rnd.random() < load for _ in range(worker["max_jobs_per_day"]))
+        else:
+            count = min(jobs_per_worker, worker["max_jobs_per_day"])
+            span = (shift_end - shift_start) // max(count, 1)
+            fitting = [choice for choice in DURATIONS if choice[0] + TRAVEL_BUFFER_MINUTES <= span]
+
+        minute = shift_start
+        for j in range(count):
+            if jobs_per_worker is None:
+                duration, _ = _pick(rnd, DURATIONS)
+                minute += rnd.choice([0, 30, 60, 90])
+            else:
+                duration = _pick(rnd, fitting)[0] if fitting else max(
+                    15, (span - TRAVEL_BUFFER_MINUTES) // 15 * 15
+                )
+                minute = shift_start + j * span
+            if minute + duration > shift_end:
+                break
+            jobs.append({
+                "booking_id": f"job-{worker['worker_id']}-{j}",
+                "worker_id": worker["worker_id"],
+                "scheduled_date": date,
+                "scheduled_time_start": _hhmm(minute),
+                "scheduled_time_end": _hhmm(minute + duration),
+                "travel_time_minutes": 0,
+                "travel_distance_km": 0.0,
+                "location": _near_hub(rnd) if rnd.random() < 0.8 else _anywhere(rnd),
+            })
+            minute += duration + TRAVEL_BUFFER_MINUTES
+    return jobs
+
+
+def generate_bookings(num_bookings: int, date: str, seed: int = 0) -> List[Dict]:
+    """新規予約を生成（8割は拠点周辺、2割は首都圏のどこか）"""
+    rnd = random.Random(seed + 2)
+    bookings = []
+    for b in range(num_bookings):
+        hour, _ = _pick(rnd, PREFERRED_HOURS)
+        duration, _ = _pick(rnd, DURATIONS)
+        urgency, _ = _pick(rnd, URGENCIES)
+        bookings.append({
+            "booking_id": f"book-{b:06d}",
+            "customer_name": "顧客",
+            "location": _near_hub(rnd) if rnd.random() < 0.8 else _anywhere(rnd),
+            "preferred_date": date,
+            "preferred_time": None if hour is None else f"{hour:02d}:00",
+            "estimated_duration_minutes": duration,
+            "urgency": urgency,
+        })
+    return bookings
+
+
+def generate_scenario(
+    num_workers: int,
+    num_bookings: int,
+    date: str,
+    load: float = 0.5,
+    seed: Optional[int] = None,
+    jobs_per_worker: Optional[int] = None
+) -> Tuple[List[Dict], List[Dict], List[Dict]]:
+    """
+    (作業員, 確定済みジョブ, 新規予約)。seed を省略した場合は規模ごとに固定の値
+
+    jobs_per_worker を指定すると確定済みジョブは作業員数 × jobs_per_worker 件になる
+    （500人 × 10件で 5,000件の日）
+    """
+    seed = num_workers if seed is None else seed
+    workers = generate_fleet(num_workers, seed, jobs_per_worker)
+    jobs = generate_jobs(workers, date, load, seed, jobs_per_worker)
+    return workers, jobs, generate_bookings(num_bookings, date, seed)
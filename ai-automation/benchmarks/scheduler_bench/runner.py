@@ -0,0 +1,281 @@
+"""
+計測と比較
+
+1つの規模について次の3段階を別々に計測する:
+
+- optimize: ScheduleOptimizer.optimize の1リクエスト
+- slot_search: 1予約について近傍の候補作業員全員の _find_available_slots
+- scoring: 同じ予約について見つかった全スロットの _calculate_score
+
+各段階は repeat 回繰り返して指標ごとに最も良い値を採用し（timeit と同じ考え方で、
+ほかのプロセスの割り込みによる揺れを除く）、計測中は GC を止める。
+時間の計測とは別に、tracemalloc を有効にした回で最適化エンジンの構築から
+optimize までのメモリ使用量のピークを計る（tracemalloc は処理を遅くするため）。
+
+旧版の scheduler-service.py と同じ合成データで計測し、速度比（speedups）を出すこともできる。
+"""
+
+import gc
+import importlib.util
+import statistics
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from .generator import generate_scenario
+
+DEFAULT_SERVICE = Path(__file__).resolve().parents[2] / "prototypes" / "scheduler-service.py"
+
+STAGES = ("optimize", "slot_search", "scoring")
+
+# 比較する指標と、基準値から悪化とみなす方向（1: 大きいほど悪い, -1: 小さいほど悪い）
+METRICS = {
+    "p50_ms": 1,
+    "p99_ms": 1,
+    "throughput_per_s": -1,
+}
+
+
+def load_service(path: Path, name: str = "scheduler_bench_service"):
+    """ハイフン付きファイル名のサービスをモジュールとして読み込む"""
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def _percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+def summarize(timings: List[float], calls: int) -> Dict:
+    """
+    所要時間（ms）の一覧を集計
+
+    calls は計測した区間全体での呼び出し回数（slot_search・scoring は1区間で複数回呼ぶ）
+    """
+    total = sum(timings)
+    return {
+        "samples": len(timings),
+        "calls": calls,
+        "throughput_per_s": round(calls / (total / 1000), 1) if total > 0 else 0.0,
+        "mean_ms": round(statistics.mean(timings), 4),
+        "p50_ms": round(statistics.median(timings), 4),
+        "p99_ms": round(_percentile(timings, 0.99), 4),
+    }
+
+
+def _build(module, workers, jobs, bookings):
+    optimizer = module.ScheduleOptimizer(
+        [module.Worker(**w) for w in workers],
+        [module.ScheduledJob(**j) for j in jobs],
+    )
+    return optimizer, [module.BookingRequest(**b) for b in bookings]
+
+
+def _no_capacity(module):
+    """空きがないときの例外（旧版には無いので、その場合は何も捕まえない）"""
+    return getattr(module, "NoCapacityError", ())
+
+
+def _time_optimize(module, optimizer, bookings, date: str) -> Dict:
+    timings = []
+    for booking in bookings:
+        start = time.perf_counter()
+        try:
+            optimizer.optimize(booking, date)
+        except _no_capacity(module):
+            pass
+        timings.append((time.perf_counter() - start) * 1000)
+    return summarize(timings, len(timings))
+
+
+def _time_stages(module, optimizer, bookings, date: str) -> Dict:
+    """
+    optimize が最初に評価する近傍の作業員について、スロット探索とスコア計算を別々に計測
+    """
+    slot_timings, score_timings = [], []
+    slot_calls = score_calls = 0
+
+    for booking in bookings:
+        candidates = optimizer._nearest_workers(booking.location, date, optimizer.candidate_workers)
+        duration = booking.estimated_duration_minutes
+        preferred = module._to_minutes(booking.preferred_time) if booking.preferred_time else None
+
+        start = time.perf_counter()
+        found = [
+            (worker, optimizer._find_available_slots(worker, duration, date))
+            for worker in candidates
+        ]
+        slot_timings.append((time.perf_counter() - start) * 1000)
+        slot_calls += len(candidates)
+
+        counts = [optimizer.index.count(worker.worker_id, date) for worker, _ in found]
+
+        start = time.perf_counter()
+        for (worker, slots), job_count in zip(found, counts):
+            for slot_start, _ in slots:
+                optimizer._calculate_score(worker, date, slot_start, job_count, booking, preferred)
+                score_calls += 1
+        score_timings.append((time.perf_counter() - start) * 1000)
+
+    return {
+        "slot_search": summarize(slot_timings, slot_calls),
+        "scoring": summarize(score_timings, score_calls),
+    }
+
+
+def _best_of(repeat: int, measure) -> Dict:
+    """
+    measure() を repeat 回実行し、段階・指標ごとに最も良い値を返す
+    （所要時間は最小、スループットは最大）
+    """
+    best: Dict = {}
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            for stage, stats in measure().items():
+                if stage not in best:
+                    best[stage] = dict(stats)
+                    continue
+                for metric, value in stats.items():
+                    if metric == "throughput_per_s":
+                        best[stage][metric] = max(best[stage][metric], value)
+                    elif metric.endswith("_ms"):
+                        best[stage][metric] = min(best[stage][metric], value)
+    finally:
+        if enabled:
+            gc.enable()
+    return best
+
+
+def _peak_memory(module, scenario, date: str, requests: int) -> float:
+    """最適化エンジンの構築から optimize までのメモリ使用量のピーク（MB）"""
+    workers, jobs, bookings = scenario
+    tracemalloc.start()
+    try:
+        optimizer, requests_ = _build(module, workers, jobs, bookings[:requests])
+        for booking in requests_:
+            try:
+                optimizer.optimize(booking, date)
+            except _no_capacity(module):
+                pass
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return round(peak / (1024 * 1024), 2)
+
+
+def run_scale(
+    module,
+    num_workers: int,
+    num_requests: int,
+    date: str,
+    load: float = 0.5,
+    memory_requests: int = 20,
+    seed: Optional[int] = None,
+    repeat: int = 3,
+    stages: Tuple[str, ...] = STAGES,
+    jobs_per_worker: Optional[int] = None
+) -> Dict:
+    """
+    1つの規模（作業員数）を計測し、段階ごとの集計とメモリのピークを返す
+
+    旧版との比較では stages を ("optimize",) にする（スロット探索・スコア計算は
+    内部のメソッドを直接呼ぶため、旧版には無いことがある）。
+    jobs_per_worker を指定すると、既存ジョブは load の代わりに作業員ごとにその件数になる
+    """
+    scenario = generate_scenario(num_workers, num_requests + 1, date, load, seed, jobs_per_worker)
+    workers, jobs, bookings = scenario
+
+    start = time.perf_counter()
+    optimizer, requests_ = _build(module, workers, jobs, bookings)
+    build_ms = (time.perf_counter() - start) * 1000
+
+    # 1件目（日付ごとの距離行列・空間索引の初回構築を含む）はウォームアップとして除外
+    start = time.perf_counter()
+    optimizer.optimize(requests_[0], date)
+    warmup_ms = (time.perf_counter() - start) * 1000
+
+    result = {
+        "workers": num_workers,
+        "jobs": len(jobs),
+        "requests": num_requests,
+        "build_ms": round(build_ms, 2),
+        "warmup_ms": round(warmup_ms, 2),
+        "repeat": repeat,
+    }
+    result.update(_best_of(repeat, lambda: {
+        "optimize": _time_optimize(module, optimizer, requests_[1:], date),
+    }))
+    if "slot_search" in stages or "scoring" in stages:
+        result.update(_best_of(repeat, lambda: _time_stages(module, optimizer, requests_[1:], date)))
+    result["peak_memory_mb"] = _peak_memory(module, scenario, date, memory_requests)
+    return result
+
+
+def speedups(current: Dict, other: Dict) -> Dict[str, float]:
+    """
+    同じ規模の2つの結果について、段階ごとの p50 の速度比（other / current、1より大きければ current が速い）
+    """
+    return {
+        stage: round(other[stage]["p50_ms"] / current[stage]["p50_ms"], 2)
+        for stage in STAGES
+        if stage in current and stage in other and current[stage]["p50_ms"] > 0
+    }
+
+
+def compare(
+    current: Dict,
+    baseline: Dict,
+    threshold: float = 0.2,
+    p99_threshold: float = 0.5,
+    memory_threshold: float = 0.2
+) -> List[Dict]:
+    """
+    基準の結果と比較し、しきい値（相対変化）を超えて悪化した指標の一覧を返す
+
+    p99 は揺れが大きいため、p50・スループットとは別のしきい値を使う。
+    基準にない規模・段階は比較しない。
+    """
+    regressions = []
+    baseline_scales = {str(scale["workers"]): scale for scale in baseline.get("scales", [])}
+
+    def check(scale: str, stage: str, metric: str, now: float, before: float, limit: float, direction: int):
+        if not before:
+            return
+        change = (now - before) / before * direction
+        if change > limit:
+            regressions.append({
+                "workers": int(scale),
+                "stage": stage,
+                "metric": metric,
+                "baseline": before,
+                "current": now,
+                "change": round(change, 3),
+                "threshold": limit,
+            })
+
+    for result in current.get("scales", []):
+        scale = str(result["workers"])
+        before = baseline_scales.get(scale)
+        if before is None:
+            continue
+
+        for stage in STAGES:
+            if stage not in result or stage not in before:
+                continue
+            for metric, direction in METRICS.items():
+                limit = p99_threshold if metric == "p99_ms" else threshold
+                check(scale, stage, metric, result[stage][metric], before[stage][metric], limit, direction)
+
+        if "peak_memory_mb" in before:
+            check(scale, "memory", "peak_memory_mb", result["peak_memory_mb"], before["peak_memory_mb"],
+                  memory_threshold, 1)
+
+    return regressions
@@ -10,15 +10,34 @@ ZENBU AI Diagnosis Service
 - 対策提案
 """
 
-from fastapi import FastAPI, HTTPException, Depends
-from pydantic import BaseModel, Field
-from typing import Optional, List, Dict
+from fastapi import FastAPI, HTTPException, Depends, Request
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field, ValidationError
+from typing import Optional, List, Dict, Tuple, Callable, Awaitable, Iterable, AsyncIterator
+from collections import OrderedDict, deque
+import aiohttp
+import numpy as np
 import openai
 import os
 from datetime import datetime
+import asyncio
+import codecs
+import hashlib
 import json
+import logging
+import math
+import operator
+import re
+import shutil
+import sqlite3
+import threading
+import time
+import unicodedata
+import uuid
+import zlib
 
 app = FastAPI(title="AI Diagnosis Service")
+logger = logging.getLogger(__name__)
 
 # OpenAI API設定
 openai.api_key = os.getenv("OPENAI_API_KEY")
@@ -41,6 +60,13 @@ class DiagnosisRequest(BaseModel):
     session_id: str
     customer_id: Optional[str] = None
     symptoms: Symptoms
+    measurement_id: Optional[str] = Field(None, description="アップロード済みの騒音測定（実測値も判定に使う）")
+
+
+class MeasurementRequest(BaseModel):
+    """騒音測定（dB の時系列）の開始"""
+    started_at: datetime = Field(..., description="最初のサンプルの時刻（測定場所の現地時刻）")
+    interval_seconds: float = Field(1.0, gt=0, le=3600, description="サンプルの間隔（秒）")
 
 
 class DiagnosisResponse(BaseModel):
@@ -60,6 +86,11 @@ class PriceEstimator:
 
     BASE_PRICE = 8800
     REPORT_FEE = 3000
+    NIGHT_MEASUREMENT_FEE = 8000
+    LONG_TERM_MEASUREMENT_FEE = 15000
+    STANDARD_MEASUREMENT_FEE = 5000
+    URGENCY_FEE = 5000
+    ADDITIONAL_MEASUREMENT_FEE = 5000
 
     @classmethod
     def calculate(cls, symptoms: Symptoms, urgency: str) -> Dict[str, int]:
@@ -72,41 +103,1359 @@ class PriceEstimator:
         - レポート作成料: 3,000円
         - 緊急対応料金: 5,000円
         """
-        base = cls.BASE_PRICE
         measurement_fee = 0
-        report_fee = cls.REPORT_FEE
         urgency_fee = 0
 
         # 測定時間による加算
         if symptoms.time_of_day == "night":
-            measurement_fee = 8000  # 夜間測定
+            measurement_fee = cls.NIGHT_MEASUREMENT_FEE  # 夜間測定
         elif symptoms.duration_weeks and symptoms.duration_weeks > 4:
-            measurement_fee = 15000  # 長期測定が必要
+            measurement_fee = cls.LONG_TERM_MEASUREMENT_FEE  # 長期測定が必要
         else:
-            measurement_fee = 5000  # 標準測定
+            measurement_fee = cls.STANDARD_MEASUREMENT_FEE  # 標準測定
 
         # 緊急対応料金
         if urgency == "high":
-            urgency_fee = 5000
+            urgency_fee = cls.URGENCY_FEE
+
+        return cls._estimate(measurement_fee, urgency_fee)
+
+    @classmethod
+    def calculate_columns(cls, columns: Dict[str, Iterable], urgency: Iterable[str]) -> List[Dict[str, int]]:
+        """
+        列ごとの配列（DiagnosisEngine.symptom_columns の形式）と緊急度の配列からまとめて計算
 
-        min_price = base + measurement_fee + report_fee + urgency_fee
-        max_price = min_price + 5000  # 追加測定の可能性
+        結果は1件ずつ calculate した場合と同じ
+        """
+        night = np.asarray(columns["time_of_day"], dtype=object) == "night"
+        duration = np.nan_to_num(np.asarray(columns["duration_weeks"], dtype=float), nan=0.0)
+        measurement = np.where(
+            night,
+            cls.NIGHT_MEASUREMENT_FEE,
+            np.where(duration > 4, cls.LONG_TERM_MEASUREMENT_FEE, cls.STANDARD_MEASUREMENT_FEE)
+        )
+        urgency_fee = np.where(np.asarray(urgency, dtype=object) == "high", cls.URGENCY_FEE, 0)
+        return [
+            cls._estimate(measurement_fee, fee)
+            for measurement_fee, fee in zip(measurement.tolist(), urgency_fee.tolist())
+        ]
+
+    @classmethod
+    def _estimate(cls, measurement_fee: int, urgency_fee: int) -> Dict[str, int]:
+        min_price = cls.BASE_PRICE + measurement_fee + cls.REPORT_FEE + urgency_fee
+        max_price = min_price + cls.ADDITIONAL_MEASUREMENT_FEE  # 追加測定の可能性
 
         return {
             "min": min_price,
             "max": max_price,
             "breakdown": {
-                "base": base,
+                "base": cls.BASE_PRICE,
                 "measurement": measurement_fee,
-                "report": report_fee,
+                "report": cls.REPORT_FEE,
                 "urgency": urgency_fee
             }
         }
 
 
+class RecommendationCache:
+    """
+    対策提案のキャッシュ
+
+    GPT-4 へのプロンプトは症状・評価の少数の項目だけで決まるため、
+    正規化したプロンプトの入力をキーに生成結果を再利用する。
+    - メモリ: LRU（max_entries 件）＋有効期限（ttl_seconds）
+    - ディスク: path を指定した場合は SQLite にも保存し、再起動後も有効期限内なら再利用
+      （読み書きはイベントループを止めないよう asyncio.to_thread で行う）
+    - 同じキーの生成が実行中なら、その結果を待つ（上流への呼び出しは1回）
+
+    返す一覧は毎回コピーなので、呼び出し側で変更してもキャッシュには影響しない。
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 86400, path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.path = path
+        # キー -> (有効期限の時刻, 対策提案)。末尾が最近使ったもの
+        self._entries: "OrderedDict[str, Tuple[float, List[str]]]" = OrderedDict()
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        self.stats = {
+            "hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "coalesced": 0,
+            "errors": 0,
+            "expired": 0,
+            "evictions": 0
+        }
+
+    @staticmethod
+    def key(inputs: Dict) -> str:
+        payload = json.dumps(inputs, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _connect(self) -> Optional[sqlite3.Connection]:
+        """ディスクのキャッシュを開く（初回のみ。期限切れの行はこのとき削除）"""
+        if self.path and self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS recommendations ("
+                "key TEXT PRIMARY KEY, expires_at REAL NOT NULL, recommendations TEXT NOT NULL)"
+            )
+            self._db.execute("DELETE FROM recommendations WHERE expires_at <= ?", (time.time(),))
+            self._db.commit()
+        return self._db
+
+    async def get(self, key: str) -> Optional[List[str]]:
+        """有効期限内のキャッシュ（メモリ、なければディスク）"""
+        now = time.time()
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] > now:
+                self._entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return list(entry[1])
+            del self._entries[key]
+            self.stats["expired"] += 1
+
+        if self.path:
+            row = await asyncio.to_thread(self._read, key)
+            if row is not None and row[0] > now:
+                recommendations = json.loads(row[1])
+                self._remember(key, row[0], recommendations)
+                self.stats["disk_hits"] += 1
+                return list(recommendations)
+
+        return None
+
+    def _remember(self, key: str, expires_at: float, recommendations: List[str]):
+        self._entries[key] = (expires_at, list(recommendations))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    async def put(self, key: str, recommendations: List[str]):
+        expires_at = time.time() + self.ttl_seconds
+        self._remember(key, expires_at, recommendations)
+
+        if self.path:
+            await asyncio.to_thread(
+                self._write, key, expires_at, json.dumps(recommendations, ensure_ascii=False)
+            )
+
+    def _read(self, key: str) -> Optional[Tuple[float, str]]:
+        """ディスクの行（ワーカースレッドで実行）"""
+        with self._db_lock:
+            return self._connect().execute(
+                "SELECT expires_at, recommendations FROM recommendations WHERE key = ?", (key,)
+            ).fetchone()
+
+    def _write(self, key: str, expires_at: float, payload: str):
+        """ディスクに保存（ワーカースレッドで実行）"""
+        with self._db_lock:
+            db = self._connect()
+            db.execute("INSERT OR REPLACE INTO recommendations VALUES (?, ?, ?)", (key, expires_at, payload))
+            db.commit()
+
+    async def get_or_load(self, key: str, loader: Callable[[], Awaitable[List[str]]]) -> List[str]:
+        """
+        キャッシュがあればそれを、なければ loader() の結果を返す
+
+        生成は独立したタスクで行うため、最初に要求したリクエストが切断されても
+        待っている他のリクエストには結果が届く。失敗（例外）と空の結果はキャッシュしない。
+        """
+        cached = await self.get(key)
+        if cached is not None:
+            return cached
+
+        shared = self._in_flight.get(key)
+        if shared is None:
+            self.stats["misses"] += 1
+            shared = asyncio.ensure_future(self._load(key, loader))
+            self._in_flight[key] = shared
+            shared.add_done_callback(lambda task: self._done(key, task))
+        else:
+            self.stats["coalesced"] += 1
+
+        return list(await asyncio.shield(shared))
+
+    async def _load(self, key: str, loader: Callable[[], Awaitable[List[str]]]) -> List[str]:
+        try:
+            recommendations = await loader()
+        except Exception:
+            self.stats["errors"] += 1
+            raise
+        if recommendations:
+            await self.put(key, recommendations)
+        return recommendations
+
+    def _done(self, key: str, task: asyncio.Future):
+        self._in_flight.pop(key, None)
+        # 待っているリクエストがすべて切断された場合も例外を回収しておく
+        if not task.cancelled():
+            task.exception()
+
+    def summary(self) -> Dict:
+        """件数と、上流を呼ばずに済んだ割合（キャッシュ・実行中の生成への合流）"""
+        lookups = self.stats["hits"] + self.stats["disk_hits"] + self.stats["misses"] + self.stats["coalesced"]
+        served = lookups - self.stats["misses"]
+        return {
+            **self.stats,
+            "entries": len(self._entries),
+            "in_flight": len(self._in_flight),
+            "hit_ratio": round(served / lookups, 4) if lookups else 0.0,
+            "disk": self.path
+        }
+
+    def close(self):
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+class LLMUnavailableError(Exception):
+    """OpenAI API を呼び出せない（期限切れ・サーキットブレーカーが開いている）"""
+
+
+class CircuitBreaker:
+    """
+    上流の障害が続いている間は呼び出しを止める
+
+    - closed: 通常。連続 failure_threshold 回失敗すると open
+    - open: reset_seconds 秒の間は呼び出さない
+    - half_open: その後の1回だけ試し、成功すれば closed、失敗すれば再び open
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_seconds: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self.stats = {"opened": 0, "rejected": 0}
+
+    def allow(self) -> bool:
+        """呼び出してよいか（half_open では試しの1回だけ許可）"""
+        if self.state == "open":
+            if time.monotonic() - self._opened_at < self.reset_seconds:
+                self.stats["rejected"] += 1
+                return False
+            self.state = "half_open"
+
+        if self.state == "half_open":
+            if self._probing:
+                self.stats["rejected"] += 1
+                return False
+            self._probing = True
+        return True
+
+    def record_success(self):
+        self.state = "closed"
+        self._failures = 0
+        self._probing = False
+
+    def record_failure(self):
+        self._failures += 1
+        self._probing = False
+        if self.state == "half_open" or self._failures >= self.failure_threshold:
+            if self.state != "open":
+                self.stats["opened"] += 1
+            self.state = "open"
+            self._opened_at = time.monotonic()
+
+    def release(self):
+        """結果が出ないまま呼び出しが取り消された（試しの枠だけ戻す）"""
+        self._probing = False
+
+
+class LLMClient:
+    """
+    OpenAI API（ChatCompletion）の呼び出し
+
+    - 接続: aiohttp のセッションを1つ共有し、接続（最大 pool_size 本）を使い回す
+    - 同時呼び出し: max_in_flight 件まで（超えた分は空くまで待つ）
+    - 期限: 1回の呼び出しは、待ち時間・やり直しを含めて deadline_seconds 秒まで
+    - ヘッジ: 最初の試行が直近の応答時間の p95 を過ぎても返らなければ2本目を並行して送り、
+      先に成功した方を使う（同時呼び出しの枠が空いていなければ送らない）。
+      応答時間の記録が MIN_LATENCY_SAMPLES 件に満たない間は hedge_delay_seconds を使う。
+      最初の試行がそれより早く失敗した場合は、期限内なら1回だけやり直す
+    - サーキットブレーカー: 障害が続いている間は呼び出さずに LLMUnavailableError
+      （呼び出し側はすぐにフォールバックに切り替える）
+    """
+
+    LATENCY_WINDOW = 200
+    MIN_LATENCY_SAMPLES = 20
+    MIN_HEDGE_DELAY_SECONDS = 0.05
+
+    def __init__(
+        self,
+        pool_size: int = 32,
+        max_in_flight: int = 16,
+        deadline_seconds: float = 10.0,
+        hedge_delay_seconds: float = 2.0,
+        breaker: Optional[CircuitBreaker] = None
+    ):
+        self.pool_size = pool_size
+        self.max_in_flight = max_in_flight
+        self.deadline_seconds = deadline_seconds
+        self.hedge_delay_seconds = hedge_delay_seconds
+        self.breaker = breaker or CircuitBreaker()
+        self._limit = asyncio.Semaphore(max_in_flight)
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._latencies: deque = deque(maxlen=self.LATENCY_WINDOW)
+        self._in_flight = 0
+        self.stats = {
+            "calls": 0,
+            "succeeded": 0,
+            "failed": 0,
+            "timeouts": 0,
+            "rejected": 0,
+            "hedges": 0,
+            "hedge_wins": 0,
+            "retries": 0
+        }
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60)
+            )
+        return self._session
+
+    def hedge_delay(self) -> float:
+        """2本目を送るまでの待ち時間（直近の成功した試行の応答時間の p95）"""
+        if len(self._latencies) < self.MIN_LATENCY_SAMPLES:
+            return self.hedge_delay_seconds
+        ordered = sorted(self._latencies)
+        return max(self.MIN_HEDGE_DELAY_SECONDS, ordered[int((len(ordered) - 1) * 0.95)])
+
+    async def chat_completion(self, **params):
+        """openai.ChatCompletion.acreate と同じ引数・戻り値（失敗時は例外）"""
+        self.stats["calls"] += 1
+        if not self.breaker.allow():
+            self.stats["rejected"] += 1
+            raise LLMUnavailableError("OpenAI API の障害が続いているため呼び出しを止めています")
+
+        try:
+            response = await asyncio.wait_for(
+                self._hedged(params, time.monotonic() + self.deadline_seconds),
+                self.deadline_seconds
+            )
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            self.breaker.record_failure()
+            raise LLMUnavailableError(f"{self.deadline_seconds}秒以内に応答がありません")
+        except asyncio.CancelledError:
+            self.breaker.release()
+            raise
+        except Exception:
+            self.stats["failed"] += 1
+            self.breaker.record_failure()
+            raise
+
+        self.stats["succeeded"] += 1
+        self.breaker.record_success()
+        return response
+
+    async def _hedged(self, params: Dict, deadline: float):
+        first = asyncio.ensure_future(self._attempt(params, deadline))
+        attempts = [first]
+        pending = {first}
+        second_considered = False
+        error: Optional[BaseException] = None
+
+        try:
+            while pending:
+                timeout = None if second_considered else self.hedge_delay()
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                for task in done:
+                    if task.exception() is None:
+                        if task is not first:
+                            self.stats["hedge_wins"] += 1
+                        return task.result()
+                    error = task.exception()
+
+                if second_considered or time.monotonic() >= deadline:
+                    continue
+                second_considered = True
+                if done:
+                    # 最初の試行が失敗した（やり直し）
+                    self.stats["retries"] += 1
+                elif self._limit.locked():
+                    # p95 を過ぎたが、同時呼び出しの枠が空いていない（ヘッジで負荷を増やさない）
+                    continue
+                else:
+                    self.stats["hedges"] += 1
+                second = asyncio.ensure_future(self._attempt(params, deadline))
+                attempts.append(second)
+                pending.add(second)
+
+            raise error
+        finally:
+            for task in attempts:
+                task.cancel()
+
+    async def _attempt(self, params: Dict, deadline: float):
+        async with self._limit:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise asyncio.TimeoutError()
+
+            self._in_flight += 1
+            token = openai.aiosession.set(self._get_session())
+            started = time.monotonic()
+            try:
+                response = await openai.ChatCompletion.acreate(request_timeout=remaining, **params)
+            finally:
+                openai.aiosession.reset(token)
+                self._in_flight -= 1
+
+            self._latencies.append(time.monotonic() - started)
+            return response
+
+    async def stream_chat_completion(self, **params) -> AsyncIterator[str]:
+        """
+        ストリーミングで呼び出し、応答の本文を届いた分ずつ返す（失敗時は例外）
+
+        接続・同時呼び出しの枠・サーキットブレーカーは chat_completion と共通。
+        上流の応答は別のタスクで最後まで読んでキューに入れるため、同時呼び出しの枠と
+        期限（最後の差分が届くまで deadline_seconds 秒）は上流とのやり取りの間だけ使い、
+        呼び出し側の読み出しが遅くても上流の失敗には数えない。
+        途中まで返した応答に2本目を混ぜられないためヘッジ・やり直しはしない
+        """
+        self.stats["calls"] += 1
+        if not self.breaker.allow():
+            self.stats["rejected"] += 1
+            raise LLMUnavailableError("OpenAI API の障害が続いているため呼び出しを止めています")
+
+        received: asyncio.Queue = asyncio.Queue()
+        reader = asyncio.ensure_future(self._read_stream(params, received))
+        # 呼び出し側が途中でやめた後に失敗した場合も例外を回収しておく
+        reader.add_done_callback(lambda task: task.cancelled() or task.exception())
+        try:
+            while True:
+                content = await received.get()
+                if content is None:
+                    break
+                yield content
+            # 上流の失敗はここで送出する
+            await reader
+        finally:
+            # 呼び出し側が途中でやめた場合は上流の読み込みも止める
+            reader.cancel()
+
+    async def _read_stream(self, params: Dict, received: asyncio.Queue):
+        """上流のストリーミング応答を最後まで読み、本文の差分を received に入れる（終わりに None）"""
+        deadline = time.monotonic() + self.deadline_seconds
+        acquired = False
+        chunks = None
+        try:
+            await asyncio.wait_for(self._limit.acquire(), self.deadline_seconds)
+            acquired = True
+            self._in_flight += 1
+
+            token = openai.aiosession.set(self._get_session())
+            try:
+                remaining = deadline - time.monotonic()
+                chunks = await asyncio.wait_for(
+                    openai.ChatCompletion.acreate(stream=True, request_timeout=remaining, **params),
+                    remaining
+                )
+            finally:
+                openai.aiosession.reset(token)
+
+            iterator = chunks.__aiter__()
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError()
+                try:
+                    chunk = await asyncio.wait_for(iterator.__anext__(), remaining)
+                except StopAsyncIteration:
+                    break
+                content = chunk.choices[0].delta.get("content") if chunk.choices else None
+                if content:
+                    received.put_nowait(content)
+
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            self.breaker.record_failure()
+            raise LLMUnavailableError(f"{self.deadline_seconds}秒以内に応答が終わりません")
+        except asyncio.CancelledError:
+            self.breaker.release()
+            raise
+        except Exception:
+            self.stats["failed"] += 1
+            self.breaker.record_failure()
+            raise
+        else:
+            self.stats["succeeded"] += 1
+            self.breaker.record_success()
+        finally:
+            received.put_nowait(None)
+            if chunks is not None and hasattr(chunks, "aclose"):
+                await chunks.aclose()
+            if acquired:
+                self._in_flight -= 1
+                self._limit.release()
+
+    def summary(self) -> Dict:
+        return {
+            **self.stats,
+            "in_flight": self._in_flight,
+            "hedge_delay_seconds": round(self.hedge_delay(), 3),
+            "circuit": {"state": self.breaker.state, **self.breaker.stats}
+        }
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+class DecisionTable:
+    """
+    判定ルール（URGENCY_RULES など）を入力の区分ごとの判定表にコンパイルしたもの
+
+    ルールが参照する項目は列挙値と継続週数だけなので、項目ごとに値を区分に分け、
+    全区分の組み合わせ（320通り）について起動時にルールを1回ずつ評価しておく。
+    判定は区分の番号から表を1回引くだけになる。
+    区分の代表値以外の値でも結果が変わらないことを起動時に確かめ、
+    ルールが区分にない値・項目を使うようになった場合は ValueError にする
+    （その場合は CATEGORIES・DURATION_BUCKETS に追加する）。
+    """
+
+    LEVELS = ("low", "medium", "high")
+
+    # 列挙値の項目と、ルールが比較する値（それ以外の値・未入力は最後の区分）
+    CATEGORIES = {
+        "time_of_day": ("night",),
+        "noise_type": ("construction", "footsteps", "music", "voice"),
+        "frequency": ("daily",),
+        "impact_level": ("severe",)
+    }
+
+    # 継続週数の区分（ルールの境目 >1・>2・>=2・>=4 による）: 1以下・未入力 / 2 / 3 / 4以上
+    DURATION_BUCKETS = 4
+
+    # 入力の値の組 -> 判定 の記憶件数の上限（自由入力の値で増え続けないように）
+    MEMO_SIZE = 4096
+
+    # 区分ごとに結果が変わらないことを確かめる値
+    _OTHER_VALUES = (None, "", "other")
+    _DURATION_VALUES = ((None, 0, 1, -1), (2,), (3,), (4, 5, 52))
+    _CONTACTED_VALUES = ((None, False), (True,))
+
+    def __init__(self, rules: Dict[str, List[Callable]]):
+        self.fields = list(self.CATEGORIES)
+        self.shape = tuple(len(values) + 1 for values in self.CATEGORIES.values()) + (2, self.DURATION_BUCKETS)
+        self.table = np.zeros(self.shape, dtype=np.uint8)
+
+        for index in np.ndindex(self.shape):
+            results = {self._evaluate(rules, symptoms) for symptoms in self._samples(index)}
+            if len(results) != 1:
+                raise ValueError(f"ルールが判定表の区分で表せない値を参照しています: {index}")
+            self.table[index] = results.pop()
+
+        self._flat = [self.LEVELS[level] for level in self.table.ravel()]
+        # 区分の番号 -> 表の通し番号の重み
+        self._strides = [int(np.prod(self.shape[i + 1:])) for i in range(len(self.shape))]
+        self._codes = [
+            {value: code for code, value in enumerate(values)}
+            for values in self.CATEGORIES.values()
+        ]
+        self._key = operator.attrgetter(*self.fields, "contacted_management", "duration_weeks")
+        self._memo: Dict[tuple, str] = {}
+
+    def _samples(self, index: Tuple[int, ...]) -> Iterable[Symptoms]:
+        """区分の組み合わせに属する症状（各項目の区分の値を1つずつ入れ替えたもの）"""
+        *categories, contacted, duration = index
+        choices = [
+            values[code:code + 1] if code < len(values) else self._OTHER_VALUES
+            for code, values in zip(categories, self.CATEGORIES.values())
+        ]
+        choices.append(self._CONTACTED_VALUES[contacted])
+        choices.append(self._DURATION_VALUES[duration])
+
+        base = [values[0] for values in choices]
+        names = self.fields + ["contacted_management", "duration_weeks"]
+        for position, values in enumerate(choices):
+            for value in values:
+                fields = dict(zip(names, base))
+                fields[names[position]] = value
+                yield Symptoms.model_construct(**fields)
+
+    @classmethod
+    def _evaluate(cls, rules: Dict[str, List[Callable]], symptoms: Symptoms) -> int:
+        for level in ("high", "medium"):
+            if any(rule(symptoms) for rule in rules.get(level, ())):
+                return cls.LEVELS.index(level)
+        return 0
+
+    def evaluate(self, symptoms: Symptoms) -> str:
+        """1件の判定（"low" / "medium" / "high"）。入力の値の組ごとに表を引いた結果を記憶する"""
+        key = self._key(symptoms)
+        level = self._memo.get(key)
+        if level is None:
+            level = self._flat[self._position(key)]
+            if len(self._memo) < self.MEMO_SIZE:
+                self._memo[key] = level
+        return level
+
+    def _position(self, key: tuple) -> int:
+        """入力の値の組 -> 表の通し番号"""
+        *categories, contacted, duration = key
+        position = 0
+        for value, codes, stride in zip(categories, self._codes, self._strides):
+            position += codes.get(value, len(codes)) * stride
+        position += bool(contacted) * self._strides[-2]
+        position += min(max(duration or 0, 1), self.DURATION_BUCKETS) - 1
+        return position
+
+    def evaluate_columns(self, columns: Dict[str, Iterable]) -> np.ndarray:
+        """列ごとの配列からまとめて判定し、LEVELS の番号（uint8）の配列を返す"""
+        return self.table.ravel()[self.positions(columns)]
+
+    def positions(self, columns: Dict[str, Iterable]) -> np.ndarray:
+        """
+        列ごとの配列 -> 表の通し番号の配列（区分が同じ判定表どうしでは共通）
+
+        列挙値の列は文字列（未入力は None）、contacted_management は真偽値、
+        duration_weeks は整数の週数（未入力は None / NaN）。渡さなかった列は未入力とみなす
+        """
+        size = max(len(column) for column in columns.values())
+        position = np.zeros(size, dtype=np.int64)
+
+        for field, values, stride in zip(self.fields, self.CATEGORIES.values(), self._strides):
+            column = np.asarray(columns.get(field, [None] * size), dtype=object)
+            codes = np.full(size, len(values), dtype=np.int64)
+            for code, value in enumerate(values):
+                codes[column == value] = code
+            position += codes * stride
+
+        contacted = np.asarray(columns.get("contacted_management", [None] * size), dtype=object).astype(bool)
+        duration = np.nan_to_num(
+            np.asarray(columns.get("duration_weeks", [None] * size), dtype=float), nan=0.0
+        ).astype(np.int64)
+        position += contacted * self._strides[-2]
+        position += np.clip(duration, 1, self.DURATION_BUCKETS) - 1
+        return position
+
+
+class SimilarCaseIndex:
+    """
+    過去の診断と、そのとき送った対策提案の類似検索（外部サービスを使わないローカルの索引）
+
+    症状の説明文の文字 n-gram（NGRAMS 文字）とプロンプトに使う項目を特徴量ハッシュにし、
+    ランダムな超平面による符号（SimHash, SIGNATURE_BITS ビット）に縮めて持つ。
+    類似度は符号の一致率から推定したコサイン類似度（説明文と項目をそれぞれ正規化して同じ重みで足したもの）。
+    近似最近傍は LSH で、符号の先頭 BANDS×BAND_BITS ビットを BANDS 個の帯に分け、
+    緊急度・法的リスクの組が同じで、どれかの帯の値が一致する事例だけを候補にする
+    （緊急度・法的リスクの異なる事例の提案は使わない）。
+    騒音タイプ・発生時間は自由入力なので帯には含めず、事例ごとにその組のハッシュ（enums）を持ち、
+    一致しない候補を除く（説明文が同じでも、騒音タイプの異なる事例の提案は使わない）。
+
+    - 保存: path のディレクトリに、統合済みの事例（.npy, 起動時に mmap で読み込む）と、
+      その後に追加した事例の追記ログ（pending.jsonl, 起動時にメモリに読み込む）
+    - 追加: 追記ログとメモリ上の差分に入れ、compact_every 件たまるとバックグラウンドで統合済みの側に書き出す
+      （None ならまとめて追加した後に compact() を呼ぶ）
+    """
+
+    SIGNATURE_BITS = 256
+    BANDS = 21
+    BAND_BITS = 12
+    NGRAMS = (2, 3)
+    FEATURE_BUCKETS = 1 << 15
+    SEED = 20240127
+
+    # 1つの帯の値に集まった事例が多い場合は、新しいものからこの件数だけ候補にする
+    MAX_BUCKET_CANDIDATES = 512
+
+    COMPACT_EVERY = 50000
+
+    _WORDS = SIGNATURE_BITS // 64
+    _KEYS = len(DecisionTable.LEVELS) ** 2 << BAND_BITS
+    _IGNORED = re.compile(r"[\W_]+")
+
+    # np.bitwise_count は NumPy 2.0 から。それより前は8ビットごとの表で数える
+    _POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+    def __init__(self, path: Optional[str] = None, threshold: float = 0.85, compact_every: Optional[int] = COMPACT_EVERY):
+        self.path = path
+        self.threshold = threshold
+        self.compact_every = compact_every
+        # 特徴量のバケットごとの ±1（固定の乱数なので、作り直しても同じ符号になる）
+        planes = np.random.default_rng(self.SEED).integers(
+            0, 2, size=(self.FEATURE_BUCKETS, self.SIGNATURE_BITS), dtype=np.int8
+        )
+        self._planes = planes * 2 - 1
+        self._band_weights = 1 << np.arange(self.BAND_BITS - 1, -1, -1)
+        self._lock = threading.Lock()
+        self._compacting = threading.Lock()
+        self._log = None
+        self.stats = {"hits": 0, "misses": 0, "adds": 0, "compactions": 0}
+
+        self._base = self._empty_base()
+        self._reset_delta()
+        if path:
+            os.makedirs(path, exist_ok=True)
+            current = self._current_base_dir()
+            if current is not None:
+                self._base = self._load_base(current)
+            self._replay(os.path.join(path, "pending.jsonl"))
+            self._log = open(os.path.join(path, "pending.jsonl"), "a", encoding="utf-8")
+
+    # --- 符号 ---
+
+    def features(self, symptoms: Symptoms, inputs: Dict) -> Dict[int, float]:
+        """特徴量ハッシュ（バケット -> 重み）。説明文・項目のどちらもなければ空"""
+        text = self._IGNORED.sub("", unicodedata.normalize("NFKC", symptoms.description or "").lower())
+        grams: Dict[str, int] = {}
+        for n in self.NGRAMS:
+            for i in range(len(text) - n + 1):
+                gram = text[i:i + n]
+                grams[gram] = grams.get(gram, 0) + 1
+
+        fields = [
+            f"{name}={value}" for name, value in inputs.items()
+            if name not in ("urgency", "legal_risk") and value not in (None, False)
+        ]
+
+        features: Dict[int, float] = {}
+        for weights in (
+            {gram: math.log1p(count) for gram, count in grams.items()},
+            {field: 1.0 for field in fields}
+        ):
+            norm = math.sqrt(sum(w * w for w in weights.values()))
+            for token, weight in weights.items():
+                bucket = zlib.crc32(token.encode()) & (self.FEATURE_BUCKETS - 1)
+                features[bucket] = features.get(bucket, 0.0) + weight / norm
+        return features
+
+    def signature(self, features: Dict[int, float]) -> np.ndarray:
+        """特徴量 -> 符号（uint64 × SIGNATURE_BITS/64）"""
+        buckets = np.fromiter(features.keys(), dtype=np.int64, count=len(features))
+        weights = np.fromiter(features.values(), dtype=np.float32, count=len(features))
+        projection = weights @ self._planes[buckets]
+        return np.packbits(projection > 0).view(np.uint64)
+
+    def _band_keys(self, signatures: np.ndarray, partitions: np.ndarray) -> np.ndarray:
+        """符号 (n, WORDS) -> 帯ごとのバケット (n, BANDS)。緊急度・法的リスクの組を上位に含む"""
+        bits = np.unpackbits(signatures.view(np.uint8).reshape(len(signatures), -1), axis=1)
+        bands = bits[:, :self.BANDS * self.BAND_BITS].reshape(len(signatures), self.BANDS, self.BAND_BITS)
+        values = bands @ self._band_weights
+        return (partitions.astype(np.int64)[:, None] << self.BAND_BITS) | values
+
+    @staticmethod
+    def _partition(urgency: str, legal_risk: str) -> int:
+        levels = DecisionTable.LEVELS
+        return levels.index(urgency) * len(levels) + levels.index(legal_risk)
+
+    @staticmethod
+    def _enums(inputs: Dict) -> int:
+        """騒音タイプ・発生時間の組のハッシュ（正規化した値から）"""
+        return zlib.crc32(json.dumps([inputs["noise_type"], inputs["time_of_day"]]).encode())
+
+    @classmethod
+    def _bit_counts(cls, words: np.ndarray) -> np.ndarray:
+        """uint64 ごとの立っているビット数（同じ形）"""
+        if hasattr(np, "bitwise_count"):
+            return np.bitwise_count(words)
+        return cls._POPCOUNT[words.view(np.uint8)].reshape(*words.shape, 8).sum(axis=-1, dtype=np.uint8)
+
+    @classmethod
+    def _distances(cls, signatures: np.ndarray, signature: np.ndarray) -> np.ndarray:
+        """符号ごとの異なるビット数（列ごとに足す方が sum(axis=1) より速い）"""
+        counts = cls._bit_counts(signatures ^ signature)
+        distances = counts[:, 0].astype(np.int64)
+        for word in range(1, counts.shape[1]):
+            distances += counts[:, word]
+        return distances
+
+    # --- 検索 ---
+
+    def search(self, symptoms: Symptoms, urgency: str, legal_risk: str, k: int = 5) -> List[Tuple[float, List[str]]]:
+        """類似度の高い順に最大 k 件の (類似度, 対策提案)"""
+        inputs = DiagnosisEngine.prompt_inputs(symptoms, urgency, legal_risk)
+        features = self.features(symptoms, inputs)
+        if not features:
+            return []
+        return self.search_signature(
+            self.signature(features), self._partition(urgency, legal_risk), self._enums(inputs), k
+        )
+
+    def search_signature(
+        self,
+        signature: np.ndarray,
+        partition: int,
+        enums: int,
+        k: int = 5
+    ) -> List[Tuple[float, List[str]]]:
+        """符号・緊急度と法的リスクの組・騒音タイプと発生時間の組で検索（search の本体）"""
+        keys = self._band_keys(signature[None, :], np.array([partition]))[0]
+
+        with self._lock:
+            base = self._base
+            candidates = []
+            for band, key in enumerate(keys.tolist()):
+                start, end = base["band_offsets"][band, key:key + 2].tolist()
+                candidates.append(base["band_ids"][band, max(start, end - self.MAX_BUCKET_CANDIDATES):end])
+            # 複数の帯で一致した事例は重複したまま距離を計算し、並べた後で除く（unique より速い）
+            ids = np.concatenate(candidates).astype(np.int64)
+            ids = ids[base["enums"][ids] == enums]
+            distances = self._distances(base["signatures"][ids], signature)
+
+            delta_ids = [
+                i for band, key in enumerate(keys.tolist()) for i in self._delta_buckets[band].get(key, ())
+                if self._delta_enums[i] == enums
+            ]
+            if delta_ids:
+                delta_ids = np.array(delta_ids, dtype=np.int64)
+                ids = np.concatenate([ids, len(base["signatures"]) + delta_ids])
+                distances = np.concatenate([distances, self._distances(self._delta_signatures[delta_ids], signature)])
+
+            # 重複を除いても k 件残るだけ近いものを選んでから並べる
+            nearest = np.arange(len(ids))
+            if len(ids) > k * self.BANDS:
+                nearest = np.argpartition(distances, k * self.BANDS - 1)[:k * self.BANDS]
+            found, seen = [], set()
+            for i in nearest[np.argsort(distances[nearest], kind="stable")].tolist():
+                case_id = int(ids[i])
+                if case_id in seen:
+                    continue
+                seen.add(case_id)
+                similarity = round(math.cos(math.pi * distances[i] / self.SIGNATURE_BITS), 4)
+                found.append((similarity, self._recommendations(base, case_id)))
+                if len(found) == k:
+                    break
+            return found
+
+    def lookup(self, symptoms: Symptoms, urgency: str, legal_risk: str) -> Optional[List[str]]:
+        """類似度が threshold 以上の事例があればその対策提案"""
+        found = self.search(symptoms, urgency, legal_risk, k=1)
+        if found and found[0][0] >= self.threshold:
+            self.stats["hits"] += 1
+            return found[0][1]
+        self.stats["misses"] += 1
+        return None
+
+    def _recommendations(self, base: Dict, case_id: int) -> List[str]:
+        size = len(base["signatures"])
+        if case_id >= size:
+            return self._delta_recommendations[case_id - size]
+        start, end = base["recommendation_offsets"][case_id:case_id + 2].tolist()
+        return json.loads(bytes(base["recommendation_data"][start:end]))
+
+    # --- 追加 ---
+
+    def add(self, symptoms: Symptoms, urgency: str, legal_risk: str, recommendations: List[str]):
+        """事例を追加（説明文・項目のどちらもない症状は追加しない）"""
+        inputs = DiagnosisEngine.prompt_inputs(symptoms, urgency, legal_risk)
+        features = self.features(symptoms, inputs)
+        if not features or not recommendations:
+            return
+        signature = self.signature(features)
+        partition = self._partition(urgency, legal_risk)
+        enums = self._enums(inputs)
+
+        with self._lock:
+            self._append_delta(signature, partition, enums, recommendations)
+            if self._log is not None:
+                self._log.write(json.dumps({
+                    "signature": signature.tolist(),
+                    "partition": partition,
+                    "enums": enums,
+                    "recommendations": recommendations
+                }, ensure_ascii=False) + "\n")
+                self._log.flush()
+        self.stats["adds"] += 1
+
+        if (
+            self.compact_every is not None
+            and self._delta_size >= self.compact_every
+            and not self._compacting.locked()
+        ):
+            threading.Thread(target=self.compact, daemon=True).start()
+
+    def _reset_delta(self):
+        self._delta_signatures = np.zeros((1024, self._WORDS), dtype=np.uint64)
+        self._delta_size = 0
+        self._delta_partitions: List[int] = []
+        self._delta_enums: List[int] = []
+        self._delta_recommendations: List[List[str]] = []
+        self._delta_buckets: List[Dict[int, List[int]]] = [{} for _ in range(self.BANDS)]
+
+    def _append_delta(self, signature: np.ndarray, partition: int, enums: int, recommendations: List[str]):
+        if self._delta_size == len(self._delta_signatures):
+            self._delta_signatures = np.concatenate([self._delta_signatures, np.zeros_like(self._delta_signatures)])
+        case_id = self._delta_size
+        self._delta_signatures[case_id] = signature
+        self._delta_size += 1
+        self._delta_partitions.append(partition)
+        self._delta_enums.append(enums)
+        self._delta_recommendations.append(recommendations)
+        keys = self._band_keys(signature[None, :], np.array([partition]))[0]
+        for band, key in enumerate(keys.tolist()):
+            self._delta_buckets[band].setdefault(key, []).append(case_id)
+
+    def _replay(self, log_path: str):
+        if not os.path.exists(log_path):
+            return
+        with open(log_path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    case = json.loads(line)
+                except ValueError:
+                    continue  # 書き込み途中で止まった行
+                self._append_delta(
+                    np.array(case["signature"], dtype=np.uint64),
+                    case["partition"],
+                    case["enums"],
+                    case["recommendations"]
+                )
+
+    # --- 統合・保存 ---
+
+    def _empty_base(self) -> Dict:
+        return {
+            "signatures": np.zeros((0, self._WORDS), dtype=np.uint64),
+            "partitions": np.zeros(0, dtype=np.uint8),
+            "enums": np.zeros(0, dtype=np.uint32),
+            "band_offsets": np.zeros((self.BANDS, self._KEYS + 1), dtype=np.int64),
+            "band_ids": np.zeros((self.BANDS, 0), dtype=np.uint32),
+            "recommendation_offsets": np.zeros(1, dtype=np.int64),
+            "recommendation_data": np.zeros(0, dtype=np.uint8)
+        }
+
+    def _current_base_dir(self) -> Optional[str]:
+        current = os.path.join(self.path, "CURRENT")
+        if not os.path.exists(current):
+            return None
+        with open(current) as f:
+            return os.path.join(self.path, f.read().strip())
+
+    def _load_base(self, directory: str) -> Dict:
+        """
+        統合済みの事例を mmap で開く（帯ごとの区切りだけはメモリに読み込む）
+
+        np.memmap は切り出すたびに memmap を作り直して遅いため、同じ領域を指す ndarray にして持つ
+        """
+        base = {
+            name: np.asarray(np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r"))
+            for name in ("signatures", "partitions", "enums", "band_ids", "recommendation_offsets")
+        }
+        base["band_offsets"] = np.load(os.path.join(directory, "band_offsets.npy"))
+        data_path = os.path.join(directory, "recommendation_data.bin")
+        base["recommendation_data"] = (
+            np.asarray(np.memmap(data_path, dtype=np.uint8, mode="r"))
+            if os.path.getsize(data_path) else np.zeros(0, dtype=np.uint8)
+        )
+        return base
+
+    def compact(self):
+        """メモリ上の差分を統合済みの側に書き出す（path がなければメモリ上で統合）"""
+        with self._compacting:
+            with self._lock:
+                base, count = self._base, self._delta_size
+                delta_signatures = self._delta_signatures[:count].copy()
+                delta_partitions = np.array(self._delta_partitions[:count], dtype=np.uint8)
+                delta_enums = np.array(self._delta_enums[:count], dtype=np.uint32)
+                delta_recommendations = self._delta_recommendations[:count]
+            if count == 0:
+                return
+
+            merged, encoded = self._merge(base, delta_signatures, delta_partitions, delta_enums, delta_recommendations)
+            previous = self._current_base_dir() if self.path else None
+            if self.path:
+                merged = self._save_base(merged, base["recommendation_data"], encoded)
+            else:
+                merged["recommendation_data"] = np.concatenate([
+                    base["recommendation_data"], np.frombuffer(b"".join(encoded), dtype=np.uint8)
+                ])
+
+            with self._lock:
+                remaining = [
+                    (
+                        self._delta_signatures[i].copy(),
+                        self._delta_partitions[i],
+                        self._delta_enums[i],
+                        self._delta_recommendations[i]
+                    )
+                    for i in range(count, self._delta_size)
+                ]
+                self._base = merged
+                self._reset_delta()
+                for case in remaining:
+                    self._append_delta(*case)
+                if self._log is not None:
+                    self._rewrite_log(remaining)
+
+            if previous is not None:
+                shutil.rmtree(previous, ignore_errors=True)
+            self.stats["compactions"] += 1
+
+    def _merge(
+        self,
+        base: Dict,
+        delta_signatures: np.ndarray,
+        delta_partitions: np.ndarray,
+        delta_enums: np.ndarray,
+        delta_recommendations: List[List[str]]
+    ) -> Tuple[Dict, List[bytes]]:
+        """統合した配列（recommendation_data 以外）と、追加分の対策提案の JSON"""
+        signatures = np.concatenate([np.asarray(base["signatures"]), delta_signatures])
+        partitions = np.concatenate([np.asarray(base["partitions"]), delta_partitions])
+        enums = np.concatenate([np.asarray(base["enums"]), delta_enums])
+
+        keys = np.empty((len(signatures), self.BANDS), dtype=np.int64)
+        for start in range(0, len(signatures), 1 << 18):
+            end = start + (1 << 18)
+            keys[start:end] = self._band_keys(signatures[start:end], partitions[start:end])
+
+        band_offsets = np.zeros((self.BANDS, self._KEYS + 1), dtype=np.int64)
+        band_ids = np.empty((self.BANDS, len(signatures)), dtype=np.uint32)
+        for band in range(self.BANDS):
+            band_ids[band] = np.argsort(keys[:, band], kind="stable")
+            band_offsets[band, 1:] = np.cumsum(np.bincount(keys[:, band], minlength=self._KEYS))
+
+        encoded = [json.dumps(r, ensure_ascii=False).encode() for r in delta_recommendations]
+        base_offsets = np.asarray(base["recommendation_offsets"])
+        offsets = np.concatenate([
+            base_offsets,
+            base_offsets[-1] + np.cumsum([len(e) for e in encoded], dtype=np.int64)
+        ])
+
+        return {
+            "signatures": signatures,
+            "partitions": partitions,
+            "enums": enums,
+            "band_offsets": band_offsets,
+            "band_ids": band_ids,
+            "recommendation_offsets": offsets
+        }, encoded
+
+    def _save_base(self, merged: Dict, previous_data: np.ndarray, encoded: List[bytes]) -> Dict:
+        """新しいディレクトリに書き出し、CURRENT を差し替えてから mmap で開き直す"""
+        name = f"base-{time.time_ns()}"
+        directory = os.path.join(self.path, name)
+        os.makedirs(directory)
+        for key in ("signatures", "partitions", "enums", "band_offsets", "band_ids", "recommendation_offsets"):
+            np.save(os.path.join(directory, f"{key}.npy"), merged[key])
+        with open(os.path.join(directory, "recommendation_data.bin"), "wb") as f:
+            f.write(memoryview(previous_data))
+            for data in encoded:
+                f.write(data)
+
+        current = os.path.join(self.path, "CURRENT")
+        with open(current + ".tmp", "w") as f:
+            f.write(name)
+        os.replace(current + ".tmp", current)
+        return self._load_base(directory)
+
+    def _rewrite_log(self, remaining: List[Tuple[np.ndarray, int, int, List[str]]]):
+        log_path = os.path.join(self.path, "pending.jsonl")
+        self._log.close()
+        with open(log_path + ".tmp", "w", encoding="utf-8") as f:
+            for signature, partition, enums, recommendations in remaining:
+                f.write(json.dumps({
+                    "signature": signature.tolist(),
+                    "partition": partition,
+                    "enums": enums,
+                    "recommendations": recommendations
+                }, ensure_ascii=False) + "\n")
+        os.replace(log_path + ".tmp", log_path)
+        self._log = open(log_path, "a", encoding="utf-8")
+
+    def summary(self) -> Dict:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "cases": len(self._base["signatures"]) + self._delta_size,
+            "pending": self._delta_size,
+            "hit_ratio": round(self.stats["hits"] / lookups, 4) if lookups else 0.0,
+            "threshold": self.threshold,
+            "path": self.path
+        }
+
+    def close(self):
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+
+class SoundLevelStream:
+    """
+    1本の騒音レベル（dB）の時系列の統計を、届いた分ずつ更新する
+
+    サンプルは started_at（測定場所の現地時刻）から interval_seconds 間隔で並び、欠測は NaN。
+    受け取った値そのものは残さず、次だけを持つ（サンプル数によらず一定の大きさ）:
+    - 昼間・夜間ごとの BIN_WIDTH 刻みのヒストグラム（L10/L50/L90）と最大値（Lmax）
+    - 時刻（0-23時）ごとのエネルギーの和とサンプル数（Leq）
+    - 時刻ごとの、1時間の Leq が環境基準を超えた時間数と評価した時間数
+    - 受信中の1時間分のエネルギーの和とサンプル数（次の時間のサンプルが届いた時点で評価する）
+    1時間のうち MIN_HOUR_COVERAGE 以上のサンプルがある時間だけを評価する。
+    """
+
+    # 環境基準（住居地域）: 昼間 6-22時 / 夜間 22-6時
+    DAY_LIMIT_DB = 55.0
+    NIGHT_LIMIT_DB = 45.0
+    DAY_HOURS = (6, 22)
+
+    MAX_DB = 140.0
+    BIN_WIDTH = 0.1
+    MIN_HOUR_COVERAGE = 0.5
+
+    # 時刻 -> 昼間かどうか・環境基準
+    _DAY = (np.arange(24) >= DAY_HOURS[0]) & (np.arange(24) < DAY_HOURS[1])
+    _LIMITS = np.where(_DAY, DAY_LIMIT_DB, NIGHT_LIMIT_DB)
+
+    def __init__(self, started_at: datetime, interval_seconds: float = 1.0):
+        self.started_at = started_at
+        self.interval_seconds = interval_seconds
+        self.samples = 0  # 受け取った位置の数（欠測を含む）
+        self.updated_at = time.time()
+        self.lock = asyncio.Lock()
+
+        # 現地時刻の 1970-01-01 0時からの秒数（時刻の判定に使う）
+        self._origin = (started_at.replace(tzinfo=None) - datetime(1970, 1, 1)).total_seconds()
+        bins = int(round(self.MAX_DB / self.BIN_WIDTH)) + 1
+        self._histograms = np.zeros((2, bins), dtype=np.int32)  # [夜間, 昼間]
+        self._lmax = np.full(2, -np.inf)
+        self._energy = np.zeros(24)
+        self._counts = np.zeros(24, dtype=np.int64)
+        self._hours = np.zeros(24, dtype=np.int64)
+        self._exceeded = np.zeros(24, dtype=np.int64)
+        # 受信中の時間（1970-01-01 0時からの通し番号）とその分のエネルギーの和・サンプル数
+        self._open_hour: Optional[int] = None
+        self._open_energy = 0.0
+        self._open_count = 0
+
+    def append(self, values: np.ndarray, offset: Optional[int] = None) -> int:
+        """
+        offset 番目（0始まり, 省略時は受け取り済みの続き）からのサンプルを追加し、追加した数を返す
+
+        受け取り済みの位置と重なる分は無視し（再送）、間が空いた分は欠測とする
+        """
+        values = np.asarray(values, dtype=np.float64)
+        if offset is None:
+            offset = self.samples
+        if offset < self.samples:
+            values = values[self.samples - offset:]
+            offset = self.samples
+        if len(values) == 0:
+            return 0
+        self.samples = offset + len(values)
+        self.updated_at = time.time()
+
+        valid = ~np.isnan(values)
+        levels = np.clip(values[valid], 0.0, self.MAX_DB)
+        if len(levels) == 0:
+            return len(values)
+        positions = np.flatnonzero(valid) + offset
+        hours = ((self._origin + positions * self.interval_seconds) // 3600).astype(np.int64)
+        hour_of_day = hours % 24
+        day = self._DAY[hour_of_day]
+
+        # ヒストグラム・最大値（昼間・夜間）
+        bins = self._histograms.shape[1]
+        self._histograms += np.bincount(
+            day * bins + np.rint(levels / self.BIN_WIDTH).astype(np.int64), minlength=2 * bins
+        ).reshape(2, bins).astype(np.int32)
+        for period in (0, 1):
+            selected = levels[day == period]
+            if len(selected):
+                self._lmax[period] = max(self._lmax[period], selected.max())
+
+        # 時間ごとのエネルギーの和（サンプルは時刻順なので、この分の時間は連続している）
+        first = int(hours[0])
+        energy = np.power(10.0, levels / 10)
+        hour_energy = np.bincount(hours - first, weights=energy)
+        hour_counts = np.bincount(hours - first)
+        numbers = first + np.arange(len(hour_counts))
+        self._energy += np.bincount(numbers % 24, weights=hour_energy, minlength=24)
+        self._counts += np.bincount(numbers % 24, weights=hour_counts, minlength=24).astype(np.int64)
+
+        # 受信中だった時間に足し、この分の最後の時間の前までを評価する
+        if self._open_hour == first:
+            hour_energy[0] += self._open_energy
+            hour_counts[0] += self._open_count
+        elif self._open_hour is not None:
+            self._close_hours(
+                np.array([self._open_hour]), np.array([self._open_energy]), np.array([self._open_count])
+            )
+        self._close_hours(numbers[:-1], hour_energy[:-1], hour_counts[:-1])
+        self._open_hour = int(numbers[-1])
+        self._open_energy = float(hour_energy[-1])
+        self._open_count = int(hour_counts[-1])
+
+        return len(values)
+
+    def _evaluate_hours(
+        self,
+        numbers: np.ndarray,
+        energy: np.ndarray,
+        counts: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """1時間ごとの Leq を環境基準と比べ、時刻ごとの (評価した時間数, 超えた時間数) を返す"""
+        covered = counts >= (3600 / self.interval_seconds) * self.MIN_HOUR_COVERAGE
+        with np.errstate(divide="ignore", invalid="ignore"):
+            leq = 10 * np.log10(energy / counts)
+        hour_of_day = numbers % 24
+        exceeded = covered & (leq > self._LIMITS[hour_of_day])
+        return (
+            np.bincount(hour_of_day[covered], minlength=24),
+            np.bincount(hour_of_day[exceeded], minlength=24)
+        )
+
+    def _close_hours(self, numbers: np.ndarray, energy: np.ndarray, counts: np.ndarray):
+        if len(numbers):
+            hours, exceeded = self._evaluate_hours(numbers, energy, counts)
+            self._hours += hours
+            self._exceeded += exceeded
+
+    def statistics(self) -> Dict:
+        """
+        Leq・L10/L50/L90・Lmax（全体・昼間・夜間）と、時刻ごとの環境基準の超過
+
+        受信中の時間も、サンプルが MIN_HOUR_COVERAGE 以上あれば評価に含める
+        """
+        hours, exceeded = self._hours.copy(), self._exceeded.copy()
+        if self._open_hour is not None:
+            open_hours, open_exceeded = self._evaluate_hours(
+                np.array([self._open_hour]), np.array([self._open_energy]), np.array([self._open_count])
+            )
+            hours += open_hours
+            exceeded += open_exceeded
+
+        periods = {}
+        for name, period, limit in (("day", 1, self.DAY_LIMIT_DB), ("night", 0, self.NIGHT_LIMIT_DB)):
+            selected = self._DAY == period
+            periods[name] = {
+                **self._levels(
+                    self._histograms[period],
+                    self._energy[selected].sum(),
+                    int(self._counts[selected].sum()),
+                    self._lmax[period]
+                ),
+                "limit": limit,
+                "hours": int(hours[selected].sum()),
+                "exceeded_hours": int(exceeded[selected].sum())
+            }
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            hourly_leq = np.round(10 * np.log10(self._energy / self._counts), 1)
+        return {
+            "started_at": self.started_at.isoformat(),
+            "interval_seconds": self.interval_seconds,
+            "samples": self.samples,
+            "duration_hours": round(self.samples * self.interval_seconds / 3600, 2),
+            "overall": self._levels(
+                self._histograms.sum(axis=0), self._energy.sum(), int(self._counts.sum()), self._lmax.max()
+            ),
+            **periods,
+            "hourly": [
+                {
+                    "hour": hour,
+                    "leq": float(hourly_leq[hour]) if self._counts[hour] else None,
+                    "limit": float(self._LIMITS[hour]),
+                    "hours": int(hours[hour]),
+                    "exceeded_hours": int(exceeded[hour])
+                }
+                for hour in range(24)
+            ]
+        }
+
+    def _levels(self, histogram: np.ndarray, energy: float, count: int, lmax: float) -> Dict:
+        """ヒストグラム・エネルギーの和から Leq・Lx（x% の時間で超えていたレベル）・Lmax"""
+        if count == 0:
+            return {"samples": 0, "leq": None, "l10": None, "l50": None, "l90": None, "lmax": None}
+
+        cumulative = np.cumsum(histogram)
+        percentiles = np.searchsorted(cumulative, np.array([0.9, 0.5, 0.1]) * count) * self.BIN_WIDTH
+        l10, l50, l90 = (round(float(level), 1) for level in percentiles)
+        return {
+            "samples": count,
+            "leq": round(10 * math.log10(energy / count), 1),
+            "l10": l10,
+            "l50": l50,
+            "l90": l90,
+            "lmax": round(float(lmax), 1)
+        }
+
+
+class MeasurementStore:
+    """
+    騒音測定（SoundLevelStream）の保管
+
+    測定ごとに持つのは統計だけ（一定の大きさ）なので、max_streams 件までメモリに置く。
+    最後にサンプルを受け取ってから ttl_seconds を過ぎたものと、上限を超えた分は古いものから削除する。
+    """
+
+    def __init__(self, max_streams: int = 1000, ttl_seconds: float = 14 * 86400):
+        self.max_streams = max_streams
+        self.ttl_seconds = ttl_seconds
+        # 測定ID -> 測定。末尾が最近使ったもの
+        self._streams: "OrderedDict[str, SoundLevelStream]" = OrderedDict()
+        self.stats = {
+            "created": 0,
+            "uploads": 0,
+            "samples": 0,
+            "expired": 0,
+            "evictions": 0
+        }
+
+    def create(self, started_at: datetime, interval_seconds: float) -> str:
+        measurement_id = f"meas-{uuid.uuid4().hex[:16]}"
+        self._streams[measurement_id] = SoundLevelStream(started_at, interval_seconds)
+        self.stats["created"] += 1
+        while len(self._streams) > self.max_streams:
+            self._streams.popitem(last=False)
+            self.stats["evictions"] += 1
+        return measurement_id
+
+    def get(self, measurement_id: str) -> Optional[SoundLevelStream]:
+        stream = self._streams.get(measurement_id)
+        if stream is None:
+            return None
+        if stream.updated_at + self.ttl_seconds <= time.time():
+            del self._streams[measurement_id]
+            self.stats["expired"] += 1
+            return None
+        self._streams.move_to_end(measurement_id)
+        return stream
+
+    def statistics(self, measurement_id: str) -> Optional[Dict]:
+        stream = self.get(measurement_id)
+        return None if stream is None else stream.statistics()
+
+    def append(self, stream: SoundLevelStream, values: np.ndarray, offset: Optional[int] = None) -> int:
+        added = stream.append(values, offset)
+        self.stats["samples"] += added
+        return added
+
+    def record_upload(self):
+        self.stats["uploads"] += 1
+
+    def summary(self) -> Dict:
+        return {**self.stats, "streams": len(self._streams)}
+
+
 class DiagnosisEngine:
     """AI診断エンジン"""
 
+    MODEL = "gpt-4"
+
+    # プロンプトの文面を変えたら上げる（ディスクに残った旧プロンプトの結果を使わない）
+    PROMPT_VERSION = 1
+
     URGENCY_RULES = {
         # 高緊急度の条件
         "high": [
@@ -138,69 +1487,232 @@ class DiagnosisEngine:
         ]
     }
 
+    # 上のルールを起動時にコンパイルした判定表
+    URGENCY_TABLE = DecisionTable(URGENCY_RULES)
+    LEGAL_RISK_TABLE = DecisionTable(LEGAL_RISK_RULES)
+
+    # 実測値のルール（SoundLevelStream.statistics() の結果に対して判定）
+    MEASURED_URGENCY_RULES = {
+        # 夜間に1時間の Leq が環境基準を超えた時間が続いている
+        "high": [
+            lambda m: m["night"]["exceeded_hours"] >= 3
+        ],
+        "medium": [
+            lambda m: m["day"]["exceeded_hours"] + m["night"]["exceeded_hours"] > 0
+        ]
+    }
+
+    MEASURED_LEGAL_RISK_RULES = {
+        # 昼間・夜間の Leq が環境基準を超過
+        "high": [
+            lambda m: m["night"]["hours"] > 0 and m["night"]["leq"] > m["night"]["limit"],
+            lambda m: m["day"]["hours"] > 0 and m["day"]["leq"] > m["day"]["limit"]
+        ],
+        # 時間単位の超過、または時間の1割以上で基準を超えている（L10）
+        "medium": [
+            lambda m: m["day"]["exceeded_hours"] + m["night"]["exceeded_hours"] > 0,
+            lambda m: any(
+                m[period]["l10"] is not None and m[period]["l10"] > m[period]["limit"]
+                for period in ("day", "night")
+            )
+        ]
+    }
+
     @classmethod
     def assess_urgency(cls, symptoms: Symptoms) -> str:
-        """緊急度を判定"""
-        # 高緊急度チェック
-        for rule in cls.URGENCY_RULES["high"]:
-            try:
-                if rule(symptoms):
-                    return "high"
-            except:
-                pass
+        """緊急度を判定（高緊急度の条件を優先し、どれにも当たらなければ low）"""
+        return cls.URGENCY_TABLE.evaluate(symptoms)
 
-        # 中緊急度チェック
-        for rule in cls.URGENCY_RULES["medium"]:
-            try:
-                if rule(symptoms):
-                    return "medium"
-            except:
-                pass
+    @classmethod
+    def assess_legal_risk(cls, symptoms: Symptoms) -> str:
+        """法的リスクを評価（高リスクの条件を優先し、どれにも当たらなければ low）"""
+        return cls.LEGAL_RISK_TABLE.evaluate(symptoms)
 
-        return "low"
+    @classmethod
+    def assess_measurement(cls, urgency: str, legal_risk: str, measurement: Dict) -> Tuple[str, str]:
+        """
+        実測値のルールに当たれば緊急度・法的リスクを引き上げる（症状からの判定より下げることはない）
+
+        Returns:
+            (緊急度, 法的リスク)
+        """
+        levels = DecisionTable.LEVELS
+
+        def measured(rules: Dict[str, List[Callable]]) -> int:
+            for level in ("high", "medium"):
+                if any(rule(measurement) for rule in rules[level]):
+                    return levels.index(level)
+            return 0
+
+        return (
+            levels[max(levels.index(urgency), measured(cls.MEASURED_URGENCY_RULES))],
+            levels[max(levels.index(legal_risk), measured(cls.MEASURED_LEGAL_RISK_RULES))]
+        )
+
+    @staticmethod
+    def symptom_columns(symptoms: List[Symptoms]) -> Dict[str, np.ndarray]:
+        """症状の一覧を assess_columns に渡す列ごとの配列に変換"""
+        return {
+            field: np.array([getattr(s, field) for s in symptoms], dtype=object)
+            for field in Symptoms.model_fields
+        }
 
     @classmethod
-    def assess_legal_risk(cls, symptoms: Symptoms) -> str:
-        """法的リスクを評価"""
-        # 高リスクチェック
-        for rule in cls.LEGAL_RISK_RULES["high"]:
-            try:
-                if rule(symptoms):
-                    return "high"
-            except:
-                pass
+    def assess_columns(cls, columns: Dict[str, Iterable]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        列ごとの配列（symptom_columns の形式）から緊急度と法的リスクをまとめて判定
 
-        # 中リスクチェック
-        for rule in cls.LEGAL_RISK_RULES["medium"]:
-            try:
-                if rule(symptoms):
-                    return "medium"
-            except:
-                pass
+        Returns:
+            (緊急度, 法的リスク) の文字列の配列
+        """
+        levels = np.array(DecisionTable.LEVELS, dtype=object)
+        positions = cls.URGENCY_TABLE.positions(columns)
+        return (
+            levels[cls.URGENCY_TABLE.table.ravel()[positions]],
+            levels[cls.LEGAL_RISK_TABLE.table.ravel()[positions]]
+        )
 
-        return "low"
+    @staticmethod
+    def prompt_inputs(symptoms: Symptoms, urgency: str, legal_risk: str) -> Dict:
+        """
+        プロンプトに使う項目を正規化（キャッシュのキーにもなる）
+
+        列挙値は前後の空白を除いて小文字にし、空文字・0週はプロンプト上と同じく「不明」（None）にそろえる
+        """
+        def normalize(value: Optional[str]) -> Optional[str]:
+            value = (value or "").strip().lower()
+            return value or None
+
+        return {
+            "noise_type": normalize(symptoms.noise_type),
+            "time_of_day": normalize(symptoms.time_of_day),
+            "duration_weeks": symptoms.duration_weeks or None,
+            "source_location": normalize(symptoms.source_location),
+            "contacted_management": bool(symptoms.contacted_management),
+            "urgency": urgency,
+            "legal_risk": legal_risk
+        }
 
     @classmethod
     async def generate_recommendations(
         cls,
         symptoms: Symptoms,
         urgency: str,
-        legal_risk: str
+        legal_risk: str,
+        limit: Optional[asyncio.Semaphore] = None
     ) -> List[str]:
-        """GPT-4で対策提案を生成"""
+        """
+        GPT-4で対策提案を生成
+
+        同じ入力の結果は recommendation_cache から、似た過去の事例があれば similar_case_index から返し、
+        どちらもない場合だけ GPT-4 を呼び出す（生成した結果は similar_case_index に追加）。
+        limit を渡した場合、GPT-4 を実際に呼び出す間だけその枠を使う
+        （キャッシュ・実行中の生成への合流では使わない）
+        """
+        inputs = cls.prompt_inputs(symptoms, urgency, legal_risk)
+        key = RecommendationCache.key({**inputs, "model": cls.MODEL, "prompt_version": cls.PROMPT_VERSION})
+
+        async def load() -> List[str]:
+            similar = similar_case_index.lookup(symptoms, urgency, legal_risk)
+            if similar is not None:
+                return similar
+
+            if limit is None:
+                recommendations = await cls._request_recommendations(inputs)
+            else:
+                async with limit:
+                    recommendations = await cls._request_recommendations(inputs)
+            similar_case_index.add(symptoms, urgency, legal_risk, recommendations)
+            return recommendations
+
+        try:
+            return await recommendation_cache.get_or_load(key, load)
+
+        except Exception as e:
+            # GPT-4呼び出し失敗時のフォールバック
+            logger.warning("GPT-4 error: %s", e)
+            return cls._fallback_recommendations(urgency, legal_risk)
+
+    @classmethod
+    async def stream_recommendations(cls, symptoms: Symptoms, urgency: str, legal_risk: str) -> AsyncIterator[str]:
+        """
+        対策提案を1件ずつ返す（GPT-4 のストリーミング応答を1行届くごとに解析）
+
+        キャッシュ・似た過去の事例にあればそれを返し、最後まで受け取れた結果はキャッシュと事例に入れる。
+        1件も届かないまま失敗した場合はデフォルトの提案を返す（途中で失敗した場合はそこまで）
+        """
+        inputs = cls.prompt_inputs(symptoms, urgency, legal_risk)
+        key = RecommendationCache.key({**inputs, "model": cls.MODEL, "prompt_version": cls.PROMPT_VERSION})
+
+        cached = await recommendation_cache.get(key)
+        if cached is None:
+            cached = similar_case_index.lookup(symptoms, urgency, legal_risk)
+            if cached is not None:
+                await recommendation_cache.put(key, cached)
+        if cached is not None:
+            for recommendation in cached:
+                yield recommendation
+            return
+
+        recommendations = []
+        try:
+            buffer = ""
+            async for content in llm_client.stream_chat_completion(**cls._completion_params(inputs)):
+                *lines, buffer = (buffer + content).split('\n')
+                for line in lines:
+                    recommendation = cls._parse_recommendation_line(line)
+                    if recommendation:
+                        recommendations.append(recommendation)
+                        yield recommendation
+
+            recommendation = cls._parse_recommendation_line(buffer)
+            if recommendation:
+                recommendations.append(recommendation)
+                yield recommendation
+
+        except Exception as e:
+            logger.warning("GPT-4 error: %s", e)
+            if not recommendations:
+                for recommendation in cls._fallback_recommendations(urgency, legal_risk):
+                    yield recommendation
+            return
+
+        if recommendations:
+            await recommendation_cache.put(key, recommendations)
+            similar_case_index.add(symptoms, urgency, legal_risk, recommendations)
+
+    @classmethod
+    async def _request_recommendations(cls, inputs: Dict) -> List[str]:
+        """GPT-4を呼び出して対策提案を生成（失敗時は例外。呼び出しは llm_client 経由）"""
+        response = await llm_client.chat_completion(**cls._completion_params(inputs))
+
+        recommendations_text = response.choices[0].message.content
+
+        # 番号付きリストを配列に変換
+        recommendations = []
+        for line in recommendations_text.split('\n'):
+            recommendation = cls._parse_recommendation_line(line)
+            if recommendation:
+                recommendations.append(recommendation)
+
+        return recommendations
+
+    @classmethod
+    def _completion_params(cls, inputs: Dict) -> Dict:
+        """prompt_inputs の項目から ChatCompletion の引数を組み立てる"""
 
         prompt = f"""以下の騒音トラブルについて、具体的な対策を3-5個提案してください。
 
 【症状】
-- 騒音タイプ: {symptoms.noise_type or '不明'}
-- 発生時間: {symptoms.time_of_day or '不明'}
-- 継続期間: {symptoms.duration_weeks or '不明'}週間
-- 発生源: {symptoms.source_location or '不明'}
-- 管理会社への相談: {'済み' if symptoms.contacted_management else '未'}
+- 騒音タイプ: {inputs['noise_type'] or '不明'}
+- 発生時間: {inputs['time_of_day'] or '不明'}
+- 継続期間: {inputs['duration_weeks'] or '不明'}週間
+- 発生源: {inputs['source_location'] or '不明'}
+- 管理会社への相談: {'済み' if inputs['contacted_management'] else '未'}
 
 【評価】
-- 緊急度: {urgency}
-- 法的リスク: {legal_risk}
+- 緊急度: {inputs['urgency']}
+- 法的リスク: {inputs['legal_risk']}
 
 【提案形式】
 1. 短期対策（すぐできること）
@@ -209,35 +1721,26 @@ class DiagnosisEngine:
 
 各提案は1文で簡潔に。"""
 
-        try:
-            response = await openai.ChatCompletion.acreate(
-                model="gpt-4",
-                messages=[
-                    {"role": "system", "content": "あなたは騒音トラブル解決の専門家です。"},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.7,
-                max_tokens=500
-            )
-
-            recommendations_text = response.choices[0].message.content
-
-            # 番号付きリストを配列に変換
-            recommendations = []
-            for line in recommendations_text.split('\n'):
-                line = line.strip()
-                if line and (line[0].isdigit() or line.startswith('-')):
-                    # 先頭の番号や記号を削除
-                    clean_line = line.lstrip('0123456789.-) ').strip()
-                    if clean_line:
-                        recommendations.append(clean_line)
-
-            return recommendations
+        return {
+            "model": cls.MODEL,
+            "messages": [
+                {"role": "system", "content": "あなたは騒音トラブル解決の専門家です。"},
+                {"role": "user", "content": prompt}
+            ],
+            "temperature": 0.7,
+            "max_tokens": 500
+        }
 
-        except Exception as e:
-            # GPT-4呼び出し失敗時のフォールバック
-            print(f"GPT-4 error: {e}")
-            return cls._fallback_recommendations(urgency, legal_risk)
+    @staticmethod
+    def _parse_recommendation_line(line: str) -> Optional[str]:
+        """番号付きリストの1行 -> 提案の文（リストの項目でない行は None）"""
+        line = line.strip()
+        if line and (line[0].isdigit() or line.startswith('-')):
+            # 先頭の番号や記号を削除
+            clean_line = line.lstrip('0123456789.-) ').strip()
+            if clean_line:
+                return clean_line
+        return None
 
     @classmethod
     def _fallback_recommendations(cls, urgency: str, legal_risk: str) -> List[str]:
@@ -256,6 +1759,364 @@ class DiagnosisEngine:
         return recommendations
 
 
+class RequestStreamParser:
+    """
+    一括診断の本文（NDJSON または JSON配列）を受け取った分ずつ解析する
+
+    形式は最初の空白以外の文字で判定する（"[" なら JSON配列、それ以外は1行1件の NDJSON）。
+    NDJSON の解析できない行はその行だけのエラーにして続ける。
+    JSON配列は要素の区切りが分からなくなるため、そこで打ち切って error に理由を入れる。
+    保持するのは解析途中の1件分だけで、1件が MAX_ITEM_SIZE 文字を超える場合も打ち切る。
+    """
+
+    MAX_ITEM_SIZE = 1024 * 1024
+
+    _WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+    def __init__(self):
+        self.format: Optional[str] = None  # "ndjson" / "array"
+        self.error: Optional[str] = None
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._json = json.JSONDecoder()
+        self._buffer = ""
+        # JSON配列で次に来るもの: "[" / "first"（要素か "]"） / "next"（"," か "]"） / "value" / "closed"
+        self._expect = "["
+
+    def feed(self, data: bytes, final: bool = False) -> List[Tuple[Optional[object], Optional[str]]]:
+        """
+        受け取った本文を渡し、取り出せた要素を (値, エラー) の一覧で返す
+
+        final=True で本文の終わりを知らせる（残りを最後の1件として解析する）
+        """
+        if self.error is not None:
+            return []
+        try:
+            self._buffer += self._decoder.decode(data, final)
+        except UnicodeDecodeError as e:
+            self.error = f"UTF-8として読めません: {e}"
+            return []
+
+        if self.format is None:
+            start = self._WHITESPACE.match(self._buffer).end()
+            if start == len(self._buffer):
+                self._buffer = ""
+                return []
+            self.format = "array" if self._buffer[start] == "[" else "ndjson"
+
+        if self.format == "array":
+            return self._feed_array(final)
+        return self._feed_lines(final)
+
+    def _feed_lines(self, final: bool) -> List[Tuple[Optional[object], Optional[str]]]:
+        *lines, self._buffer = self._buffer.split("\n")
+        if final:
+            lines.append(self._buffer)
+            self._buffer = ""
+
+        items = []
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                items.append((json.loads(line), None))
+            except ValueError as e:
+                items.append((None, f"JSONとして解析できません: {e}"))
+
+        if len(self._buffer) > self.MAX_ITEM_SIZE:
+            self.error = f"1行が {self.MAX_ITEM_SIZE} 文字を超えています"
+        return items
+
+    def _feed_array(self, final: bool) -> List[Tuple[Optional[object], Optional[str]]]:
+        items = []
+        buffer, position = self._buffer, 0
+
+        while self.error is None:
+            position = self._WHITESPACE.match(buffer, position).end()
+            if position == len(buffer):
+                break
+            char = buffer[position]
+
+            if self._expect == "[":
+                position += 1
+                self._expect = "first"
+            elif self._expect == "closed":
+                self.error = "配列の ] の後に余分なデータがあります"
+            elif self._expect in ("first", "next") and char == "]":
+                position += 1
+                self._expect = "closed"
+            elif self._expect == "next":
+                if char != ",":
+                    self.error = "配列の要素の後に , または ] がありません"
+                position += 1
+                self._expect = "value"
+            else:
+                try:
+                    value, position = self._json.raw_decode(buffer, position)
+                except ValueError as e:
+                    # 要素の途中で受信が切れている場合は続きを待つ
+                    if final:
+                        self.error = f"配列の要素をJSONとして解析できません: {e}"
+                    elif len(buffer) - position > self.MAX_ITEM_SIZE:
+                        self.error = f"配列の要素が {self.MAX_ITEM_SIZE} 文字を超えています"
+                    break
+                items.append((value, None))
+                self._expect = "next"
+
+        self._buffer = buffer[position:]
+        if final and self.error is None and self._expect != "closed":
+            self.error = "配列が ] で閉じられていません"
+        return items
+
+
+class BatchDiagnoser:
+    """
+    一括診断（POST /api/internal/diagnose/batch）
+
+    本文を受け取りながら chunk_size 件ずつに区切り、区切りごとに
+    緊急度・法的リスク・価格・信頼度を配列でまとめて計算する。
+    対策提案は区切りの中で同じプロンプトになる行を1回にまとめ、GPT-4 の同時呼び出しは
+    1リクエストあたり llm_concurrency 件まで（区切りをまたぐ重複は recommendation_cache で合流）。
+    結果は入力の順に1行1件の NDJSON で、先頭の区切りから終わったものを順に返す。
+    処理中・返却待ちの区切りが max_pending_chunks 個になると本文の読み込みを止めるため、
+    入力の件数によらずメモリ使用量は一定。
+    """
+
+    def __init__(self, chunk_size: int = 256, max_pending_chunks: int = 4, llm_concurrency: int = 8):
+        self.chunk_size = chunk_size
+        self.max_pending_chunks = max_pending_chunks
+        self.llm_concurrency = llm_concurrency
+
+    async def stream(self, body: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        """本文のバイト列 -> 結果の NDJSON（区切りごと）"""
+        limit = asyncio.Semaphore(self.llm_concurrency)
+        pending: asyncio.Queue = asyncio.Queue(maxsize=self.max_pending_chunks)
+
+        async def produce():
+            try:
+                async for rows in self._read_chunks(body):
+                    task = asyncio.ensure_future(self._diagnose_chunk(rows, limit))
+                    try:
+                        await pending.put(task)
+                    except asyncio.CancelledError:
+                        task.cancel()
+                        raise
+            except Exception as e:
+                # 読み込み中の切断など（返す相手がいないため結果の行は出さない）
+                logger.warning("Batch diagnosis input error: %s", e)
+            await pending.put(None)
+
+        producer = asyncio.ensure_future(produce())
+        try:
+            while True:
+                task = await pending.get()
+                if task is None:
+                    break
+                yield await task
+        finally:
+            producer.cancel()
+            while not pending.empty():
+                task = pending.get_nowait()
+                if task is not None:
+                    task.cancel()
+
+    async def _read_chunks(
+        self,
+        body: AsyncIterator[bytes]
+    ) -> AsyncIterator[List[Tuple[int, Optional[DiagnosisRequest], Optional[str]]]]:
+        """
+        本文を (入力の順番, リクエスト, エラー) の一覧に chunk_size 件ずつ区切る
+
+        本文の形式が壊れている場合は、その位置のエラーを最後の1件にして終える
+        """
+        parser = RequestStreamParser()
+        rows: List[Tuple[int, Optional[DiagnosisRequest], Optional[str]]] = []
+        index = 0
+
+        async def parsed():
+            async for data in body:
+                yield parser.feed(data)
+                if parser.error is not None:
+                    return
+            yield parser.feed(b"", final=True)
+
+        async for items in parsed():
+            for value, error in items:
+                rows.append(self._validate(index, value, error))
+                index += 1
+                if len(rows) >= self.chunk_size:
+                    yield rows
+                    rows = []
+            if parser.error is not None:
+                rows.append((index, None, parser.error))
+                break
+
+        if rows:
+            yield rows
+
+    @staticmethod
+    def _validate(
+        index: int,
+        value: Optional[object],
+        error: Optional[str]
+    ) -> Tuple[int, Optional[DiagnosisRequest], Optional[str]]:
+        if error is not None:
+            return index, None, error
+        try:
+            return index, DiagnosisRequest.model_validate(value), None
+        except ValidationError as e:
+            details = "; ".join(
+                f"{'.'.join(str(loc) for loc in detail['loc']) or 'body'}: {detail['msg']}"
+                for detail in e.errors()
+            )
+            return index, None, f"入力が不正です: {details}"
+
+    async def _diagnose_chunk(
+        self,
+        rows: List[Tuple[int, Optional[DiagnosisRequest], Optional[str]]],
+        limit: asyncio.Semaphore
+    ) -> bytes:
+        """1区切り分を診断し、入力の順の NDJSON を返す（不正な行は index と error だけの行）"""
+        rows, measurements = self._measurements(rows)
+        valid = [(index, request) for index, request, _ in rows if request is not None]
+        results: Dict[int, Dict] = {}
+
+        if valid:
+            symptoms = [request.symptoms for _, request in valid]
+            columns = DiagnosisEngine.symptom_columns(symptoms)
+            urgency, legal_risk = DiagnosisEngine.assess_columns(columns)
+            measured_hours = np.zeros(len(valid))
+            for i, (index, _) in enumerate(valid):
+                if index in measurements:
+                    urgency[i], legal_risk[i] = DiagnosisEngine.assess_measurement(
+                        urgency[i], legal_risk[i], measurements[index]
+                    )
+                    measured_hours[i] = measurement_hours(measurements[index])
+            prices = PriceEstimator.calculate_columns(columns, urgency)
+            confidence = calculate_confidence_columns(columns, measured_hours).tolist()
+
+            # 同じプロンプトになる行は1回だけ生成して共有
+            groups: Dict[tuple, List[int]] = {}
+            for i, s in enumerate(symptoms):
+                inputs = DiagnosisEngine.prompt_inputs(s, urgency[i], legal_risk[i])
+                groups.setdefault(tuple(inputs.values()), []).append(i)
+            generated = await asyncio.gather(*(
+                DiagnosisEngine.generate_recommendations(symptoms[i], urgency[i], legal_risk[i], limit)
+                for i in (members[0] for members in groups.values())
+            ))
+            recommendations: List[List[str]] = [[]] * len(symptoms)
+            for members, generated_recommendations in zip(groups.values(), generated):
+                for i in members:
+                    recommendations[i] = generated_recommendations
+
+            # 推論理由は緊急度・法的リスク・夜間かどうかだけで決まる（実測値がある行を除く）
+            reasons: Dict[tuple, str] = {}
+            timestamp = datetime.utcnow().strftime('%Y%m%d%H%M%S')
+
+            for i, (index, request) in enumerate(valid):
+                s = symptoms[i]
+                reason_key = (urgency[i], legal_risk[i], s.time_of_day == "night")
+                if index in measurements:
+                    reasoning = generate_reasoning(s, urgency[i], legal_risk[i], measurements[index])
+                else:
+                    if reason_key not in reasons:
+                        reasons[reason_key] = generate_reasoning(s, urgency[i], legal_risk[i])
+                    reasoning = reasons[reason_key]
+
+                results[index] = {
+                    "index": index,
+                    "session_id": request.session_id,
+                    "diagnosis_id": f"diag-{timestamp}-{index}",
+                    "noise_type": s.noise_type or "unknown",
+                    "urgency": urgency[i],
+                    "legal_risk": legal_risk[i],
+                    "confidence": confidence[i],
+                    "price_estimate": prices[i],
+                    "recommendations": recommendations[i],
+                    "reasoning": reasoning
+                }
+
+        lines = [
+            json.dumps(
+                results[index] if request is not None else {"index": index, "error": error},
+                ensure_ascii=False
+            )
+            for index, request, error in rows
+        ]
+        return ("\n".join(lines) + "\n").encode()
+
+    @staticmethod
+    def _measurements(
+        rows: List[Tuple[int, Optional[DiagnosisRequest], Optional[str]]]
+    ) -> Tuple[List[Tuple[int, Optional[DiagnosisRequest], Optional[str]]], Dict[int, Dict]]:
+        """measurement_id のある行の測定の統計（入力の順番 -> 統計）。見つからない行はエラーにする"""
+        checked = []
+        measurements: Dict[int, Dict] = {}
+        for index, request, error in rows:
+            if request is not None and request.measurement_id:
+                measurement = measurement_store.statistics(request.measurement_id)
+                if measurement is None:
+                    request, error = None, f"測定が見つかりません: {request.measurement_id}"
+                else:
+                    measurements[index] = measurement
+            checked.append((index, request, error))
+        return checked, measurements
+
+
+class RequestBodyStreamingResponse(StreamingResponse):
+    """
+    リクエスト本文を読みながら返す StreamingResponse
+
+    StreamingResponse は送信中に receive() で切断を待つため（ASGI 2.4 未満のサーバー）、
+    本文を読み終える前に返し始めると本文の受信と取り合いになる。
+    こちらは送信だけを行い、切断は本文の読み込み（ClientDisconnect）で検出する。
+    """
+
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+
+# 対策提案のキャッシュ（RECOMMENDATION_CACHE_PATH を指定するとディスクにも保存）
+recommendation_cache = RecommendationCache(
+    max_entries=int(os.getenv("RECOMMENDATION_CACHE_SIZE", "1024")),
+    ttl_seconds=float(os.getenv("RECOMMENDATION_CACHE_TTL_SECONDS", "86400")),
+    path=os.getenv("RECOMMENDATION_CACHE_PATH") or None
+)
+
+# 似た過去の事例の対策提案の再利用（SIMILAR_CASE_INDEX_PATH を指定するとディスクに保存し、起動時に mmap で読み込む）
+similar_case_index = SimilarCaseIndex(
+    path=os.getenv("SIMILAR_CASE_INDEX_PATH") or None,
+    threshold=float(os.getenv("SIMILAR_CASE_THRESHOLD", "0.85"))
+)
+
+# OpenAI API の呼び出し（接続の共有・同時呼び出し数・期限・ヘッジ・サーキットブレーカー）
+llm_client = LLMClient(
+    pool_size=int(os.getenv("LLM_POOL_SIZE", "32")),
+    max_in_flight=int(os.getenv("LLM_MAX_IN_FLIGHT", "16")),
+    deadline_seconds=float(os.getenv("LLM_DEADLINE_SECONDS", "10")),
+    hedge_delay_seconds=float(os.getenv("LLM_HEDGE_DELAY_SECONDS", "2")),
+    breaker=CircuitBreaker(
+        failure_threshold=int(os.getenv("LLM_CIRCUIT_FAILURES", "5")),
+        reset_seconds=float(os.getenv("LLM_CIRCUIT_RESET_SECONDS", "30"))
+    )
+)
+
+# アップロードされた騒音測定の統計（測定ごとに一定の大きさ）
+measurement_store = MeasurementStore(
+    max_streams=int(os.getenv("MEASUREMENT_MAX_STREAMS", "1000")),
+    ttl_seconds=float(os.getenv("MEASUREMENT_TTL_SECONDS", str(14 * 86400)))
+)
+
+# 一括診断の区切りの件数・同時に処理する区切りの数・GPT-4 の同時呼び出し数
+batch_diagnoser = BatchDiagnoser(
+    chunk_size=int(os.getenv("DIAGNOSE_BATCH_CHUNK_SIZE", "256")),
+    max_pending_chunks=int(os.getenv("DIAGNOSE_BATCH_MAX_PENDING_CHUNKS", "4")),
+    llm_concurrency=int(os.getenv("DIAGNOSE_BATCH_LLM_CONCURRENCY", "8"))
+)
+
+
 @app.post("/api/internal/diagnose", response_model=DiagnosisResponse)
 async def diagnose(request: DiagnosisRequest):
     """
@@ -267,7 +2128,11 @@ async def diagnose(request: DiagnosisRequest):
     - 法的リスク
     - 価格見積もり
     - 対策提案
+
+    measurement_id を指定すると、アップロード済みの測定の実測値も緊急度・法的リスク・信頼度に使う
     """
+    measurement = find_measurement(request.measurement_id)
+
     try:
         symptoms = request.symptoms
 
@@ -277,6 +2142,10 @@ async def diagnose(request: DiagnosisRequest):
         # 法的リスク評価
         legal_risk = DiagnosisEngine.assess_legal_risk(symptoms)
 
+        # 実測値による引き上げ
+        if measurement is not None:
+            urgency, legal_risk = DiagnosisEngine.assess_measurement(urgency, legal_risk, measurement)
+
         # 価格見積もり
         price_estimate = PriceEstimator.calculate(symptoms, urgency)
 
@@ -288,10 +2157,10 @@ async def diagnose(request: DiagnosisRequest):
         )
 
         # 信頼度計算（情報の充実度）
-        confidence = calculate_confidence(symptoms)
+        confidence = calculate_confidence(symptoms, measurement)
 
         # 推論理由生成
-        reasoning = generate_reasoning(symptoms, urgency, legal_risk)
+        reasoning = generate_reasoning(symptoms, urgency, legal_risk, measurement)
 
         # 診断IDを生成
         diagnosis_id = f"diag-{datetime.utcnow().strftime('%Y%m%d%H%M%S')}"
@@ -311,19 +2180,36 @@ async def diagnose(request: DiagnosisRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 
-def calculate_confidence(symptoms: Symptoms) -> float:
+# 信頼度（入力情報の充実度）の対象項目
+CONFIDENCE_FIELDS = ("noise_type", "time_of_day", "duration_weeks", "frequency", "source_location")
+
+# 実測値による信頼度の加算（評価できた時間が MEASUREMENT_CONFIDENCE_HOURS 時間分で最大）
+MEASUREMENT_CONFIDENCE_BONUS = 0.2
+MEASUREMENT_CONFIDENCE_HOURS = 24
+
+
+def find_measurement(measurement_id: Optional[str]) -> Optional[Dict]:
+    """measurement_id の測定の統計（指定なしは None, 見つからなければ 404）"""
+    if not measurement_id:
+        return None
+    measurement = measurement_store.statistics(measurement_id)
+    if measurement is None:
+        raise HTTPException(status_code=404, detail=f"測定が見つかりません: {measurement_id}")
+    return measurement
+
+
+def measurement_hours(measurement: Dict) -> int:
+    """環境基準と比べられた（サンプルが十分にあった）時間数"""
+    return measurement["day"]["hours"] + measurement["night"]["hours"]
+
+
+def calculate_confidence(symptoms: Symptoms, measurement: Optional[Dict] = None) -> float:
     """
     診断の信頼度を計算
 
-    入力情報の充実度に基づいて0.0-1.0の値を返す
+    入力情報の充実度に基づいて0.0-1.0の値を返す（実測値がある場合は評価できた時間数に応じて加算）
     """
-    fields = [
-        symptoms.noise_type,
-        symptoms.time_of_day,
-        symptoms.duration_weeks,
-        symptoms.frequency,
-        symptoms.source_location
-    ]
+    fields = [getattr(symptoms, field) for field in CONFIDENCE_FIELDS]
 
     filled_count = sum(1 for field in fields if field is not None)
     base_confidence = filled_count / len(fields)
@@ -332,10 +2218,46 @@ def calculate_confidence(symptoms: Symptoms) -> float:
     if symptoms.description and len(symptoms.description) > 50:
         base_confidence = min(1.0, base_confidence + 0.1)
 
+    # 実測値がある場合はボーナス
+    if measurement is not None:
+        coverage = min(1.0, measurement_hours(measurement) / MEASUREMENT_CONFIDENCE_HOURS)
+        base_confidence = min(1.0, base_confidence + MEASUREMENT_CONFIDENCE_BONUS * coverage)
+
     return round(base_confidence, 2)
 
 
-def generate_reasoning(symptoms: Symptoms, urgency: str, legal_risk: str) -> str:
+def calculate_confidence_columns(
+    columns: Dict[str, Iterable],
+    measured_hours: Optional[Iterable[float]] = None
+) -> np.ndarray:
+    """
+    列ごとの配列（DiagnosisEngine.symptom_columns の形式）からまとめて信頼度を計算
+
+    measured_hours は行ごとの実測値の評価できた時間数（実測値のない行は 0）
+    """
+    filled_count = sum(
+        ~np.equal(np.asarray(columns[field], dtype=object), None) for field in CONFIDENCE_FIELDS
+    )
+    base_confidence = filled_count / len(CONFIDENCE_FIELDS)
+
+    description_length = np.array([len(d) if d else 0 for d in columns["description"]], dtype=np.int64)
+    base_confidence = np.where(
+        description_length > 50, np.minimum(1.0, base_confidence + 0.1), base_confidence
+    )
+
+    if measured_hours is not None:
+        coverage = np.minimum(1.0, np.asarray(measured_hours, dtype=float) / MEASUREMENT_CONFIDENCE_HOURS)
+        base_confidence = np.minimum(1.0, base_confidence + MEASUREMENT_CONFIDENCE_BONUS * coverage)
+
+    return np.round(base_confidence, 2)
+
+
+def generate_reasoning(
+    symptoms: Symptoms,
+    urgency: str,
+    legal_risk: str,
+    measurement: Optional[Dict] = None
+) -> str:
     """診断理由を生成"""
     reasons = []
 
@@ -354,12 +2276,189 @@ def generate_reasoning(symptoms: Symptoms, urgency: str, legal_risk: str) -> str
     if symptoms.time_of_day == "night":
         reasons.append("夜間（22時〜翌6時）は環境基準が45dBと厳しくなります。")
 
+    if measurement is not None:
+        for period, label in (("night", "夜間"), ("day", "昼間")):
+            stats = measurement[period]
+            if stats["leq"] is None:
+                continue
+            reasons.append(
+                f"実測の{label}の等価騒音レベル（Leq）は{stats['leq']}dB（環境基準{stats['limit']:g}dB）で、"
+                f"1時間値が基準を超えた時間は{stats['hours']}時間中{stats['exceeded_hours']}時間でした。"
+            )
+
     if not reasons:
         reasons.append("提供された情報から総合的に判断しました。")
 
     return " ".join(reasons)
 
 
+@app.post("/api/internal/diagnose/batch")
+async def diagnose_batch(request: Request):
+    """
+    一括診断
+
+    本文は DiagnosisRequest の NDJSON（1行1件）または JSON配列。
+    結果は入力の順に1行1件の NDJSON（application/x-ndjson）で、処理の終わった分から返す。
+    各行は index（入力の順番, 0始まり）・session_id と DiagnosisResponse の項目。
+    不正な行は index と error だけの行になり、ほかの行の処理は続ける
+    （JSON配列の形式が壊れている場合はそこで終わる）。
+    """
+    return RequestBodyStreamingResponse(
+        batch_diagnoser.stream(request.stream()),
+        media_type="application/x-ndjson"
+    )
+
+
+def _sse(event: str, data: Dict) -> str:
+    """Server-Sent Events の1イベント"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.post("/api/internal/diagnose/stream")
+async def diagnose_stream(request: DiagnosisRequest):
+    """
+    AI診断（ストリーミング, text/event-stream）
+
+    GPT-4 の応答を待たずに返せる項目を先に送り、対策提案は生成され次第1件ずつ送る:
+    - diagnosis: DiagnosisResponse のうち recommendations 以外の項目
+    - recommendation: 対策提案1件（{"index": 0始まりの番号, "text": 提案}）
+    - done: 対策提案の全件（{"recommendations": [...]}）
+    """
+    symptoms = request.symptoms
+    measurement = find_measurement(request.measurement_id)
+    urgency = DiagnosisEngine.assess_urgency(symptoms)
+    legal_risk = DiagnosisEngine.assess_legal_risk(symptoms)
+    if measurement is not None:
+        urgency, legal_risk = DiagnosisEngine.assess_measurement(urgency, legal_risk, measurement)
+
+    diagnosis = {
+        "diagnosis_id": f"diag-{datetime.utcnow().strftime('%Y%m%d%H%M%S')}",
+        "noise_type": symptoms.noise_type or "unknown",
+        "urgency": urgency,
+        "legal_risk": legal_risk,
+        "confidence": calculate_confidence(symptoms, measurement),
+        "price_estimate": PriceEstimator.calculate(symptoms, urgency),
+        "reasoning": generate_reasoning(symptoms, urgency, legal_risk, measurement)
+    }
+
+    async def events():
+        yield _sse("diagnosis", diagnosis)
+
+        recommendations = []
+        async for recommendation in DiagnosisEngine.stream_recommendations(symptoms, urgency, legal_risk):
+            yield _sse("recommendation", {"index": len(recommendations), "text": recommendation})
+            recommendations.append(recommendation)
+
+        yield _sse("done", {"recommendations": recommendations})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.post("/api/internal/diagnose/measurements")
+def create_measurement(request: MeasurementRequest):
+    """騒音測定の開始（サンプルは /samples に分けてアップロードする）"""
+    measurement_id = measurement_store.create(request.started_at, request.interval_seconds)
+    return {
+        "measurement_id": measurement_id,
+        "started_at": request.started_at.isoformat(),
+        "interval_seconds": request.interval_seconds
+    }
+
+
+@app.post("/api/internal/diagnose/measurements/{measurement_id}/samples")
+async def upload_measurement_samples(measurement_id: str, request: Request, offset: Optional[int] = None):
+    """
+    騒音レベル（dB）のサンプルを追加
+
+    本文は application/octet-stream なら float32（リトルエンディアン）の並びで、受け取った分ずつ処理する。
+    それ以外は dB の JSON配列。欠測は NaN / null。
+    offset は最初のサンプルの位置（0始まり, 省略時は受け取り済みの続き）で、
+    受け取り済みの分と重なる部分は無視する（途中で失敗したアップロードはそのまま送り直せる）
+    """
+    stream = measurement_store.get(measurement_id)
+    if stream is None:
+        raise HTTPException(status_code=404, detail=f"測定が見つかりません: {measurement_id}")
+    if offset is not None and offset < 0:
+        raise HTTPException(status_code=400, detail="offset は0以上を指定してください")
+
+    async with stream.lock:
+        start = stream.samples if offset is None else offset
+        received = 0
+
+        if request.headers.get("content-type", "").startswith("application/octet-stream"):
+            remainder = b""
+            async for data in request.stream():
+                data = remainder + data
+                usable = len(data) - len(data) % 4
+                values = np.frombuffer(data[:usable], dtype="<f4")
+                measurement_store.append(stream, values, start + received)
+                received += len(values)
+                remainder = data[usable:]
+            if remainder:
+                raise HTTPException(status_code=400, detail="本文の長さが float32 の倍数ではありません")
+        else:
+            try:
+                values = np.asarray(json.loads(await request.body()), dtype=np.float64)
+            except (ValueError, TypeError) as e:
+                raise HTTPException(status_code=400, detail=f"dB の JSON配列として読めません: {e}")
+            if values.ndim != 1:
+                raise HTTPException(status_code=400, detail="dB の JSON配列を指定してください")
+            measurement_store.append(stream, values, start)
+            received = len(values)
+
+        measurement_store.record_upload()
+        return {"measurement_id": measurement_id, "received": received, "samples": stream.samples}
+
+
+@app.get("/api/internal/diagnose/measurements/stats")
+def measurement_store_stats():
+    """保持している測定の件数と受け取ったサンプル数"""
+    return measurement_store.summary()
+
+
+@app.get("/api/internal/diagnose/measurements/{measurement_id}")
+def get_measurement(measurement_id: str):
+    """測定の統計（Leq・L10/L50/L90・Lmax と時刻ごとの環境基準の超過）"""
+    return {"measurement_id": measurement_id, **find_measurement(measurement_id)}
+
+
+@app.get("/api/internal/diagnose/cache/stats")
+def recommendation_cache_stats():
+    """対策提案キャッシュのヒット・ミス件数"""
+    return recommendation_cache.summary()
+
+
+@app.get("/api/internal/diagnose/llm/stats")
+def llm_client_stats():
+    """OpenAI API の呼び出し件数（ヘッジ・やり直し・期限切れ）とサーキットブレーカーの状態"""
+    return llm_client.summary()
+
+
+@app.on_event("shutdown")
+def close_recommendation_cache():
+    recommendation_cache.close()
+
+
+@app.get("/api/internal/diagnose/similar/stats")
+def similar_case_stats():
+    """類似事例の索引の件数と、GPT-4 を呼ばずに済んだ割合"""
+    return similar_case_index.summary()
+
+
+@app.on_event("shutdown")
+def close_similar_case_index():
+    similar_case_index.close()
+
+
+@app.on_event("shutdown")
+async def close_llm_client():
+    await llm_client.close()
+
+
 @app.get("/health")
 def health_check():
     """ヘルスチェック"""
@@ -376,7 +2475,8 @@ def readiness_check():
 
         return {
             "status": "ready",
-            "openai": "configured"
+            "openai": "configured",
+            "llm_circuit": llm_client.breaker.state
         }
     except Exception as e:
         return {
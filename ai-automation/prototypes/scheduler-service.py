@@ -10,14 +10,34 @@ ZENBU Scheduler Service
 - 自動リマインド送信
 """
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Query, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from fastapi.encoders import jsonable_encoder
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Tuple
+from typing import List, Optional, Dict, Tuple, Iterable
 from datetime import datetime, timedelta, time
+import bisect
+import heapq
 from ortools.constraint_solver import routing_enums_pb2
 from ortools.constraint_solver import pywrapcp
+from ortools.util import optional_boolean_pb2
+from array import array
+from collections import OrderedDict, deque
+from concurrent.futures import BrokenExecutor, Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+import numpy as np
 import math
 import asyncio
+import hashlib
+import json
+import mmap
+import os
+import signal
+import struct
+import sys
+import threading
+import time as clock
+import zlib
 
 app = FastAPI(title="Scheduler Service")
 
@@ -59,6 +79,28 @@ class ScheduledJob(BaseModel):
     scheduled_time_end: str
     travel_time_minutes: int
     travel_distance_km: float
+    location: Optional[Location] = None
+
+
+class RescheduleRequest(BaseModel):
+    """確定済みジョブの変更リクエスト（指定した項目だけを変更）"""
+    worker_id: Optional[str] = None
+    scheduled_date: Optional[str] = None
+    scheduled_time_start: Optional[str] = None
+    scheduled_time_end: Optional[str] = None
+
+
+class LocationPing(BaseModel):
+    """作業員端末からの位置通知"""
+    worker_id: str
+    latitude: float
+    longitude: float
+    timestamp: Optional[float] = None  # UNIX時刻（秒）。省略時は受信時刻
+
+
+class LocationBatch(BaseModel):
+    """複数作業員分の位置通知をまとめたもの"""
+    pings: List[LocationPing]
 
 
 class OptimizationRequest(BaseModel):
@@ -74,6 +116,67 @@ class OptimizationResponse(BaseModel):
     efficiency_score: float
     total_travel_distance_km: float
     total_travel_time_minutes: int
+    alternatives: List[ScheduledJob] = []
+    metadata: Dict = {}
+
+
+class DayOptimizationRequest(BaseModel):
+    """日次一括最適化リクエスト"""
+    date: str
+    bookings: List[BookingRequest]
+    workers: List[Worker]
+    constraints: Optional[Dict] = None
+
+
+class BatchOptimizationRequest(BaseModel):
+    """複数予約の一括割り当てリクエスト"""
+    date: str
+    bookings: List[BookingRequest]
+    constraints: Optional[Dict] = None
+
+
+class BatchOptimizationResponse(BaseModel):
+    """複数予約の一括割り当て結果"""
+    date: str
+    assignments: List[ScheduledJob]
+    unassigned_booking_ids: List[str]
+    total_travel_distance_km: float
+    total_travel_time_minutes: int
+    metadata: Dict = {}
+
+
+class WorkerRoute(BaseModel):
+    """作業員ごとの巡回ルート"""
+    worker_id: str
+    jobs: List[ScheduledJob]
+    total_travel_distance_km: float
+    total_travel_time_minutes: int
+
+
+class DayOptimizationResponse(BaseModel):
+    """日次一括最適化結果"""
+    date: str
+    routes: List[WorkerRoute]
+    unassigned_booking_ids: List[str]
+    total_travel_distance_km: float
+    total_travel_time_minutes: int
+    metadata: Dict = {}
+
+
+def _to_minutes(value: str) -> int:
+    """HH:MM を0時からの経過分に変換"""
+    hours, minutes = value.split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+def _time_to_minutes(value: time) -> int:
+    """time を0時からの経過分に変換"""
+    return value.hour * 60 + value.minute
+
+
+def _format_minutes(minutes: int) -> str:
+    """0時からの経過分を HH:MM に変換"""
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
 
 
 class DistanceCalculator:
@@ -114,324 +217,5551 @@ class DistanceCalculator:
         with_buffer = base_time * 1.2
         return int(with_buffer)
 
+    @staticmethod
+    def haversine_matrix(
+        lat1: np.ndarray,
+        lon1: np.ndarray,
+        lat2: np.ndarray,
+        lon2: np.ndarray
+    ) -> np.ndarray:
+        """
+        地点群同士の直線距離をまとめて計算（km）
 
-class ScheduleOptimizer:
-    """スケジュール最適化エンジン"""
+        haversine_distance のベクトル版。戻り値の形状は (len(lat1), len(lat2))
+        """
+        R = 6371  # 地球の半径（km）
 
-    def __init__(self, workers: List[Worker], existing_jobs: List[ScheduledJob]):
-        self.workers = workers
-        self.existing_jobs = existing_jobs
-        self.dist_calc = DistanceCalculator()
+        lat1, lon1 = np.radians(lat1)[:, None], np.radians(lon1)[:, None]
+        lat2, lon2 = np.radians(lat2)[None, :], np.radians(lon2)[None, :]
 
-    def optimize(
+        dlat = lat2 - lat1
+        dlon = lon2 - lon1
+
+        a = (np.sin(dlat / 2) ** 2 +
+             np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2)
+        c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+        return R * c
+
+    @staticmethod
+    def estimate_travel_time_array(distance_km: np.ndarray) -> np.ndarray:
+        """移動時間をまとめて推定（分）。estimate_travel_time と同じ仮定"""
+        base_time = (distance_km / 30) * 60
+        with_buffer = base_time * 1.2
+        return with_buffer.astype(np.int32)
+
+
+class TravelTimeBackend:
+    """
+    移動時間計算のバックエンド
+
+    matrix() は出発地群×到着地群の移動時間（分）を返す
+    """
+
+    name = "base"
+
+    def matrix(
         self,
-        new_booking: BookingRequest,
-        target_date: str
-    ) -> Tuple[ScheduledJob, float]:
+        origin_lat: np.ndarray,
+        origin_lon: np.ndarray,
+        dest_lat: np.ndarray,
+        dest_lon: np.ndarray
+    ) -> np.ndarray:
+        raise NotImplementedError
+
+
+class HaversineTravelTime(TravelTimeBackend):
+    """直線距離から移動時間を推定（estimate_travel_time と同じ仮定）"""
+
+    name = "haversine"
+
+    def matrix(self, origin_lat, origin_lon, dest_lat, dest_lon) -> np.ndarray:
+        distance_km = DistanceCalculator.haversine_matrix(origin_lat, origin_lon, dest_lat, dest_lon)
+        return DistanceCalculator.estimate_travel_time_array(distance_km)
+
+
+class RoadGraph:
+    """
+    道路ネットワーク（Contraction Hierarchies 前処理済み）
+
+    tools/build_road_graph.py が書き出したバイナリファイルを mmap で開き、配列はファイル上の
+    領域をそのまま参照する（起動時のパースなし）。
+
+    ファイル形式（リトルエンディアン、各配列は8バイト境界に配置）:
+        ヘッダ: magic "ZRG1", version, ノード数, 上向き辺数, 下向き辺数, セル数,
+                セルの緯度幅, セルの経度幅
+        lat, lon                    float64[ノード数]
+        up_offsets                  uint32[ノード数+1]  順方向に順位が上がる辺（CSR）
+        up_targets, up_weights      uint32 / float32（秒）
+        down_offsets                uint32[ノード数+1]  逆方向に順位が上がる辺（CSR）
+        down_targets, down_weights  uint32 / float32（秒）
+        cell_keys                   int64[セル数]       最寄りノード検索用のグリッド
+        cell_offsets                uint32[セル数+1]
+        cell_nodes                  uint32[ノード数]
+    """
+
+    MAGIC = b"ZRG1"
+    VERSION = 1
+    HEADER = struct.Struct("<4sIIIIIdd")
+
+    # セル座標をキーにまとめる際のオフセット（負の座標に対応）
+    CELL_OFFSET = 1 << 20
+
+    def __init__(self, buffer, source: Optional[str] = None):
+        self.source = source
+        self._buffer = buffer
+
+        magic, version, n, m_up, m_down, num_cells, lat_step, lon_step = \
+            self.HEADER.unpack_from(buffer, 0)
+        if magic != self.MAGIC or version != self.VERSION:
+            raise ValueError(f"道路グラフの形式が不正です: {source}")
+
+        self.num_nodes = n
+        self.lat_step = lat_step
+        self.lon_step = lon_step
+
+        offset = self.HEADER.size
+
+        def take(dtype, count):
+            nonlocal offset
+            offset = -(-offset // 8) * 8
+            array = np.frombuffer(buffer, dtype=dtype, count=count, offset=offset)
+            offset += array.nbytes
+            return array
+
+        self.lat = take("<f8", n)
+        self.lon = take("<f8", n)
+        self.up_offsets = take("<u4", n + 1)
+        self.up_targets = take("<u4", m_up)
+        self.up_weights = take("<f4", m_up)
+        self.down_offsets = take("<u4", n + 1)
+        self.down_targets = take("<u4", m_down)
+        self.down_weights = take("<f4", m_down)
+        self.cell_keys = take("<i8", num_cells)
+        self.cell_offsets = take("<u4", num_cells + 1)
+        self.cell_nodes = take("<u4", n)
+
+        # 探索で辺をたどるときは、mmap 上の配列をそのまま memoryview で読む
+        # （要素ごとに Python の数値で取り出せ、展開したコピーを持たない）
+        self._up = tuple(map(self._view, (self.up_offsets, self.up_targets, self.up_weights)))
+        self._down = tuple(map(self._view, (self.down_offsets, self.down_targets, self.down_weights)))
+
+    @staticmethod
+    def _view(array: np.ndarray) -> memoryview:
+        """配列の memoryview（リトルエンディアン以外の環境ではネイティブ順に変換したもの）"""
+        view = memoryview(array)
+        if view.format not in ("I", "f"):
+            view = memoryview(array.astype(array.dtype.newbyteorder("=")))
+        return view
+
+    @classmethod
+    def open(cls, path: str) -> "RoadGraph":
+        """ファイルを mmap で開く"""
+        with open(path, "rb") as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(buffer, source=path)
+
+    @classmethod
+    def cell_key(cls, i: int, j: int) -> int:
+        return (i + cls.CELL_OFFSET) * (cls.CELL_OFFSET * 2) + (j + cls.CELL_OFFSET)
+
+    def nearest_node(self, latitude: float, longitude: float, max_km: float) -> Tuple[int, float]:
         """
-        新規予約を最適な作業員・時間帯に割り当て
+        最寄りノードと距離（km）。max_km 以内になければ (-1, inf)
+        """
+        ci = int(math.floor(latitude / self.lat_step))
+        cj = int(math.floor(longitude / self.lon_step))
+        cell_km = min(self.lat_step * 111.32, self.lon_step * 111.32 * math.cos(math.radians(latitude)))
+        max_ring = max(1, int(math.ceil(max_km / cell_km)))
 
-        Returns:
-            (最適なスケジュール, 効率スコア)
+        best_node, best_km = -1, float("inf")
+        for radius in range(max_ring + 1):
+            candidates = []
+            for di in range(-radius, radius + 1):
+                for dj in range(-radius, radius + 1):
+                    if max(abs(di), abs(dj)) != radius:
+                        continue
+                    key = self.cell_key(ci + di, cj + dj)
+                    pos = int(np.searchsorted(self.cell_keys, key))
+                    if pos < len(self.cell_keys) and self.cell_keys[pos] == key:
+                        candidates.append(
+                            self.cell_nodes[self.cell_offsets[pos]:self.cell_offsets[pos + 1]]
+                        )
+
+            if candidates:
+                nodes = np.concatenate(candidates)
+                distances = DistanceCalculator.haversine_matrix(
+                    np.array([latitude]), np.array([longitude]),
+                    self.lat[nodes], self.lon[nodes]
+                )[0]
+                i = int(np.argmin(distances))
+                if distances[i] < best_km:
+                    best_node, best_km = int(nodes[i]), float(distances[i])
+
+            # このリングまでで、より近いノードが外側にないことが保証される
+            if best_node >= 0 and best_km <= radius * cell_km:
+                break
+
+        if best_km > max_km:
+            return -1, float("inf")
+        return best_node, best_km
+
+    def upward_search(self, node: int, forward: bool) -> Tuple[np.ndarray, np.ndarray]:
         """
-        best_schedule = None
-        best_score = float('-inf')
+        順位が上がる辺だけをたどるDijkstra（CHの片側探索）
 
-        for worker in self.workers:
-            # その日の作業員のスケジュールを取得
-            worker_jobs = [
-                job for job in self.existing_jobs
-                if job.worker_id == worker.worker_id and job.scheduled_date == target_date
-            ]
+        Returns:
+            (到達ノード, 所要秒数)（ノード番号順）
+        """
+        offsets, targets, weights = self._up if forward else self._down
+        best = {node: 0.0}
+        heap = [(0.0, node)]
 
-            # すでに満杯の場合はスキップ
-            if len(worker_jobs) >= worker.max_jobs_per_day:
+        while heap:
+            d, u = heapq.heappop(heap)
+            if d > best[u]:
                 continue
+            for i in range(offsets[u], offsets[u + 1]):
+                v = targets[i]
+                nd = d + weights[i]
+                if nd < best.get(v, float("inf")):
+                    best[v] = nd
+                    heapq.heappush(heap, (nd, v))
 
-            # 可能な時間スロットを探索
-            available_slots = self._find_available_slots(
-                worker,
-                worker_jobs,
-                new_booking.estimated_duration_minutes,
-                target_date
-            )
+        nodes = np.fromiter(best.keys(), dtype=np.int64, count=len(best))
+        seconds = np.fromiter(best.values(), dtype=np.float64, count=len(best))
+        order = np.argsort(nodes)
+        return nodes[order], seconds[order]
 
-            for slot_start, slot_end in available_slots:
-                # このスロットでのスケジュールを評価
-                temp_schedule = ScheduledJob(
-                    booking_id=new_booking.booking_id,
-                    worker_id=worker.worker_id,
-                    scheduled_date=target_date,
-                    scheduled_time_start=slot_start.strftime("%H:%M"),
-                    scheduled_time_end=slot_end.strftime("%H:%M"),
-                    travel_time_minutes=0,
-                    travel_distance_km=0.0
-                )
 
-                # スコア計算
-                score = self._calculate_score(
-                    worker,
-                    temp_schedule,
-                    worker_jobs,
-                    new_booking
-                )
+class RoadGraphTravelTime(TravelTimeBackend):
+    """
+    道路ネットワーク上の移動時間
 
-                if score > best_score:
-                    best_score = score
-                    best_schedule = temp_schedule
+    - 出発地・到着地を最寄りノードに寄せ、CHの多対多探索（バケット法）で所要時間を求める
+    - ノードへのアクセス区間は直線距離で推定して加算する
+    - 最寄りノードが max_snap_km より遠い地点は直線距離の推定にフォールバック
+    - よく使うノードの片側探索結果、出発・到着ノード対の所要時間、地点の最寄りノードはLRUで保持する
+    """
 
-        if best_schedule is None:
-            # 空きがない場合、翌日を試す
-            next_date = (datetime.strptime(target_date, "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d")
-            return self.optimize(new_booking, next_date)
+    name = "road_graph"
 
-        # 移動距離・時間を計算
-        prev_location = self._get_previous_location(
-            best_schedule.worker_id,
-            best_schedule.scheduled_time_start,
-            target_date
-        )
+    # 到着地側の探索結果をまとめて扱う件数（メモリ使用量の上限）
+    TARGET_CHUNK = 256
 
-        if prev_location:
-            distance = self.dist_calc.haversine_distance(
-                prev_location,
-                new_booking.location
-            )
-            travel_time = self.dist_calc.estimate_travel_time(distance)
+    def __init__(
+        self,
+        graph: RoadGraph,
+        max_snap_km: float = 1.0,
+        search_cache_size: int = 4096,
+        pair_cache_size: int = 100_000,
+        snap_cache_size: int = 100_000
+    ):
+        self.graph = graph
+        self.max_snap_km = max_snap_km
+        self.fallback = HaversineTravelTime()
+        self._search_cache: "OrderedDict[Tuple[int, bool], Tuple[np.ndarray, np.ndarray]]" = OrderedDict()
+        self._search_cache_size = search_cache_size
+        self._pair_cache: "OrderedDict[Tuple[int, int], float]" = OrderedDict()
+        self._pair_cache_size = pair_cache_size
+        self._snap_cache: "OrderedDict[Tuple[float, float], Tuple[int, float]]" = OrderedDict()
+        self._snap_cache_size = snap_cache_size
+        # キャッシュは LRU の並べ替えを伴うため、スレッド実行のプールでは1スレッドずつ使う
+        self._lock = threading.Lock()
 
-            best_schedule.travel_distance_km = round(distance, 2)
-            best_schedule.travel_time_minutes = travel_time
+    def _snap(self, lat: np.ndarray, lon: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """各地点の最寄りノードとアクセス距離（km）"""
+        nodes = np.empty(len(lat), dtype=np.int64)
+        access_km = np.empty(len(lat))
+        for i, key in enumerate(zip(lat.tolist(), lon.tolist())):
+            snapped = self._snap_cache.get(key)
+            if snapped is None:
+                snapped = self.graph.nearest_node(key[0], key[1], self.max_snap_km)
+                self._snap_cache[key] = snapped
+                if len(self._snap_cache) > self._snap_cache_size:
+                    self._snap_cache.popitem(last=False)
+            else:
+                self._snap_cache.move_to_end(key)
+            nodes[i], access_km[i] = snapped
+        return nodes, access_km
 
-        return best_schedule, best_score
+    def _search(self, node: int, forward: bool) -> Tuple[np.ndarray, np.ndarray]:
+        key = (node, forward)
+        cached = self._search_cache.get(key)
+        if cached is not None:
+            self._search_cache.move_to_end(key)
+            return cached
 
-    def _find_available_slots(
-        self,
-        worker: Worker,
-        existing_jobs: List[ScheduledJob],
-        duration_minutes: int,
-        date: str
-    ) -> List[Tuple[datetime, datetime]]:
-        """
-        作業員の空き時間スロットを探す
-        """
-        slots = []
+        result = self.graph.upward_search(node, forward)
+        self._search_cache[key] = result
+        if len(self._search_cache) > self._search_cache_size:
+            self._search_cache.popitem(last=False)
+        return result
 
-        # その日の開始・終了時刻
-        work_start = datetime.strptime(
-            f"{date} {worker.available_from.strftime('%H:%M')}",
-            "%Y-%m-%d %H:%M"
-        )
-        work_end = datetime.strptime(
-            f"{date} {worker.available_to.strftime('%H:%M')}",
-            "%Y-%m-%d %H:%M"
+    def node_seconds(self, sources: np.ndarray, targets: np.ndarray) -> np.ndarray:
+        """ノード間の所要秒数（len(sources) × len(targets)、到達不能は inf）"""
+        result = np.full((len(sources), len(targets)), np.inf)
+        if len(sources) == 0 or len(targets) == 0:
+            return result
+
+        # よく使うノード対はキャッシュから埋める
+        if len(sources) * len(targets) <= self._pair_cache_size:
+            missing = False
+            for i, s in enumerate(sources.tolist()):
+                for j, t in enumerate(targets.tolist()):
+                    seconds = self._pair_cache.get((s, t))
+                    if seconds is None:
+                        missing = True
+                    else:
+                        result[i, j] = seconds
+            if not missing:
+                return result
+
+        source_spaces = [self._search(s, True) for s in sources.tolist()]
+
+        for chunk_start in range(0, len(targets), self.TARGET_CHUNK):
+            chunk = targets[chunk_start:chunk_start + self.TARGET_CHUNK].tolist()
+
+            # 到着地側の逆向き探索結果をバケット（ノード×到着地の所要秒数）にまとめる
+            spaces = [self._search(t, False) for t in chunk]
+            bucket_nodes = np.unique(np.concatenate([nodes for nodes, _ in spaces]))
+            buckets = np.full((len(bucket_nodes), len(chunk)), np.inf, dtype=np.float32)
+            for j, (nodes, seconds) in enumerate(spaces):
+                buckets[np.searchsorted(bucket_nodes, nodes), j] = seconds
+
+            # 出発地側の探索で到達したノードのバケットと突き合わせる
+            for i, (nodes, seconds) in enumerate(source_spaces):
+                pos = np.searchsorted(bucket_nodes, nodes)
+                pos[pos == len(bucket_nodes)] = 0
+                hit = bucket_nodes[pos] == nodes
+                if hit.any():
+                    result[i, chunk_start:chunk_start + len(chunk)] = np.min(
+                        buckets[pos[hit]] + seconds[hit, None], axis=0
+                    )
+
+        if len(sources) * len(targets) <= self._pair_cache_size:
+            for i, s in enumerate(sources.tolist()):
+                for j, t in enumerate(targets.tolist()):
+                    self._pair_cache[(s, t)] = float(result[i, j])
+            while len(self._pair_cache) > self._pair_cache_size:
+                self._pair_cache.popitem(last=False)
+
+        return result
+
+    def matrix(self, origin_lat, origin_lon, dest_lat, dest_lon) -> np.ndarray:
+        with self._lock:
+            return self._matrix(origin_lat, origin_lon, dest_lat, dest_lon)
+
+    def _matrix(self, origin_lat, origin_lon, dest_lat, dest_lon) -> np.ndarray:
+        origin_lat, origin_lon = np.asarray(origin_lat), np.asarray(origin_lon)
+        dest_lat, dest_lon = np.asarray(dest_lat), np.asarray(dest_lon)
+
+        minutes = self.fallback.matrix(origin_lat, origin_lon, dest_lat, dest_lon)
+
+        src_nodes, src_access = self._snap(origin_lat, origin_lon)
+        dst_nodes, dst_access = self._snap(dest_lat, dest_lon)
+        src_ok = np.flatnonzero(src_nodes >= 0)
+        dst_ok = np.flatnonzero(dst_nodes >= 0)
+        if len(src_ok) == 0 or len(dst_ok) == 0:
+            return minutes
+
+        # 同じノードに寄った地点はまとめて探索する
+        uniq_src, src_inv = np.unique(src_nodes[src_ok], return_inverse=True)
+        uniq_dst, dst_inv = np.unique(dst_nodes[dst_ok], return_inverse=True)
+        seconds = self.node_seconds(uniq_src, uniq_dst)[src_inv][:, dst_inv]
+
+        # ノードまでのアクセス区間は直線距離で推定
+        access = (
+            DistanceCalculator.estimate_travel_time_array(src_access[src_ok])[:, None] +
+            DistanceCalculator.estimate_travel_time_array(dst_access[dst_ok])[None, :]
         )
+        road = seconds / 60 + access
+
+        block = minutes[np.ix_(src_ok, dst_ok)]
+        reachable = np.isfinite(road)
+        block[reachable] = road[reachable].astype(block.dtype)
+        minutes[np.ix_(src_ok, dst_ok)] = block
+        return minutes
+
+
+def load_travel_time_backend() -> TravelTimeBackend:
+    """
+    移動時間バックエンドを選択
 
-        # 既存ジョブを時間順にソート
-        sorted_jobs = sorted(
-            existing_jobs,
-            key=lambda x: x.scheduled_time_start
+    ROAD_GRAPH_PATH に前処理済みの道路グラフがあれば道路ネットワーク、
+    なければ直線距離の推定を使う
+    """
+    path = os.getenv("ROAD_GRAPH_PATH")
+    if path:
+        return RoadGraphTravelTime(
+            RoadGraph.open(path),
+            max_snap_km=float(os.getenv("ROAD_GRAPH_MAX_SNAP_KM", "1.0"))
         )
+    return HaversineTravelTime()
 
-        current_time = work_start
 
-        for job in sorted_jobs:
-            job_start = datetime.strptime(
-                f"{date} {job.scheduled_time_start}",
-                "%Y-%m-%d %H:%M"
-            )
-            job_end = datetime.strptime(
-                f"{date} {job.scheduled_time_end}",
-                "%Y-%m-%d %H:%M"
-            )
+class DistanceMatrix:
+    """
+    距離・移動時間行列
 
-            # 移動時間を考慮した余裕（30分）
-            buffer = timedelta(minutes=30)
+    作業員・ジョブの地点を登録しておき、地点ごとの行（全登録地点までの距離・移動時間）を
+    必要になった時点でNumPyでまとめて計算して保持する。
+    地点は緯度経度で識別する。新しい地点が増えた行は、追加分の列だけを計算して伸ばす。
+    行列全体（地点数の2乗）を作らないため、数千地点の日でも必要な行の分しか計算しない。
 
-            # current_time から job_start までに空きがあるか
-            if (job_start - current_time) >= timedelta(minutes=duration_minutes + buffer.total_seconds() / 60):
-                slots.append((current_time, job_start - buffer))
+    スレッド実行のプールでは同じ行列を複数スレッドが使うため、地点の登録と行の計算は
+    ロック内で行う。地点のインデックスは座標を書き込んでから公開するので、
+    計算済みの行・登録済みの地点の参照はロックなしで読める。
+    """
 
-            current_time = job_end + buffer
+    def __init__(self, initial_capacity: int = 64, backend: Optional[TravelTimeBackend] = None):
+        self.backend = backend or HaversineTravelTime()
+        self._lock = threading.Lock()
+        self._index: Dict[Tuple[float, float], int] = {}
+        self._lat = np.empty(initial_capacity)
+        self._lon = np.empty(initial_capacity)
+        self._size = 0
+        # 地点インデックス -> (距離km float32, 移動時間分 int16)
+        self._rows: Dict[int, Tuple[np.ndarray, np.ndarray]] = {}
+        # 行の参照回数（計算済みの行をそのまま使えた / 計算・列の追加が必要だった）
+        self.row_hits = 0
+        self.row_misses = 0
+        # forget された（作業員が離れ、もう使われない）地点のインデックス
+        self._stale: set = set()
 
-        # 最後のジョブから work_end までの空き
-        if (work_end - current_time) >= timedelta(minutes=duration_minutes):
-            slots.append((current_time, work_end))
+    def __len__(self) -> int:
+        return self._size
 
-        return slots
+    @staticmethod
+    def _key(location: Location) -> Tuple[float, float]:
+        return (location.latitude, location.longitude)
 
-    def _calculate_score(
-        self,
-        worker: Worker,
-        schedule: ScheduledJob,
-        existing_jobs: List[ScheduledJob],
-        booking: BookingRequest
-    ) -> float:
+    def _reserve(self, size: int):
+        """座標配列の容量が足りなければ倍々で拡張する"""
+        capacity = len(self._lat)
+        if size <= capacity:
+            return
+
+        new_capacity = max(size, capacity * 2)
+        n = self._size
+
+        lat = np.empty(new_capacity)
+        lon = np.empty(new_capacity)
+        lat[:n] = self._lat[:n]
+        lon[:n] = self._lon[:n]
+        self._lat, self._lon = lat, lon
+
+    def extend(self, locations: Iterable[Location]) -> List[int]:
+        """地点をまとめて登録し、インデックスを返す"""
+        indices = []
+
+        with self._lock:
+            new_points: Dict[Tuple[float, float], int] = {}
+            for location in locations:
+                key = self._key(location)
+                idx = self._index.get(key)
+                if idx is None:
+                    idx = new_points.get(key)
+                    if idx is None:
+                        idx = self._size + len(new_points)
+                        new_points[key] = idx
+                indices.append(idx)
+
+            if new_points:
+                start = self._size
+                total = start + len(new_points)
+                self._reserve(total)
+
+                self._lat[start:total] = [p[0] for p in new_points]
+                self._lon[start:total] = [p[1] for p in new_points]
+                self._size = total
+                # 座標を書き込んでから公開する
+                self._index.update(new_points)
+
+        return indices
+
+    def index_of(self, location: Location) -> int:
+        """地点のインデックス（未登録なら追加）"""
+        idx = self._index.get(self._key(location))
+        if idx is None:
+            idx = self.extend([location])[0]
+        return idx
+
+    def row(self, idx: int) -> Tuple[np.ndarray, np.ndarray]:
         """
-        スケジュールのスコアを計算
+        地点 idx から全登録地点への (距離, 移動時間)
 
-        考慮要素:
-        1. 移動距離の最小化（重要度: 高）
-        2. 顧客希望時間との一致（重要度: 中）
-        3. 作業員の負荷均等化（重要度: 低）
+        未計算なら1回のベクトル計算で作り、その後に増えた地点の分は列を追加する
         """
-        score = 100.0
+        cached = self._rows.get(idx)
+        if cached is not None and len(cached[0]) == self._size:
+            self.row_hits += 1
+            return cached
 
-        # 1. 移動距離スコア（距離が短いほど高スコア）
-        prev_location = self._get_previous_location(
-            worker.worker_id,
-            schedule.scheduled_time_start,
-            schedule.scheduled_date
-        )
+        with self._lock:
+            # 待っている間に他のスレッドが計算していればそれを使う
+            cached = self._rows.get(idx)
+            done = 0 if cached is None else len(cached[0])
+            size = self._size
+            if done == size:
+                self.row_hits += 1
+                return cached
+            self.row_misses += 1
 
-        if prev_location:
-            distance = self.dist_calc.haversine_distance(
-                prev_location,
-                booking.location
-            )
-            # 10km以内なら満点、以降は減点
-            distance_score = max(0, 50 - (distance - 10) * 2)
-            score += distance_score
+            lat, lon = self._lat, self._lon
+            block = DistanceCalculator.haversine_matrix(
+                lat[idx:idx + 1], lon[idx:idx + 1], lat[done:size], lon[done:size]
+            )[0].astype(np.float32)
+            travel = self.backend.matrix(
+                lat[idx:idx + 1], lon[idx:idx + 1], lat[done:size], lon[done:size]
+            )[0].astype(np.int16)
 
-        # 2. 希望時間との一致スコア
-        if booking.preferred_time:
-            preferred_dt = datetime.strptime(
-                f"{schedule.scheduled_date} {booking.preferred_time}",
-                "%Y-%m-%d %H:%M"
-            )
-            scheduled_dt = datetime.strptime(
-                f"{schedule.scheduled_date} {schedule.scheduled_time_start}",
-                "%Y-%m-%d %H:%M"
-            )
+            if cached is not None:
+                block = np.concatenate([cached[0], block])
+                travel = np.concatenate([cached[1], travel])
 
-            time_diff_hours = abs((scheduled_dt - preferred_dt).total_seconds() / 3600)
-            # 1時間以内なら満点、以降は減点
-            time_score = max(0, 30 - time_diff_hours * 10)
-            score += time_score
+            self._rows[idx] = (block, travel)
+            return block, travel
 
-        # 3. 負荷均等化スコア
-        job_count = len(existing_jobs)
-        load_score = max(0, 20 - job_count * 5)
-        score += load_score
+    def _lookup(self, origin: Location, destination: Location) -> Tuple[np.ndarray, np.ndarray, int]:
+        """計算済みの行があればそれを使う（距離は対称）"""
+        i = self.index_of(origin)
+        j = self.index_of(destination)
+        if i in self._rows and j not in self._rows:
+            i, j = j, i
+        dist, travel = self.row(j)
+        return dist, travel, i
 
-        # 4. 緊急度ボーナス
-        if booking.urgency == "high":
-            score += 20
+    def distance(self, origin: Location, destination: Location) -> float:
+        """2点間の距離（km）"""
+        dist, _, i = self._lookup(origin, destination)
+        return float(dist[i])
 
-        return score
+    def travel_time(self, origin: Location, destination: Location) -> int:
+        """2点間の移動時間（分）"""
+        _, travel, i = self._lookup(origin, destination)
+        return int(travel[i])
 
-    def _get_previous_location(
-        self,
-        worker_id: str,
-        time_str: str,
-        date: str
-    ) -> Optional[Location]:
+    def distances_from(self, origin: Location, destinations: List[Location]) -> np.ndarray:
+        """1地点から複数地点への距離（km）"""
+        idx = self.extend([origin] + list(destinations))
+        dist, _ = self.row(idx[0])
+        return dist[idx[1:]]
+
+    def forget(self, location: Location):
         """
-        指定時刻直前の作業員の位置を取得
+        地点の計算済みの行を破棄する（作業員の位置が変わり、もう起点にならない場合）
+
+        地点自体の登録と、他の行にあるこの地点への列はそのまま残す
+        （使われなくなった地点の数は stale_points で数え、多くなったら行列ごと作り直す）
         """
-        target_time = datetime.strptime(f"{date} {time_str}", "%Y-%m-%d %H:%M")
+        idx = self._index.get(self._key(location))
+        if idx is not None:
+            self._rows.pop(idx, None)
+            self._stale.add(idx)
 
-        # その日の前のジョブを探す
-        previous_jobs = [
-            job for job in self.existing_jobs
-            if job.worker_id == worker_id and
-               job.scheduled_date == date and
-               datetime.strptime(f"{date} {job.scheduled_time_end}", "%Y-%m-%d %H:%M") < target_time
-        ]
+    @property
+    def stale_points(self) -> int:
+        return len(self._stale)
 
-        if not previous_jobs:
-            # その日の最初のジョブなら、作業員の自宅・事務所位置
-            worker = next((w for w in self.workers if w.worker_id == worker_id), None)
-            return worker.current_location if worker else None
 
-        # 直近のジョブの位置
-        latest_job = max(
-            previous_jobs,
-            key=lambda x: x.scheduled_time_end
+class DistanceMatrixCache:
+    """
+    日付ごとの距離行列キャッシュ
+
+    最近使った max_dates 日分まで保持する（古いものから破棄）。日付が変わった後に
+    新しい日付の行列を作るとき、過ぎた日付の行列もまとめて破棄する。
+    プール内・リージョンの各プロセスも同じキャッシュを持つため、どのプロセスでも増え続けない。
+
+    作業員が移動するたびに新しい位置が地点として増えるため、地点の半分以上が
+    使われなくなった行列や、max_points を超えた行列は空の行列に作り直す
+    （作り直す前の行列を参照中の探索は、そのまま古い行列で最後まで計算できる）。
+    """
+
+    MAX_DATES = 32
+    MAX_POINTS = 50_000
+    # これより小さい行列は、使われない地点が多くても作り直さない
+    MIN_REBUILD_POINTS = 1024
+
+    def __init__(
+        self,
+        backend: Optional[TravelTimeBackend] = None,
+        max_dates: int = MAX_DATES,
+        max_points: int = MAX_POINTS
+    ):
+        self.backend = backend
+        self.max_dates = max(1, max_dates)
+        self.max_points = max_points
+        self._lock = threading.Lock()
+        self._matrices: "OrderedDict[str, DistanceMatrix]" = OrderedDict()
+        # 過ぎた日付を最後に破棄した日（その日のうちは再走査しない）
+        self._swept: Optional[str] = None
+        # 破棄した行列の行の参照回数（row_stats の累計を減らさないため）
+        self._dropped_hits = 0
+        self._dropped_misses = 0
+
+    def for_date(self, date: str) -> DistanceMatrix:
+        with self._lock:
+            matrix = self._matrices.get(date)
+            if matrix is None:
+                self._evict()
+                matrix = DistanceMatrix(backend=self.backend)
+                self._matrices[date] = matrix
+            elif len(matrix) > self.max_points:
+                matrix = self._rebuild(date)
+            else:
+                self._matrices.move_to_end(date)
+            return matrix
+
+    def _rebuild(self, date: str) -> DistanceMatrix:
+        """日付の行列を空の行列に置き換える"""
+        self._drop(date)
+        matrix = DistanceMatrix(backend=self.backend)
+        self._matrices[date] = matrix
+        return matrix
+
+    def _evict(self):
+        """過ぎた日付の行列と、上限を超える古い行列を破棄"""
+        today = datetime.now().strftime("%Y-%m-%d")
+        if today != self._swept:
+            self._swept = today
+            for date in [date for date in self._matrices if date < today]:
+                self._drop(date)
+        while len(self._matrices) >= self.max_dates:
+            self._drop(next(iter(self._matrices)))
+
+    def drop(self, date: str):
+        """日付の行列を破棄"""
+        with self._lock:
+            self._drop(date)
+
+    def _drop(self, date: str):
+        matrix = self._matrices.pop(date, None)
+        if matrix is not None:
+            self._dropped_hits += matrix.row_hits
+            self._dropped_misses += matrix.row_misses
+
+    def row_stats(self) -> Tuple[int, int]:
+        """全日付の行列の行の参照回数 (計算済み, 計算が必要)"""
+        with self._lock:
+            matrices = list(self._matrices.values())
+        return (
+            self._dropped_hits + sum(matrix.row_hits for matrix in matrices),
+            self._dropped_misses + sum(matrix.row_misses for matrix in matrices)
         )
 
-        # 実際のサービスではDBからジョブの位置情報を取得
-        # ここではダミー
-        return None
+    def forget(self, location: Location):
+        """
+        すべての日付の行列から地点の計算済みの行を破棄
 
+        使われない地点が半分を超えた行列は作り直す
+        """
+        with self._lock:
+            for date, matrix in list(self._matrices.items()):
+                matrix.forget(location)
+                if len(matrix) >= self.MIN_REBUILD_POINTS and matrix.stale_points * 2 > len(matrix):
+                    self._rebuild(date)
 
-@app.post("/api/internal/scheduler/optimize", response_model=OptimizationResponse)
-async def optimize_schedule(request: OptimizationRequest):
+
+class SpatialIndex:
     """
-    スケジュール最適化API
+    位置の空間索引
 
-    新規予約を最適な作業員・時間に割り当て
+    緯度経度を一辺 cell_km のグリッドに分けて地点を登録し、
+    近い順の検索はクエリ地点のセルから外側のリングへ広げていく。
     """
-    try:
-        # TODO: 実際のサービスではDBから取得
-        # ダミーデータ
-        workers = [
-            Worker(
-                worker_id="worker-001",
-                name="田中",
-                current_location=Location(
-                    latitude=35.6812,
-                    longitude=139.7671,
-                    address="東京都渋谷区"
-                ),
-                available_from=time(9, 0),
-                available_to=time(18, 0),
-                max_jobs_per_day=4
-            ),
-            Worker(
-                worker_id="worker-002",
-                name="佐藤",
-                current_location=Location(
-                    latitude=35.6895,
-                    longitude=139.6917,
-                    address="東京都新宿区"
-                ),
-                available_from=time(9, 0),
-                available_to=time(18, 0),
-                max_jobs_per_day=4
-            )
-        ]
 
-        existing_jobs = []  # TODO: DBから取得
+    def __init__(self, cell_km: float = 5.0, reference_latitude: float = 35.7):
+        self.cell_km = cell_km
+        self._lat_step = cell_km / 111.32
+        self._lon_step = cell_km / (111.32 * math.cos(math.radians(reference_latitude)))
+        self._cells: Dict[Tuple[int, int], Dict[str, Tuple[float, float]]] = {}
+        self._points: Dict[str, Tuple[int, int]] = {}
+        self._bounds: Optional[List[int]] = None
 
-        optimizer = ScheduleOptimizer(workers, existing_jobs)
+    def __len__(self) -> int:
+        return len(self._points)
 
-        # 最適化実行
-        optimal_job, score = optimizer.optimize(
-            request.new_booking,
-            request.date
-        )
+    def _cell(self, latitude: float, longitude: float) -> Tuple[int, int]:
+        return (int(math.floor(latitude / self._lat_step)),
+                int(math.floor(longitude / self._lon_step)))
 
-        # 全体スケジュールを構築
-        all_jobs = existing_jobs + [optimal_job]
+    def add(self, key: str, location: Location):
+        """地点を登録（同じキーがあれば置き換え）"""
+        self.remove(key)
+        cell = self._cell(location.latitude, location.longitude)
+        self._cells.setdefault(cell, {})[key] = (location.latitude, location.longitude)
+        self._points[key] = cell
 
-        # 統計計算
-        total_distance = sum(job.travel_distance_km for job in all_jobs)
-        total_travel_time = sum(job.travel_time_minutes for job in all_jobs)
-        efficiency_score = score / 100.0
+        if self._bounds is None:
+            self._bounds = [cell[0], cell[0], cell[1], cell[1]]
+        else:
+            b = self._bounds
+            b[0], b[1] = min(b[0], cell[0]), max(b[1], cell[0])
+            b[2], b[3] = min(b[2], cell[1]), max(b[3], cell[1])
 
-        return OptimizationResponse(
-            optimal_schedule=all_jobs,
-            efficiency_score=round(efficiency_score, 2),
-            total_travel_distance_km=round(total_distance, 2),
-            total_travel_time_minutes=total_travel_time
+    def remove(self, key: str):
+        cell = self._points.pop(key, None)
+        if cell is not None:
+            bucket = self._cells[cell]
+            del bucket[key]
+            if not bucket:
+                del self._cells[cell]
+
+    def _ring(self, center: Tuple[int, int], radius: int) -> Iterable[Tuple[int, int]]:
+        """中心セルからチェビシェフ距離 radius のセル"""
+        ci, cj = center
+        if radius == 0:
+            yield center
+            return
+        for dj in range(-radius, radius + 1):
+            yield (ci - radius, cj + dj)
+            yield (ci + radius, cj + dj)
+        for di in range(-radius + 1, radius):
+            yield (ci + di, cj - radius)
+            yield (ci + di, cj + radius)
+
+    def nearest(
+        self,
+        location: Location,
+        k: Optional[int] = None,
+        radius_km: Optional[float] = None
+    ) -> List[Tuple[str, float]]:
+        """
+        近い順に (キー, 距離km) を返す
+
+        k 件、または radius_km 以内（両方指定時は両方を満たす範囲）。
+        どちらも指定しなければ全件。
+        """
+        if not self._points:
+            return []
+
+        center = self._cell(location.latitude, location.longitude)
+        b = self._bounds
+        max_ring = max(
+            abs(center[0] - b[0]), abs(center[0] - b[1]),
+            abs(center[1] - b[2]), abs(center[1] - b[3])
         )
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        keys: List[str] = []
+        lats: List[float] = []
+        lons: List[float] = []
+        found = np.empty(0)
 
+        for radius in range(max_ring + 1):
+            for cell in self._ring(center, radius):
+                bucket = self._cells.get(cell)
+                if bucket:
+                    for key, (lat, lon) in bucket.items():
+                        keys.append(key)
+                        lats.append(lat)
+                        lons.append(lon)
 
-@app.get("/api/v1/workers/{worker_id}/schedule")
+            # リング radius まで調べれば、半径 radius * cell_km 以内は漏れなく含まれる
+            covered_km = radius * self.cell_km
+            if radius_km is not None and covered_km >= radius_km:
+                break
+            if k is not None and len(keys) >= k:
+                found = DistanceCalculator.haversine_matrix(
+                    np.array([location.latitude]), np.array([location.longitude]),
+                    np.array(lats), np.array(lons)
+                )[0]
+                if np.partition(found, k - 1)[k - 1] <= covered_km:
+                    break
+
+        if len(found) != len(keys):
+            found = DistanceCalculator.haversine_matrix(
+                np.array([location.latitude]), np.array([location.longitude]),
+                np.array(lats), np.array(lons)
+            )[0]
+
+        order = np.argsort(found, kind="stable")
+        if radius_km is not None:
+            order = order[found[order] <= radius_km]
+        if k is not None:
+            order = order[:k]
+
+        return [(keys[i], float(found[i])) for i in order]
+
+
+class ScheduleIndex:
+    """
+    作業員・日付ごとのジョブ索引
+
+    (worker_id, date) ごとにジョブを開始時刻（分）順に保持し、
+    直前・直後のジョブを二分探索で引く
+    """
+
+    def __init__(self, jobs: Iterable[ScheduledJob] = ()):
+        self._starts: Dict[Tuple[str, str], List[int]] = {}
+        self._entries: Dict[Tuple[str, str], List[Tuple[int, ScheduledJob]]] = {}
+        self._keys: Dict[str, Tuple[Tuple[str, str], int]] = {}
+
+        for job in jobs:
+            self.add(job)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __contains__(self, booking_id: str) -> bool:
+        return booking_id in self._keys
+
+    def add(self, job: ScheduledJob):
+        """ジョブを登録（同じ booking_id があれば置き換え）"""
+        if job.booking_id in self._keys:
+            self.remove(job.booking_id)
+
+        key = (job.worker_id, job.scheduled_date)
+        starts = self._starts.setdefault(key, [])
+        entries = self._entries.setdefault(key, [])
+
+        start = _to_minutes(job.scheduled_time_start)
+        pos = bisect.bisect_right(starts, start)
+        starts.insert(pos, start)
+        entries.insert(pos, (_to_minutes(job.scheduled_time_end), job))
+        self._keys[job.booking_id] = (key, start)
+
+    def remove(self, booking_id: str) -> Optional[ScheduledJob]:
+        """ジョブを削除して返す"""
+        found = self._keys.pop(booking_id, None)
+        if found is None:
+            return None
+
+        key, start = found
+        starts = self._starts[key]
+        entries = self._entries[key]
+
+        pos = self._position(key, start, booking_id)
+        del starts[pos]
+        _, job = entries.pop(pos)
+
+        if not starts:
+            del self._starts[key]
+            del self._entries[key]
+
+        return job
+
+    def _position(self, key: Tuple[str, str], start: int, booking_id: str) -> int:
+        """同じ開始時刻のジョブの中から booking_id の位置を特定"""
+        entries = self._entries[key]
+        pos = bisect.bisect_left(self._starts[key], start)
+        while entries[pos][1].booking_id != booking_id:
+            pos += 1
+        return pos
+
+    def get(self, booking_id: str) -> Optional[ScheduledJob]:
+        """booking_id のジョブを取得"""
+        found = self._keys.get(booking_id)
+        if found is None:
+            return None
+        key, start = found
+        return self._entries[key][self._position(key, start, booking_id)][1]
+
+    def jobs_for(self, worker_id: str, date: str) -> List[ScheduledJob]:
+        """作業員のその日のジョブ（開始時刻順）"""
+        return [job for _, job in self._entries.get((worker_id, date), ())]
+
+    def all_jobs(self) -> List[ScheduledJob]:
+        """登録済みの全ジョブ（順不同）"""
+        return [job for entries in self._entries.values() for _, job in entries]
+
+    def count(self, worker_id: str, date: str) -> int:
+        """作業員のその日のジョブ件数"""
+        return len(self._starts.get((worker_id, date), ()))
+
+    def previous_job(self, worker_id: str, date: str, minute: int) -> Optional[ScheduledJob]:
+        """指定時刻（分）より前に終わる直近のジョブ"""
+        key = (worker_id, date)
+        starts = self._starts.get(key)
+        if not starts:
+            return None
+
+        entries = self._entries[key]
+        pos = bisect.bisect_left(starts, minute) - 1
+        while pos >= 0:
+            end, job = entries[pos]
+            if end < minute:
+                return job
+            pos -= 1
+        return None
+
+    def spans(self, worker_id: str, date: str) -> Iterable[Tuple[int, int]]:
+        """作業員のその日の (開始, 終了)（分、開始時刻順）"""
+        key = (worker_id, date)
+        starts = self._starts.get(key, ())
+        entries = self._entries.get(key, ())
+        return zip(starts, (end for end, _ in entries))
+
+    def next_job(self, worker_id: str, date: str, minute: int) -> Optional[ScheduledJob]:
+        """指定時刻（分）以降に始まる直近のジョブ"""
+        key = (worker_id, date)
+        starts = self._starts.get(key)
+        if not starts:
+            return None
+
+        pos = bisect.bisect_left(starts, minute)
+        if pos == len(starts):
+            return None
+        return self._entries[key][pos][1]
+
+
+class ScheduleStore:
+    """
+    確定済みスケジュールの永続化ストア
+
+    ScheduleIndex と同じ問い合わせに答えるメモリ上の索引を、スナップショットと
+    追記型ログ（WAL）で永続化する。外部DBは使わない。
+
+    - 書き込みは WAL に1レコード追記してから索引に反映する。fsync はレコードごとには行わず、
+      リクエストの最後に sync() を await して、その時点までの書き込みを1回の fsync で確定する
+      （同時に待っているリクエストの分もまとめる。fsync は専用スレッドで行う）
+    - snapshot_every 件ごとに、全件を固定長レコードの配列＋文字列領域のファイルに書き出し、
+      WAL を次の世代に切り替える。イベントループ上では WAL の切り替えと対象ジョブの
+      参照の取得だけを行い、ファイルの書き出しは専用スレッドで行う
+    - 起動時はスナップショットを mmap して配列として参照し、後続の WAL だけを再生する。
+      スナップショット内のジョブは日付ごとに、最初に参照されたときに索引へ展開する
+
+    ファイル:
+        snapshot.bin          ヘッダ（magic "ZSS1", version, 世代, 件数, 文字列領域の長さ）、
+                              RECORD[件数]（日付順）、booking_id のハッシュ順索引、文字列領域
+        wal-<世代>.log         [長さ, CRC32, 種別] + 本文 の繰り返し（途中で切れたレコードは
+                              復元時に切り捨てる）
+    """
+
+    MAGIC = b"ZSS1"
+    VERSION = 1
+    HEADER = struct.Struct("<4sIQQQ")
+    WAL_HEADER = struct.Struct("<IIB")
+
+    OP_UPSERT = 1
+    OP_DELETE = 2
+
+    # スナップショットの書き出しで、ジョブをまとめて配列に変換する件数
+    SNAPSHOT_CHUNK = 5000
+
+    RECORD = np.dtype([
+        ("booking_hash", "<u8"),
+        ("date", "<i4"),  # 日付の序数（date.toordinal）
+        ("start", "<i2"),
+        ("end", "<i2"),
+        ("travel_minutes", "<i4"),
+        ("distance_km", "<f8"),
+        ("latitude", "<f8"),
+        ("longitude", "<f8"),
+        ("has_location", "u1"),
+        ("booking_offset", "<u4"),
+        ("booking_length", "<u2"),
+        ("worker_offset", "<u4"),
+        ("worker_length", "<u2"),
+        ("address_offset", "<u4"),
+        ("address_length", "<u2"),
+    ])
+
+    def __init__(self, directory: str, snapshot_every: int = 10_000, fsync: bool = True):
+        self.directory = directory
+        self.snapshot_every = snapshot_every
+        self.fsync = fsync
+        self.generation = 0
+
+        # 展開済みのジョブ
+        self._index = ScheduleIndex()
+        self._dates: Dict[str, set] = {}
+        self._loaded: set = set()
+
+        # スナップショット以降に書き込まれた booking_id（スナップショット側の行は無効）
+        self._shadowed: set = set()
+
+        self._records = np.empty(0, dtype=self.RECORD)
+        self._hashes = np.empty(0, dtype="<u8")
+        self._hash_rows = np.empty(0, dtype="<u4")
+        self._blob = memoryview(b"")
+        self._groups: Dict[str, Tuple[int, int]] = {}
+
+        self._wal = None
+        self._opened = False
+        self._pending = 0
+
+        # WAL の fsync とスナップショットの書き出しを行う専用スレッド（open で作成）
+        self._io: Optional[ThreadPoolExecutor] = None
+        # WAL に書いたレコード数と、そのうち fsync 済みの数（グループコミット）
+        self._written = 0
+        self._synced = 0
+        self._syncing: Optional[asyncio.Future] = None
+        # 書き出し中のスナップショットと、書き出し開始後に書き込まれた booking_id
+        self._snapshotting: Optional[asyncio.Task] = None
+        self._recent: Optional[set] = None
+
+        # 直近の復元の所要時間・件数
+        self.recovery: Dict = {}
+
+    @property
+    def snapshot_path(self) -> str:
+        return os.path.join(self.directory, "snapshot.bin")
+
+    @property
+    def version(self) -> int:
+        """書き込んだ変更の通番（確定済みジョブが変わるたびに増える）"""
+        return self._written
+
+    def _wal_path(self, generation: int) -> str:
+        return os.path.join(self.directory, f"wal-{generation:08d}.log")
+
+    def _wal_generations(self) -> List[int]:
+        generations = []
+        for name in os.listdir(self.directory):
+            if name.startswith("wal-") and name.endswith(".log"):
+                generations.append(int(name[4:-4]))
+        return sorted(generations)
+
+    @staticmethod
+    def _hash(booking_id: str) -> int:
+        return int.from_bytes(hashlib.blake2b(booking_id.encode(), digest_size=8).digest(), "little")
+
+    # ---- 復元 ----
+
+    def open(self):
+        """スナップショットを mmap し、それ以降の WAL を再生して書き込みを受け付ける"""
+        started = clock.time()
+        self._opened = True
+        os.makedirs(self.directory, exist_ok=True)
+        self._io = ThreadPoolExecutor(max_workers=1, thread_name_prefix="schedule-store")
+
+        if os.path.exists(self.snapshot_path):
+            self._map_snapshot(self.snapshot_path)
+
+        replayed = 0
+        generations = [g for g in self._wal_generations() if g >= self.generation]
+        for generation in generations:
+            replayed += self._replay(self._wal_path(generation))
+        self._pending = replayed
+
+        if generations:
+            self.generation = generations[-1]
+        self._wal = open(self._wal_path(self.generation), "ab")
+
+        self.recovery = {
+            "snapshot_jobs": len(self._records),
+            "replayed_records": replayed,
+            "elapsed_ms": round((clock.time() - started) * 1000, 2)
+        }
+
+    def _map_snapshot(self, path: str):
+        with open(path, "rb") as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, generation, count, blob_size = self.HEADER.unpack_from(buffer, 0)
+        if magic != self.MAGIC or version != self.VERSION:
+            raise ValueError(f"スナップショットの形式が不正です: {path}")
+
+        offset = self.HEADER.size
+
+        def take(dtype, n):
+            nonlocal offset
+            offset = -(-offset // 8) * 8
+            array = np.frombuffer(buffer, dtype=dtype, count=n, offset=offset)
+            offset += array.nbytes
+            return array
+
+        self.generation = generation
+        self._records = take(self.RECORD, count)
+        self._hashes = take("<u8", count)
+        self._hash_rows = take("<u4", count)
+        self._blob = memoryview(buffer)[offset:offset + blob_size]
+
+        # 日付ごとの行範囲（レコードは日付順に並んでいる）
+        ordinals, first, counts = np.unique(self._records["date"], return_index=True, return_counts=True)
+        self._groups = {
+            datetime.fromordinal(int(ordinal)).strftime("%Y-%m-%d"): (int(lo), int(lo + n))
+            for ordinal, lo, n in zip(ordinals, first, counts)
+        }
+
+    def _replay(self, path: str) -> int:
+        """WAL を再生（末尾の壊れたレコードは切り捨てる）"""
+        with open(path, "rb") as f:
+            data = f.read()
+
+        offset = 0
+        replayed = 0
+        header = self.WAL_HEADER
+        while offset + header.size <= len(data):
+            length, checksum, op = header.unpack_from(data, offset)
+            payload = data[offset + header.size:offset + header.size + length]
+            if len(payload) < length or zlib.crc32(bytes([op]) + payload) != checksum:
+                break
+
+            if op == self.OP_UPSERT:
+                self._apply_upsert(ScheduledJob.model_validate_json(payload))
+            elif op == self.OP_DELETE:
+                self._apply_delete(payload.decode())
+
+            offset += header.size + length
+            replayed += 1
+
+        if offset < len(data):
+            with open(path, "r+b") as f:
+                f.truncate(offset)
+
+        return replayed
+
+    def _text(self, offset: int, length: int) -> str:
+        return bytes(self._blob[offset:offset + length]).decode()
+
+    def _materialize(self, row: Dict, booking_id: str, date: str) -> ScheduledJob:
+        """スナップショットの行から ScheduledJob を作成（検証済みの値なので model_construct）"""
+        location = None
+        if row["has_location"]:
+            location = Location.model_construct(
+                latitude=row["latitude"],
+                longitude=row["longitude"],
+                address=self._text(row["address_offset"], row["address_length"])
+            )
+        return ScheduledJob.model_construct(
+            booking_id=booking_id,
+            worker_id=self._text(row["worker_offset"], row["worker_length"]),
+            scheduled_date=date,
+            scheduled_time_start=_format_minutes(row["start"]),
+            scheduled_time_end=_format_minutes(row["end"]),
+            travel_time_minutes=row["travel_minutes"],
+            travel_distance_km=row["distance_km"],
+            location=location
+        )
+
+    def _ensure_open(self):
+        """起動時に開いていなければ、最初の参照・更新で開く"""
+        if not self._opened:
+            self.open()
+
+    def _ensure_date(self, date: str):
+        """スナップショット内のその日のジョブを索引に展開（初回のみ）"""
+        self._ensure_open()
+        if date in self._loaded:
+            return
+        self._loaded.add(date)
+
+        group = self._groups.get(date)
+        if group is None:
+            return
+
+        # 列ごとに Python の値へまとめて変換してから行を組み立てる
+        records = self._records[group[0]:group[1]]
+        names = self.RECORD.names
+        for values in zip(*[records[name].tolist() for name in names]):
+            row = dict(zip(names, values))
+            booking_id = self._text(row["booking_offset"], row["booking_length"])
+            if booking_id in self._shadowed:
+                continue
+            self._index.add(self._materialize(row, booking_id, date))
+            self._dates.setdefault(date, set()).add(booking_id)
+
+    def _locate(self, booking_id: str):
+        """booking_id がスナップショットにしかなければ、その日付を展開する"""
+        self._ensure_open()
+        if booking_id in self._index or booking_id in self._shadowed or not len(self._hashes):
+            return
+
+        key = self._hash(booking_id)
+        pos = int(np.searchsorted(self._hashes, key))
+        while pos < len(self._hashes) and int(self._hashes[pos]) == key:
+            row = self._records[int(self._hash_rows[pos])]
+            if self._text(int(row["booking_offset"]), int(row["booking_length"])) == booking_id:
+                self._ensure_date(datetime.fromordinal(int(row["date"])).strftime("%Y-%m-%d"))
+                return
+            pos += 1
+
+    # ---- 更新 ----
+
+    def _forget(self, booking_id: str) -> Optional[ScheduledJob]:
+        """
+        展開済みの索引から外して無効化する
+
+        未展開の日付にあるスナップショットの行は、_shadowed に入れることで展開時に読み飛ばす
+        （そのために日付を展開する必要はない）
+        """
+        job = self._index.remove(booking_id)
+        if job is not None:
+            self._dates[job.scheduled_date].discard(booking_id)
+        self._shadowed.add(booking_id)
+        if self._recent is not None:
+            self._recent.add(booking_id)
+        return job
+
+    def _apply_upsert(self, job: ScheduledJob):
+        self._forget(job.booking_id)
+        self._index.add(job)
+        self._dates.setdefault(job.scheduled_date, set()).add(job.booking_id)
+
+    def _apply_delete(self, booking_id: str) -> Optional[ScheduledJob]:
+        return self._forget(booking_id)
+
+    def _append(self, op: int, payload: bytes):
+        self._ensure_open()
+        self._wal.write(self.WAL_HEADER.pack(len(payload), zlib.crc32(bytes([op]) + payload), op))
+        self._wal.write(payload)
+        self._wal.flush()
+        self._written += 1
+        self._pending += 1
+
+    async def sync(self):
+        """
+        ここまでの書き込みを fsync する（グループコミット）
+
+        fsync は専用スレッドで行い、実行中の fsync があればその完了を待ってから、
+        それまでに溜まった書き込みをまとめて1回の fsync で確定する
+        """
+        if not self.fsync or self._wal is None:
+            return
+        target = self._written
+        while self._synced < target:
+            if self._syncing is None:
+                self._syncing = asyncio.ensure_future(self._fsync_wal())
+            await asyncio.shield(self._syncing)
+
+    async def _fsync_wal(self):
+        written = self._written
+        try:
+            await asyncio.get_running_loop().run_in_executor(self._io, os.fsync, self._wal.fileno())
+            self._synced = max(self._synced, written)
+        finally:
+            self._syncing = None
+
+    def _maybe_snapshot(self):
+        if self._pending < self.snapshot_every or self._snapshotting is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # イベントループの外（ツール・ベンチマーク）ではその場で書き出す
+            self.snapshot()
+            return
+        self._snapshotting = loop.create_task(self._snapshot_in_background())
+
+    def add(self, job: ScheduledJob):
+        """ジョブを登録（同じ booking_id があれば置き換え）"""
+        self._append(self.OP_UPSERT, job.model_dump_json().encode())
+        self._apply_upsert(job)
+        self._maybe_snapshot()
+
+    def remove(self, booking_id: str) -> Optional[ScheduledJob]:
+        """ジョブを削除して返す"""
+        if self.get(booking_id) is None:
+            return None
+        self._append(self.OP_DELETE, booking_id.encode())
+        job = self._apply_delete(booking_id)
+        self._maybe_snapshot()
+        return job
+
+    # ---- 参照（ScheduleIndex と同じインターフェース） ----
+
+    def __len__(self) -> int:
+        """登録件数（未展開の日付もすべて展開する）"""
+        self._ensure_open()
+        for date in list(self._groups):
+            self._ensure_date(date)
+        return len(self._index)
+
+    def __contains__(self, booking_id: str) -> bool:
+        self._locate(booking_id)
+        return booking_id in self._index
+
+    def get(self, booking_id: str) -> Optional[ScheduledJob]:
+        self._locate(booking_id)
+        return self._index.get(booking_id)
+
+    def jobs_for(self, worker_id: str, date: str) -> List[ScheduledJob]:
+        self._ensure_date(date)
+        return self._index.jobs_for(worker_id, date)
+
+    def count(self, worker_id: str, date: str) -> int:
+        self._ensure_date(date)
+        return self._index.count(worker_id, date)
+
+    def previous_job(self, worker_id: str, date: str, minute: int) -> Optional[ScheduledJob]:
+        self._ensure_date(date)
+        return self._index.previous_job(worker_id, date, minute)
+
+    def spans(self, worker_id: str, date: str) -> Iterable[Tuple[int, int]]:
+        self._ensure_date(date)
+        return self._index.spans(worker_id, date)
+
+    def next_job(self, worker_id: str, date: str, minute: int) -> Optional[ScheduledJob]:
+        self._ensure_date(date)
+        return self._index.next_job(worker_id, date, minute)
+
+    def jobs_on(self, date: str) -> List[ScheduledJob]:
+        """その日の全作業員のジョブ（作業員・開始時刻順）"""
+        self._ensure_date(date)
+        jobs = [self._index.get(booking_id) for booking_id in self._dates.get(date, ())]
+        return sorted(jobs, key=lambda job: (job.worker_id, _to_minutes(job.scheduled_time_start)))
+
+    # ---- スナップショット ----
+
+    def snapshot(self):
+        """
+        全件をスナップショットに書き出し、WAL を次の世代に切り替える（呼び出し元で完了まで行う）
+
+        新しい世代の WAL を先に作るため、途中で停止しても古いスナップショット＋
+        残っている WAL から復元できる
+        """
+        generation, old_wal, state = self._begin_snapshot()
+        self._close_wal(old_wal)
+        self._write_snapshot_file(generation, state)
+        self._finish_snapshot()
+
+    async def _snapshot_in_background(self):
+        """snapshot と同じ処理を、ファイルの書き出しだけ専用スレッドで行う"""
+        loop = asyncio.get_running_loop()
+        pending = self._pending
+        generation, old_wal, state = self._begin_snapshot()
+        try:
+            # 切り替え前の WAL の fsync・クローズは、その後に積まれる sync より先に行われる
+            closing = loop.run_in_executor(self._io, self._close_wal, old_wal)
+            await loop.run_in_executor(self._io, self._write_snapshot_file, generation, state)
+            await closing
+        except Exception:
+            # 古いスナップショットと WAL は残っているので、次の書き込みで取り直す
+            self._recent = None
+            self._pending += pending
+            return
+        finally:
+            self._snapshotting = None
+
+        if self._wal is not None:
+            self._finish_snapshot()
+
+    def _begin_snapshot(self) -> Tuple[int, object, Dict]:
+        """WAL を次の世代に切り替え、書き出す内容（切り替え時点の状態）を取得する"""
+        generation = self.generation + 1
+        old_wal = self._wal
+        self._wal = open(self._wal_path(generation), "ab")
+        self.generation = generation
+
+        # 参照するのは不変の配列・ジョブだけなので、別スレッドから読んでよい
+        state = {
+            "records": self._records,
+            "blob": self._blob,
+            "loaded": set(self._loaded),
+            "shadowed": set(self._shadowed),
+            "jobs": self._index.all_jobs()
+        }
+        self._recent = set()
+        self._pending = 0
+        return generation, old_wal, state
+
+    def _close_wal(self, wal):
+        if self.fsync:
+            os.fsync(wal.fileno())
+        wal.close()
+
+    def _write_snapshot_file(self, generation: int, state: Dict):
+        temporary = self.snapshot_path + ".tmp"
+        self._write_snapshot(temporary, generation, state)
+        os.replace(temporary, self.snapshot_path)
+
+        for old in self._wal_generations():
+            if old < generation:
+                os.remove(self._wal_path(old))
+
+    def _finish_snapshot(self):
+        """書き出したスナップショットに切り替える"""
+        # 展開済みの日付は索引にあるものが最新なので、そのまま使う
+        self._map_snapshot(self.snapshot_path)
+        self._shadowed = self._recent
+        self._recent = None
+
+    def _write_snapshot(self, path: str, generation: int, state: Dict):
+        blob = bytearray()
+        source = state["blob"]
+        shadowed_ids = state["shadowed"]
+
+        def text(offset: int, length: int) -> str:
+            return bytes(source[offset:offset + length]).decode()
+
+        def put(text: str) -> Tuple[int, int]:
+            data = text.encode()
+            offset = len(blob)
+            blob.extend(data)
+            return offset, len(data)
+
+        # 未展開の日付のうち、スナップショット以降に書き換えられていない行はそのまま引き継ぐ
+        records = state["records"]
+        loaded = np.array(
+            [datetime.strptime(date, "%Y-%m-%d").toordinal() for date in state["loaded"]], dtype="<i4"
+        )
+        keep = ~np.isin(records["date"], loaded)
+        if shadowed_ids:
+            shadowed = np.array([self._hash(booking_id) for booking_id in shadowed_ids], dtype="<u8")
+            for row in np.flatnonzero(keep & np.isin(records["booking_hash"], shadowed)):
+                record = records[row]
+                booking_id = text(int(record["booking_offset"]), int(record["booking_length"]))
+                if booking_id in shadowed_ids:
+                    keep[row] = False
+
+        kept = records[keep].copy()
+        for field in ("booking", "worker", "address"):
+            spans = [
+                put(text(offset, length))
+                for offset, length in zip(
+                    kept[f"{field}_offset"].tolist(), kept[f"{field}_length"].tolist()
+                )
+            ]
+            if spans:
+                kept[f"{field}_offset"], kept[f"{field}_length"] = zip(*spans)
+
+        # 展開済みのジョブ（RECORD のフィールド順のタプルから配列を作る）
+        rows = []
+        ordinals: Dict[str, int] = {}
+        for job in state["jobs"]:
+            date = job.scheduled_date
+            if date not in ordinals:
+                ordinals[date] = datetime.strptime(date, "%Y-%m-%d").toordinal()
+            location = job.location
+            rows.append((
+                self._hash(job.booking_id),
+                ordinals[date],
+                _to_minutes(job.scheduled_time_start),
+                _to_minutes(job.scheduled_time_end),
+                job.travel_time_minutes,
+                job.travel_distance_km,
+                location.latitude if location else 0.0,
+                location.longitude if location else 0.0,
+                location is not None,
+                *put(job.booking_id),
+                *put(job.worker_id),
+                *(put(location.address) if location else (0, 0))
+            ))
+        # 別スレッドで書き出す間もイベントループが GIL を取れるよう、配列への変換は分けて行う
+        fresh = np.concatenate([np.empty(0, dtype=self.RECORD)] + [
+            np.array(rows[i:i + self.SNAPSHOT_CHUNK], dtype=self.RECORD)
+            for i in range(0, len(rows), self.SNAPSHOT_CHUNK)
+        ])
+
+        merged = np.concatenate([kept, fresh])
+        merged = merged[np.argsort(merged["date"], kind="stable")]
+        order = np.argsort(merged["booking_hash"], kind="stable")
+
+        with open(path, "wb") as f:
+            f.write(self.HEADER.pack(self.MAGIC, self.VERSION, generation, len(merged), len(blob)))
+            for array in (merged, merged["booking_hash"][order], order.astype("<u4")):
+                f.write(b"\0" * (-f.tell() % 8))
+                f.write(np.ascontiguousarray(array).tobytes())
+            f.write(bytes(blob))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def close(self):
+        """未反映の WAL があればスナップショットを取って閉じる（次回の起動を速くする）"""
+        if self._wal is None:
+            return
+        # 実行中の fsync・スナップショットの書き出しを待つ（書き出し中だった分は取り直す）
+        self._io.shutdown(wait=True)
+        if self._pending or self._recent is not None:
+            self.snapshot()
+        self._close_wal(self._wal)
+        self._wal = None
+        self._opened = False
+
+
+class NoCapacityError(Exception):
+    """探索期間内に割り当て可能な作業員・時間帯がない"""
+
+    def __init__(self, booking_id: str, start_date: str, max_days: int):
+        super().__init__(
+            f"{start_date}から{max_days}日以内に予約 {booking_id} を割り当てられる空きがありません"
+        )
+        self.booking_id = booking_id
+        self.start_date = start_date
+        self.max_days = max_days
+
+
+class BookingConflictError(Exception):
+    """確定しようとした候補が、探索中に確定したほかの予約とすべて重なった"""
+
+    def __init__(self, booking_id: str):
+        super().__init__(f"予約 {booking_id} の候補がほかの予約の確定と重なったため割り当てられませんでした")
+        self.booking_id = booking_id
+
+
+class ScheduleOptimizer:
+    """スケジュール最適化エンジン"""
+
+    # 移動時間を考慮した余裕（分）
+    TRAVEL_BUFFER_MINUTES = 30
+
+    # 空きを探す最大日数
+    DEFAULT_HORIZON_DAYS = 14
+
+    # 希望日から1日遅れるごとの減点
+    DAY_DELAY_PENALTY = 20.0
+
+    # _calculate_score の上限（基本100 + 距離70 + 希望時間30 + 負荷20 + 緊急度20）
+    MAX_SCORE = 240.0
+
+    # 最初に評価する近傍の作業員数（空きがなければ4倍ずつ広げる）
+    CANDIDATE_WORKERS = 50
+
+    # 段階別の所要時間（秒）と件数。探索ごとに数え直し、last_search["stages"] で返す
+    # （scoring は previous_location・distance を含む。slots はスコアを計算した候補の数）
+    STAGES = ("nearest_workers", "slot_search", "scoring", "previous_location", "distance", "build_job")
+    COUNTS = ("candidate_workers", "slot_searches", "slots")
+
+    # scoring の内訳（previous_location・distance）はスコア計算1回ごとに計時するため、
+    # プロセス内で STAGE_DETAIL_EVERY 回に1回の探索だけ計る（1なら毎回）
+    STAGE_DETAIL_EVERY = 10
+    _searches = 0
+
+    def __init__(
+        self,
+        workers: List[Worker],
+        existing_jobs: List[ScheduledJob],
+        matrices: Optional[DistanceMatrixCache] = None,
+        candidate_workers: Optional[int] = None,
+        index=None
+    ):
+        self.workers = workers
+        self.existing_jobs = existing_jobs
+        # index を渡した場合は existing_jobs の代わりにそれを参照する（ScheduleStore など）
+        self.index = index if index is not None else ScheduleIndex(existing_jobs)
+        self.dist_calc = DistanceCalculator()
+        self.matrices = matrices or DistanceMatrixCache()
+        self.candidate_workers = candidate_workers or self.CANDIDATE_WORKERS
+
+        # 作業員の拠点と、日付ごとのジョブ地点の空間索引
+        self.worker_locations = SpatialIndex()
+        for worker in workers:
+            self.worker_locations.add(worker.worker_id, worker.current_location)
+        self._job_locations: Dict[str, SpatialIndex] = {}
+
+        # 直近の optimize_horizon の探索状況（完了したか、評価件数、所要時間）
+        self.last_search: Dict = {}
+        self.stage_seconds: Dict[str, float] = dict.fromkeys(self.STAGES, 0.0)
+        self.stage_counts: Dict[str, int] = dict.fromkeys(self.COUNTS, 0)
+        self.stage_detail_every = self.STAGE_DETAIL_EVERY
+        self._detailed = False
+        self._job_index_hits = self._job_index_misses = 0
+
+        # 稼働時間は取り込み時に0時からの経過分へ変換しておく
+        self._workers_by_id = {worker.worker_id: worker for worker in workers}
+        self._shifts = {
+            worker.worker_id: (
+                _time_to_minutes(worker.available_from),
+                _time_to_minutes(worker.available_to)
+            )
+            for worker in workers
+        }
+
+    def optimize(
+        self,
+        new_booking: BookingRequest,
+        target_date: str,
+        max_days: Optional[int] = None
+    ) -> Tuple[ScheduledJob, float]:
+        """
+        新規予約を最適な作業員・時間帯に割り当て
+
+        Returns:
+            (最適なスケジュール, 効率スコア)
+
+        Raises:
+            NoCapacityError: 探索期間内に空きがない場合
+        """
+        options = self.optimize_horizon(new_booking, target_date, max_days, top_k=1)
+
+        if not options:
+            raise NoCapacityError(
+                new_booking.booking_id, target_date,
+                self.DEFAULT_HORIZON_DAYS if max_days is None else max_days
+            )
+
+        return options[0]
+
+    def optimize_horizon(
+        self,
+        new_booking: BookingRequest,
+        start_date: str,
+        max_days: Optional[int] = None,
+        top_k: int = 3,
+        deadline: Optional[float] = None
+    ) -> List[Tuple[ScheduledJob, float]]:
+        """
+        開始日から max_days 日間の候補を1回の走査で評価し、上位 top_k 件を返す
+
+        希望日から離れるほど1日あたり DAY_DELAY_PENALTY を減点するため、
+        同程度の候補なら早い日が優先される。スコアの上限から上位に入り得ない日に
+        達した時点で打ち切る。空きがなければ空リストを返す。
+
+        deadline（time.time() の時刻）を指定した場合は、拠点が近い作業員から評価し、
+        候補が1件以上見つかった後に期限を過ぎたらその時点の上位候補を返す。
+        探索を最後まで行えたかは last_search["search_complete"] に記録する。
+
+        Returns:
+            [(スケジュール, 効率スコア), ...]（スコア降順）
+
+        Raises:
+            ValueError: max_days・top_k が1未満の場合
+        """
+        if max_days is None:
+            max_days = self.DEFAULT_HORIZON_DAYS
+        if max_days < 1 or top_k < 1:
+            raise ValueError("max_days と top_k は1以上を指定してください")
+
+        preferred = (
+            _to_minutes(new_booking.preferred_time) if new_booking.preferred_time else None
+        )
+        first_day = datetime.strptime(start_date, "%Y-%m-%d")
+        started = clock.time()
+        self._reset_stages()
+        row_stats = self.matrices.row_stats()
+
+        # (スコア, 日付の早さ, 評価順, 作業員, 日付, 開始分) の最小ヒープで上位k件を保持
+        top: List[Tuple[float, int, int, Worker, str, int]] = []
+        sequence = 0
+        complete = True
+        days_searched = 0
+
+        for offset in range(max_days):
+            target_date = (first_day + timedelta(days=offset)).strftime("%Y-%m-%d")
+            day_penalty = offset * self.DAY_DELAY_PENALTY
+
+            # 以降の日はどの候補も上位k件に入り得ないので打ち切る
+            if len(top) == top_k and self.MAX_SCORE - day_penalty <= top[0][0]:
+                break
+
+            days_searched += 1
+            matrix = self.matrices.for_date(target_date)
+            evaluated = set()
+            limit = self.candidate_workers
+
+            # 近い作業員から評価し、その日に空きが見つからなければ範囲を広げる
+            # （近い作業員ほど高スコアになりやすいので、期限付き探索の初期解にもなる）
+            while complete:
+                stage_start = clock.perf_counter()
+                candidates = [
+                    worker for worker in self._nearest_workers(new_booking.location, target_date, limit)
+                    if worker.worker_id not in evaluated
+                ]
+                self.stage_seconds["nearest_workers"] += clock.perf_counter() - stage_start
+                self.stage_counts["candidate_workers"] += len(candidates)
+                found_before = sequence
+
+                # 候補の拠点・既存ジョブ・新規予約の地点を距離行列にまとめて登録
+                matrix.extend(
+                    [worker.current_location for worker in candidates] +
+                    [
+                        job.location
+                        for worker in candidates
+                        for job in self.index.jobs_for(worker.worker_id, target_date)
+                        if job.location
+                    ] +
+                    [new_booking.location]
+                )
+
+                for worker in candidates:
+                    # 期限を過ぎたら、見つかっている候補で打ち切る
+                    if deadline is not None and top and clock.time() >= deadline:
+                        complete = False
+                        break
+
+                    evaluated.add(worker.worker_id)
+                    sequence = self._evaluate_worker(
+                        worker, target_date, offset, new_booking, preferred, top, top_k, sequence
+                    )
+
+                if sequence > found_before or limit >= len(self.workers):
+                    break
+                limit *= 4
+
+            if not complete:
+                break
+
+        stage_start = clock.perf_counter()
+        options = [
+            (self._build_job(new_booking, worker, date, slot_start), score)
+            for score, _, _, worker, date, slot_start in sorted(
+                top, key=lambda e: e[:3], reverse=True
+            )
+        ]
+        self.stage_seconds["build_job"] += clock.perf_counter() - stage_start
+
+        self.last_search = {
+            "search_complete": complete,
+            "candidates_evaluated": sequence,
+            "days_searched": days_searched,
+            "elapsed_ms": round((clock.time() - started) * 1000, 2),
+            "stages": self._stage_report(row_stats)
+        }
+
+        return options
+
+    def optimize_batch(
+        self,
+        bookings: List[BookingRequest],
+        target_date: str,
+        max_passes: int = 20,
+        deadline: Optional[float] = None
+    ) -> Tuple[List[ScheduledJob], List[str]]:
+        """
+        複数の予約を指定日にまとめて割り当てる
+
+        regret 挿入で初期解を作り、relocate / swap / 2-opt の局所探索で改善する。
+        結果は予約の到着順に依存しない。探索状況は last_search に記録する。
+
+        Returns:
+            (割り当て結果, 割り当てられなかった予約ID)
+        """
+        started = clock.time()
+        self._reset_stages()
+        row_stats = self.matrices.row_stats()
+
+        stage_start = clock.perf_counter()
+        batch = BatchInsertion(self, bookings, target_date)
+        unassigned = batch.insert_all(deadline)
+        insertion_score = batch.total_score()
+        inserted = clock.perf_counter()
+        unassigned, passes, converged = batch.improve(unassigned, max_passes, deadline)
+
+        # 一括割り当ては候補の評価を BatchInsertion でまとめて行うため、段階は挿入と局所探索の2つ
+        stages = self._stage_report(row_stats)
+        stages["seconds"] = {
+            "batch_insertion": inserted - stage_start,
+            "batch_local_search": clock.perf_counter() - inserted
+        }
+        stages["counts"] = {"bookings": len(bookings)}
+
+        self.last_search = {
+            "search_complete": converged,
+            "insertion_score": round(insertion_score, 2),
+            "score": round(batch.total_score(), 2),
+            "local_search_passes": passes,
+            "moves": dict(batch.stats),
+            "elapsed_ms": round((clock.time() - started) * 1000, 2),
+            "stages": stages
+        }
+
+        return batch.jobs(), [bookings[booking].booking_id for booking in unassigned]
+
+    def move_worker(self, worker: Worker):
+        """作業員の位置の更新を反映（拠点の空間索引を差し替える）"""
+        if worker.worker_id in self._workers_by_id:
+            self._workers_by_id[worker.worker_id] = worker
+            self.worker_locations.add(worker.worker_id, worker.current_location)
+
+    def _reset_stages(self):
+        for stage in self.stage_seconds:
+            self.stage_seconds[stage] = 0.0
+        for name in self.stage_counts:
+            self.stage_counts[name] = 0
+        self._job_index_hits = self._job_index_misses = 0
+
+        ScheduleOptimizer._searches += 1
+        self._detailed = ScheduleOptimizer._searches % max(1, self.stage_detail_every) == 0
+
+    def _stage_report(self, row_stats: Tuple[int, int]) -> Dict:
+        """
+        探索1回分の段階別の所要時間・件数・キャッシュの参照回数
+
+        距離行列の参照回数は探索の開始時点 row_stats からの差分
+        （スレッドで並行に実行している場合は他の探索の分を含むことがある）
+        """
+        hits, misses = self.matrices.row_stats()
+        seconds = dict(self.stage_seconds)
+        if not self._detailed:
+            del seconds["previous_location"], seconds["distance"]
+        return {
+            "seconds": seconds,
+            "counts": dict(self.stage_counts),
+            "caches": {
+                "distance_row": [hits - row_stats[0], misses - row_stats[1]],
+                "job_index": [self._job_index_hits, self._job_index_misses]
+            }
+        }
+
+    def _nearest_workers(self, location: Location, date: str, limit: int) -> List[Worker]:
+        """
+        拠点、またはその日のジョブ地点が近い順に作業員を最大 limit 人返す
+        """
+        distances: Dict[str, float] = {}
+
+        for worker_id, distance in self.worker_locations.nearest(location, k=limit):
+            distances[worker_id] = distance
+
+        for booking_id, distance in self._job_index(date).nearest(location, k=limit):
+            worker_id = self.index.get(booking_id).worker_id
+            if distance < distances.get(worker_id, float("inf")):
+                distances[worker_id] = distance
+
+        ordered = sorted(distances, key=distances.get)[:limit]
+        return [self._workers_by_id[worker_id] for worker_id in ordered if worker_id in self._workers_by_id]
+
+    def _job_index(self, date: str) -> SpatialIndex:
+        """その日のジョブ地点の空間索引（初回に作成）"""
+        job_index = self._job_locations.get(date)
+        if job_index is not None:
+            self._job_index_hits += 1
+        else:
+            self._job_index_misses += 1
+            job_index = SpatialIndex()
+            for worker in self.workers:
+                for job in self.index.jobs_for(worker.worker_id, date):
+                    if job.location:
+                        job_index.add(job.booking_id, job.location)
+            self._job_locations[date] = job_index
+        return job_index
+
+    def _evaluate_worker(
+        self,
+        worker: Worker,
+        target_date: str,
+        offset: int,
+        new_booking: BookingRequest,
+        preferred: Optional[int],
+        top: List,
+        top_k: int,
+        sequence: int
+    ) -> int:
+        """作業員の空きスロットを評価して上位候補のヒープを更新し、評価件数を返す"""
+        job_count = self.index.count(worker.worker_id, target_date)
+        day_penalty = offset * self.DAY_DELAY_PENALTY
+
+        # すでに満杯の場合はスキップ
+        if job_count >= worker.max_jobs_per_day:
+            return sequence
+
+        seconds = self.stage_seconds
+        stage_start = clock.perf_counter()
+
+        # 可能な時間スロットを探索
+        available_slots = self._find_available_slots(
+            worker,
+            new_booking.estimated_duration_minutes,
+            target_date
+        )
+
+        scoring_start = clock.perf_counter()
+        seconds["slot_search"] += scoring_start - stage_start
+        self.stage_counts["slot_searches"] += 1
+        self.stage_counts["slots"] += len(available_slots)
+
+        for slot_start, _ in available_slots:
+            # スコア計算
+            score = self._calculate_score(
+                worker,
+                target_date,
+                slot_start,
+                job_count,
+                new_booking,
+                preferred
+            ) - day_penalty
+
+            sequence += 1
+            entry = (score, -offset, -sequence, worker, target_date, slot_start)
+            if len(top) < top_k:
+                heapq.heappush(top, entry)
+            elif entry[:3] > top[0][:3]:
+                heapq.heapreplace(top, entry)
+
+        seconds["scoring"] += clock.perf_counter() - scoring_start
+        return sequence
+
+    def _build_job(
+        self,
+        booking: BookingRequest,
+        worker: Worker,
+        date: str,
+        start_minute: int
+    ) -> ScheduledJob:
+        """割り当て結果を ScheduledJob に変換（直前の位置からの移動距離・時間を含む）"""
+        schedule = ScheduledJob(
+            booking_id=booking.booking_id,
+            worker_id=worker.worker_id,
+            scheduled_date=date,
+            scheduled_time_start=_format_minutes(start_minute),
+            scheduled_time_end=_format_minutes(start_minute + booking.estimated_duration_minutes),
+            travel_time_minutes=0,
+            travel_distance_km=0.0,
+            location=booking.location
+        )
+
+        # 移動距離・時間を計算
+        prev_location = self._get_previous_location(
+            worker.worker_id,
+            start_minute,
+            date
+        )
+
+        if prev_location:
+            matrix = self.matrices.for_date(date)
+            distance = matrix.distance(prev_location, booking.location)
+            travel_time = matrix.travel_time(prev_location, booking.location)
+
+            schedule.travel_distance_km = round(distance, 2)
+            schedule.travel_time_minutes = travel_time
+
+        return schedule
+
+    def _find_available_slots(
+        self,
+        worker: Worker,
+        duration_minutes: int,
+        date: str
+    ) -> List[Tuple[int, int]]:
+        """
+        作業員の空き時間スロットを探す
+
+        Returns:
+            (開始, 終了) の一覧（0時からの経過分）
+        """
+        slots = []
+        buffer = self.TRAVEL_BUFFER_MINUTES
+
+        # その日の開始・終了時刻
+        work_start, work_end = self._shifts[worker.worker_id]
+
+        current_time = work_start
+
+        # 既存ジョブ（索引上で時間順に並んでいる）
+        for job_start, job_end in self.index.spans(worker.worker_id, date):
+            # current_time から job_start までに空きがあるか
+            if job_start - current_time >= duration_minutes + buffer:
+                slots.append((current_time, job_start - buffer))
+
+            current_time = job_end + buffer
+
+        # 最後のジョブから work_end までの空き
+        if work_end - current_time >= duration_minutes:
+            slots.append((current_time, work_end))
+
+        return slots
+
+    def _calculate_score(
+        self,
+        worker: Worker,
+        date: str,
+        start_minute: int,
+        job_count: int,
+        booking: BookingRequest,
+        preferred_minute: Optional[int]
+    ) -> float:
+        """
+        スケジュールのスコアを計算
+
+        考慮要素:
+        1. 移動距離の最小化（重要度: 高）
+        2. 顧客希望時間との一致（重要度: 中）
+        3. 作業員の負荷均等化（重要度: 低）
+        """
+        score = 100.0
+        detailed = self._detailed
+
+        # 1. 移動距離スコア（距離が短いほど高スコア）
+        if detailed:
+            stage_start = clock.perf_counter()
+        prev_location = self._get_previous_location(
+            worker.worker_id,
+            start_minute,
+            date
+        )
+        if detailed:
+            located = clock.perf_counter()
+            self.stage_seconds["previous_location"] += located - stage_start
+
+        if prev_location:
+            distance = self.matrices.for_date(date).distance(
+                prev_location,
+                booking.location
+            )
+            if detailed:
+                self.stage_seconds["distance"] += clock.perf_counter() - located
+            # 10km以内なら満点、以降は減点
+            distance_score = max(0, 50 - (distance - 10) * 2)
+            score += distance_score
+
+        # 2. 希望時間との一致スコア
+        if preferred_minute is not None:
+            time_diff_hours = abs(start_minute - preferred_minute) / 60
+            # 1時間以内なら満点、以降は減点
+            time_score = max(0, 30 - time_diff_hours * 10)
+            score += time_score
+
+        # 3. 負荷均等化スコア
+        load_score = max(0, 20 - job_count * 5)
+        score += load_score
+
+        # 4. 緊急度ボーナス
+        if booking.urgency == "high":
+            score += 20
+
+        return score
+
+    def _get_previous_location(
+        self,
+        worker_id: str,
+        minute: int,
+        date: str
+    ) -> Optional[Location]:
+        """
+        指定時刻（0時からの経過分）直前の作業員の位置を取得
+        """
+        # その日の前のジョブを探す
+        latest_job = self.index.previous_job(worker_id, date, minute)
+
+        if latest_job is None:
+            # その日の最初のジョブなら、作業員の自宅・事務所位置
+            worker = self._workers_by_id.get(worker_id)
+            return worker.current_location if worker else None
+
+        # 直近のジョブの位置
+        return latest_job.location
+
+
+class BatchInsertion:
+    """
+    複数予約の一括割り当て（regret 挿入＋局所探索）
+
+    作業員ごとのその日のルートを、既存ジョブで区切られた空き区間（ギャップ）の並びとして扱い、
+    新規ジョブはギャップの先頭から移動バッファを挟んで詰めて配置する（_find_available_slots と同じ規則）。
+    新規ジョブごとのスコアは _calculate_score と同じ基準で、その合計を最大化する:
+        - 距離: 直前の地点（同じギャップの前の新規ジョブ、前の既存ジョブ、または拠点）からの距離
+        - 希望時間: 配置された開始時刻と希望時刻の差
+        - 負荷: その日のほかのジョブ数（ルートの件数だけで決まるので O(1) で更新）
+        - 緊急度
+
+    ギャップごとのスコアを保持しておき、挿入・移動は変更のあったギャップだけを評価して
+    差分を求める（1つのギャップに入るのは max_jobs_per_day 件まで）。
+    ジョブは詰めて配置するため、ギャップに収まるかは並び順によらず空き時間だけで決まり、
+    ギャップごとの残り時間で先に判定できる。
+    """
+
+    # 改善とみなす最小のスコア差
+    EPSILON = 1e-6
+
+    def __init__(
+        self,
+        optimizer: "ScheduleOptimizer",
+        bookings: List[BookingRequest],
+        date: str,
+        candidate_workers: Optional[int] = None
+    ):
+        self.optimizer = optimizer
+        self.bookings = bookings
+        self.date = date
+        self.buffer = optimizer.TRAVEL_BUFFER_MINUTES
+        self.matrix = optimizer.matrices.for_date(date)
+        self.limit = candidate_workers or optimizer.candidate_workers
+
+        self._loc = self.matrix.extend([booking.location for booking in bookings])
+        self._duration = [booking.estimated_duration_minutes for booking in bookings]
+        self._preferred = [
+            _to_minutes(booking.preferred_time) if booking.preferred_time else None
+            for booking in bookings
+        ]
+        self._base = [100.0 + (20 if booking.urgency == "high" else 0) for booking in bookings]
+        self._distance_scores: Dict[Tuple[int, int], float] = {}
+
+        self.routes: Dict[str, Dict] = {}
+        self.candidates: List[List[str]] = [[] for _ in bookings]
+        self._add_candidates(range(len(bookings)), self.limit)
+
+        # 割り当て済みの予約 -> (作業員, ギャップ番号)
+        self.where: Dict[int, Tuple[str, int]] = {}
+
+        # 局所探索のパス中に変更のあったルート
+        self.touched = set()
+
+        self.stats = {"relocate": 0, "swap": 0, "two_opt": 0, "reinserted": 0}
+
+    def _add_candidates(self, bookings: Iterable[int], limit: int):
+        """予約ごとの候補作業員（拠点・その日のジョブ地点が近い順に limit 人）とそのルートを用意"""
+        added = set()
+        for booking in bookings:
+            nearest = self.optimizer._nearest_workers(self.bookings[booking].location, self.date, limit)
+            self.candidates[booking] = [worker.worker_id for worker in nearest]
+            added.update(worker_id for worker_id in self.candidates[booking] if worker_id not in self.routes)
+
+        # 新しい作業員の拠点・既存ジョブの地点を距離行列にまとめて登録
+        worker_ids = sorted(added)
+        self.matrix.extend(
+            [self.optimizer._workers_by_id[worker_id].current_location for worker_id in worker_ids] +
+            [
+                job.location
+                for worker_id in worker_ids
+                for job in self.optimizer.index.jobs_for(worker_id, self.date)
+                if job.location
+            ]
+        )
+        for worker_id in worker_ids:
+            self.routes[worker_id] = self._build_route(worker_id)
+
+    def _build_route(self, worker_id: str) -> Dict:
+        """既存ジョブの間の空き区間を (開始, 終了の上限, 直前の地点) として並べる"""
+        worker = self.optimizer._workers_by_id[worker_id]
+        work_start, work_end = self.optimizer._shifts[worker_id]
+        fixed = self.optimizer.index.jobs_for(worker_id, self.date)
+
+        gaps = []
+        cursor = work_start
+        prev = self.matrix.index_of(worker.current_location)
+        for job in fixed:
+            limit = _to_minutes(job.scheduled_time_start) - self.buffer
+            gaps.append({
+                "start": cursor,
+                "limit": limit,
+                "prev": prev,
+                "jobs": [],
+                "cost": 0.0,
+                "free": limit - cursor
+            })
+            cursor = _to_minutes(job.scheduled_time_end) + self.buffer
+            # 地点のないジョブの直後は距離スコアなし（_calculate_score と同じ）
+            prev = self.matrix.index_of(job.location) if job.location else -1
+        gaps.append({
+            "start": cursor,
+            "limit": work_end,
+            "prev": prev,
+            "jobs": [],
+            "cost": 0.0,
+            "free": work_end - cursor
+        })
+
+        return {
+            "worker_id": worker_id,
+            "gaps": gaps,
+            "fixed": len(fixed),
+            "new": 0,
+            "max_jobs": worker.max_jobs_per_day
+        }
+
+    def _distance_score(self, prev: int, booking: int) -> float:
+        if prev < 0:
+            return 0.0
+        key = (prev, booking)
+        score = self._distance_scores.get(key)
+        if score is None:
+            distance = float(self.matrix.row(self._loc[booking])[0][prev])
+            # 10km以内なら満点、以降は減点
+            score = max(0, 50 - (distance - 10) * 2)
+            self._distance_scores[key] = score
+        return score
+
+    def _gap_cost(self, gap: Dict, jobs: List[int]) -> float:
+        """ギャップに jobs を順に詰めたときのスコア合計（負荷を除く。収まるかは呼び出し側で判定）"""
+        minute = gap["start"]
+        prev = gap["prev"]
+        total = 0.0
+
+        for booking in jobs:
+            end = minute + self._duration[booking]
+            total += self._base[booking] + self._distance_score(prev, booking)
+            preferred = self._preferred[booking]
+            if preferred is not None:
+                total += max(0, 30 - abs(minute - preferred) / 60 * 10)
+
+            prev = self._loc[booking]
+            minute = end + self.buffer
+
+        return total
+
+    @staticmethod
+    def _load(route: Dict, new: int) -> float:
+        """新規ジョブ new 件の負荷スコアの合計（その日のほかのジョブ数で決まる）"""
+        return new * max(0, 20 - (route["fixed"] + new - 1) * 5)
+
+    def _load_delta(self, route: Dict, change: int) -> Optional[float]:
+        new = route["new"] + change
+        if route["fixed"] + new > route["max_jobs"]:
+            return None
+        return self._load(route, new) - self._load(route, route["new"])
+
+    def best_insertion(self, booking: int, worker_id: str) -> Optional[Tuple[float, int, int]]:
+        """作業員のルートへの最良の挿入 (スコア増分, ギャップ, 位置)"""
+        route = self.routes[worker_id]
+        load = self._load_delta(route, 1)
+        if load is None:
+            return None
+
+        best = None
+        for g, gap in enumerate(route["gaps"]):
+            if self._duration[booking] > gap["free"]:
+                continue
+            jobs = gap["jobs"]
+            for pos in range(len(jobs) + 1):
+                cost = self._gap_cost(gap, jobs[:pos] + [booking] + jobs[pos:])
+                delta = cost - gap["cost"] + load
+                if best is None or delta > best[0] + self.EPSILON:
+                    best = (delta, g, pos)
+        return best
+
+    def _set_gap(self, route: Dict, g: int, jobs: List[int], cost: float):
+        gap = route["gaps"][g]
+        gap["jobs"] = jobs
+        gap["cost"] = cost
+        # 残り時間（次に詰める新規ジョブが使える長さ）
+        gap["free"] = gap["limit"] - gap["start"] - sum(self._duration[b] + self.buffer for b in jobs)
+        for booking in jobs:
+            self.where[booking] = (route["worker_id"], g)
+        self.touched.add(route["worker_id"])
+
+    def _insert(self, booking: int, worker_id: str, g: int, pos: int):
+        route = self.routes[worker_id]
+        gap = route["gaps"][g]
+        jobs = gap["jobs"][:pos] + [booking] + gap["jobs"][pos:]
+        self._set_gap(route, g, jobs, self._gap_cost(gap, jobs))
+        route["new"] += 1
+
+    def insert_all(self, deadline: Optional[float] = None) -> List[int]:
+        """
+        全予約を挿入し、割り当てられなかった予約を返す
+
+        候補の作業員に空きがなければ、optimize_horizon と同様に候補を4倍ずつ広げる
+        """
+        pending = list(range(len(self.bookings)))
+        limit = self.limit
+
+        while True:
+            self._insert_greedy(pending, deadline)
+            pending = [booking for booking in pending if booking not in self.where]
+
+            if not pending or limit >= len(self.optimizer.workers):
+                return pending
+            if deadline is not None and clock.time() >= deadline:
+                return pending
+
+            limit *= 4
+            self._add_candidates(pending, limit)
+
+    def _insert_greedy(self, bookings: List[int], deadline: Optional[float]):
+        """
+        regret 挿入: 最良と次点のルートのスコア差が大きい予約（後回しにすると損が大きい予約）から確定する
+
+        予約×候補ルートの最良挿入を表に保持し、確定で変わったルートの分だけ再評価する。
+        同点は予約IDで決めるため、予約の到着順に依存しない。
+        """
+        insertions: Dict[int, Dict[str, Tuple[float, int, int]]] = {}
+        watchers: Dict[str, List[int]] = {}
+        version = {booking: 0 for booking in bookings}
+        heap = []
+
+        def push(booking: int):
+            # 以前に積んだ候補は無効になる
+            version[booking] += 1
+            options = sorted(
+                (option[0], worker_id) for worker_id, option in insertions[booking].items()
+            )
+            if not options:
+                return
+            # 候補が1つしかなければ最優先
+            regret = options[-1][0] - options[-2][0] if len(options) > 1 else float("inf")
+            heapq.heappush(heap, (
+                -regret, -options[-1][0], self.bookings[booking].booking_id,
+                version[booking], booking, options[-1][1]
+            ))
+
+        for booking in bookings:
+            insertions[booking] = {}
+            for worker_id in self.candidates[booking]:
+                watchers.setdefault(worker_id, []).append(booking)
+                best = self.best_insertion(booking, worker_id)
+                if best is not None:
+                    insertions[booking][worker_id] = best
+            push(booking)
+
+        while heap:
+            if deadline is not None and clock.time() >= deadline:
+                break
+            *_, seen, booking, worker_id = heapq.heappop(heap)
+            if booking in self.where or seen != version[booking]:
+                continue
+
+            _, g, pos = insertions[booking][worker_id]
+            self._insert(booking, worker_id, g, pos)
+
+            # このルートを候補に持つ予約だけを再評価
+            for other in watchers[worker_id]:
+                if other in self.where:
+                    continue
+                best = self.best_insertion(other, worker_id)
+                if best is None:
+                    insertions[other].pop(worker_id, None)
+                else:
+                    insertions[other][worker_id] = best
+                push(other)
+
+    def _relocate(self, booking: int) -> bool:
+        """予約を別の位置（同じ作業員の別ギャップ・別の作業員を含む）へ移して改善するか試す"""
+        worker_id, g = self.where[booking]
+        route = self.routes[worker_id]
+        gap = route["gaps"][g]
+        jobs = gap["jobs"]
+        pos = jobs.index(booking)
+        remaining = jobs[:pos] + jobs[pos + 1:]
+        removed_cost = self._gap_cost(gap, remaining)
+        removal = removed_cost - gap["cost"]
+
+        best = None
+        for target in self.candidates[booking]:
+            target_route = self.routes[target]
+            if target == worker_id:
+                load = 0.0
+            else:
+                load = self._load_delta(target_route, 1)
+                if load is None:
+                    continue
+                load += self._load_delta(route, -1)
+
+            for tg, target_gap in enumerate(target_route["gaps"]):
+                same_gap = target == worker_id and tg == g
+                if not same_gap and self._duration[booking] > target_gap["free"]:
+                    continue
+                base = remaining if same_gap else target_gap["jobs"]
+                for tpos in range(len(base) + 1):
+                    if same_gap and tpos == pos:
+                        continue
+                    candidate = base[:tpos] + [booking] + base[tpos:]
+                    cost = self._gap_cost(target_gap, candidate)
+                    if same_gap:
+                        delta = cost - gap["cost"]
+                    else:
+                        delta = removal + cost - target_gap["cost"] + load
+                    if delta > self.EPSILON and (best is None or delta > best[0]):
+                        best = (delta, target, tg, candidate, cost)
+
+        if best is None:
+            return False
+
+        _, target, tg, candidate, cost = best
+        if not (target == worker_id and tg == g):
+            self._set_gap(route, g, remaining, removed_cost)
+            route["new"] -= 1
+            self.routes[target]["new"] += 1
+        self._set_gap(self.routes[target], tg, candidate, cost)
+        self.stats["relocate"] += 1
+        return True
+
+    def _swap(self, booking: int) -> bool:
+        """別の作業員に割り当てられた予約と位置を入れ替えて改善するか試す（件数は変わらない）"""
+        worker_id, g = self.where[booking]
+        gap = self.routes[worker_id]["gaps"][g]
+        pos = gap["jobs"].index(booking)
+        duration = self._duration[booking]
+
+        for target in self.candidates[booking]:
+            if target == worker_id:
+                continue
+            for tg, target_gap in enumerate(self.routes[target]["gaps"]):
+                for tpos, other in enumerate(target_gap["jobs"]):
+                    # 入れ替えた後も両方のギャップに収まるか
+                    if (self._duration[other] > gap["free"] + duration or
+                            duration > target_gap["free"] + self._duration[other]):
+                        continue
+                    jobs = gap["jobs"][:pos] + [other] + gap["jobs"][pos + 1:]
+                    cost = self._gap_cost(gap, jobs)
+                    target_jobs = target_gap["jobs"][:tpos] + [booking] + target_gap["jobs"][tpos + 1:]
+                    target_cost = self._gap_cost(target_gap, target_jobs)
+                    delta = cost - gap["cost"] + target_cost - target_gap["cost"]
+                    if delta > self.EPSILON:
+                        self._set_gap(self.routes[worker_id], g, jobs, cost)
+                        self._set_gap(self.routes[target], tg, target_jobs, target_cost)
+                        self.stats["swap"] += 1
+                        return True
+        return False
+
+    def _two_opt(self, route: Dict) -> bool:
+        """ギャップ内の区間を反転して改善するか試す"""
+        improved = False
+        for g, gap in enumerate(route["gaps"]):
+            jobs = gap["jobs"]
+            for i in range(len(jobs) - 1):
+                for j in range(i + 1, len(jobs)):
+                    candidate = jobs[:i] + jobs[i:j + 1][::-1] + jobs[j + 1:]
+                    cost = self._gap_cost(gap, candidate)
+                    if cost - gap["cost"] > self.EPSILON:
+                        self._set_gap(route, g, candidate, cost)
+                        jobs = candidate
+                        self.stats["two_opt"] += 1
+                        improved = True
+        return improved
+
+    def improve(
+        self,
+        unassigned: List[int],
+        max_passes: int = 20,
+        deadline: Optional[float] = None
+    ) -> Tuple[List[int], int, bool]:
+        """
+        局所探索: 改善がなくなるまで relocate / swap / 2-opt を繰り返す
+
+        各パスの終わりに、空きができたルートへ未割り当ての予約を挿入し直す。
+
+        Returns:
+            (未割り当ての予約, 実行したパス数, 収束したか)
+        """
+        passes = 0
+        order = sorted(range(len(self.bookings)), key=lambda b: self.bookings[b].booking_id)
+        unassigned = sorted(unassigned, key=lambda b: self.bookings[b].booking_id)
+        changed = set(self.routes)
+
+        for passes in range(1, max_passes + 1):
+            improved = False
+            self.touched = set()
+
+            # 前のパスで変更のあったルートに関わる予約だけを見直す
+            for booking in order:
+                if booking not in self.where:
+                    continue
+                if self.where[booking][0] not in changed and changed.isdisjoint(self.candidates[booking]):
+                    continue
+                if deadline is not None and clock.time() >= deadline:
+                    return unassigned, passes, False
+                improved |= self._relocate(booking)
+                improved |= self._swap(booking)
+
+            for worker_id in sorted(changed | self.touched):
+                improved |= self._two_opt(self.routes[worker_id])
+
+            still_unassigned = []
+            for booking in unassigned:
+                options = [
+                    (best, worker_id)
+                    for worker_id in self.candidates[booking]
+                    for best in [self.best_insertion(booking, worker_id)]
+                    if best is not None
+                ]
+                if options:
+                    best, worker_id = max(options, key=lambda o: o[0][0])
+                    self._insert(booking, worker_id, best[1], best[2])
+                    self.stats["reinserted"] += 1
+                    improved = True
+                else:
+                    still_unassigned.append(booking)
+            unassigned = still_unassigned
+            changed = self.touched
+
+            if not improved:
+                return unassigned, passes, True
+
+        return unassigned, passes, False
+
+    def total_score(self) -> float:
+        return sum(
+            sum(gap["cost"] for gap in route["gaps"]) + self._load(route, route["new"])
+            for route in self.routes.values()
+        )
+
+    def jobs(self) -> List[ScheduledJob]:
+        """割り当て結果を ScheduledJob に変換（直前の地点からの移動距離・時間を含む）"""
+        jobs = []
+        for worker_id in sorted(self.routes):
+            for gap in self.routes[worker_id]["gaps"]:
+                minute = gap["start"]
+                prev = gap["prev"]
+                for booking in gap["jobs"]:
+                    request = self.bookings[booking]
+                    end = minute + self._duration[booking]
+                    job = ScheduledJob(
+                        booking_id=request.booking_id,
+                        worker_id=worker_id,
+                        scheduled_date=self.date,
+                        scheduled_time_start=_format_minutes(minute),
+                        scheduled_time_end=_format_minutes(end),
+                        travel_time_minutes=0,
+                        travel_distance_km=0.0,
+                        location=request.location
+                    )
+                    if prev >= 0:
+                        distance, travel = self.matrix.row(prev)
+                        job.travel_distance_km = round(float(distance[self._loc[booking]]), 2)
+                        job.travel_time_minutes = int(travel[self._loc[booking]])
+                    jobs.append(job)
+                    prev = self._loc[booking]
+                    minute = end + self.buffer
+        return jobs
+
+
+class FleetAvailability:
+    """
+    作業員・日付ごとの空き状況ビットマップ
+
+    1日を15分単位の96スロットに分け、ビットi が [15i, 15i+15) 分の空きを表す。
+    稼働時間内のスロットを立て、既存ジョブの前後30分（移動の余裕）を含む範囲を落とす。
+    予約・キャンセル時は該当する作業員・日付のビットマップだけを更新する。
+    ビットマップは最近使った max_dates 日分まで保持し（古い日付から破棄）、
+    日付が変わった後に新しい日付を作るとき、過ぎた日付もまとめて破棄する。
+    """
+
+    SLOT_MINUTES = 15
+    SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+    MAX_DATES = 64
+
+    def __init__(self, workers: List[Worker], index=None, max_dates: int = MAX_DATES):
+        self.workers = workers
+        self.index = index if index is not None else ScheduleIndex()
+        self.max_dates = max(1, max_dates)
+        # 日付 -> 作業員ID -> ビットマップ。末尾が最近使った日付
+        self._bitmaps: "OrderedDict[str, Dict[str, int]]" = OrderedDict()
+        # 過ぎた日付を最後に破棄した日（その日のうちは再走査しない）
+        self._swept: Optional[str] = None
+        # 空きの確認と予約の反映をまとめて行うためのロック（try_book）
+        self._lock = threading.Lock()
+
+        # 日付ごとのジョブ地点の空間索引（作成済みの日付は予約・キャンセル時に差分更新）
+        self.job_locations: Dict[str, SpatialIndex] = {}
+
+        # 作業員ごとの稼働時間マスクと拠点座標は取り込み時に作っておく
+        self._shift_masks = {
+            worker.worker_id: self._range_mask(
+                -(-_time_to_minutes(worker.available_from) // self.SLOT_MINUTES),
+                _time_to_minutes(worker.available_to) // self.SLOT_MINUTES
+            )
+            for worker in workers
+        }
+        self._lat = np.array([w.current_location.latitude for w in workers])
+        self._lon = np.array([w.current_location.longitude for w in workers])
+        self._rows = {worker.worker_id: i for i, worker in enumerate(workers)}
+
+    @staticmethod
+    def _range_mask(first_slot: int, end_slot: int) -> int:
+        """[first_slot, end_slot) のビットを立てたマスク"""
+        first_slot = max(0, first_slot)
+        if end_slot <= first_slot:
+            return 0
+        return ((1 << (end_slot - first_slot)) - 1) << first_slot
+
+    def _job_mask(self, start_minute: int, end_minute: int) -> int:
+        """ジョブと前後の移動余裕が占めるスロットのマスク"""
+        buffer = ScheduleOptimizer.TRAVEL_BUFFER_MINUTES
+        return self._range_mask(
+            (start_minute - buffer) // self.SLOT_MINUTES,
+            -(-(end_minute + buffer) // self.SLOT_MINUTES)
+        )
+
+    def bitmap(self, worker_id: str, date: str) -> int:
+        """作業員のその日の空きビットマップ（未計算なら索引から作成）"""
+        bitmaps = self._bitmaps.get(date)
+        if bitmaps is None:
+            self._evict()
+            bitmaps = self._bitmaps[date] = {}
+        else:
+            self._bitmaps.move_to_end(date)
+
+        bitmap = bitmaps.get(worker_id)
+        if bitmap is None:
+            bitmap = self._shift_masks.get(worker_id, 0)
+            for start, end in self.index.spans(worker_id, date):
+                bitmap &= ~self._job_mask(start, end)
+            bitmaps[worker_id] = bitmap
+        return bitmap
+
+    def _evict(self):
+        """過ぎた日付のビットマップと、上限を超える古い日付のビットマップを破棄"""
+        today = datetime.now().strftime("%Y-%m-%d")
+        if today != self._swept:
+            self._swept = today
+            for date in [date for date in self._bitmaps if date < today]:
+                del self._bitmaps[date]
+        while len(self._bitmaps) >= self.max_dates:
+            self._bitmaps.popitem(last=False)
+
+    def book(self, job: ScheduledJob):
+        """予約を反映（該当スロットのビットを落とす。割り当て済みの予約なら先に取り消す）"""
+        if job.booking_id in self.index:
+            self.cancel(job.booking_id)
+        self.index.add(job)
+
+        job_index = self.job_locations.get(job.scheduled_date)
+        if job_index is not None and job.location:
+            job_index.add(job.booking_id, job.location)
+
+        bitmaps = self._bitmaps.get(job.scheduled_date)
+        if bitmaps is not None and job.worker_id in bitmaps:
+            bitmaps[job.worker_id] &= ~self._job_mask(
+                _to_minutes(job.scheduled_time_start),
+                _to_minutes(job.scheduled_time_end)
+            )
+
+    def try_book(self, job: ScheduledJob) -> bool:
+        """
+        予約がまだ空いている時間に収まる場合だけ反映する
+
+        最適化の結果は探索を始めた時点の状態で計算されているため、その間にほかの
+        リクエストが確定したジョブと重ならないかを確定の直前に確認する。
+        稼働時間・1日の上限件数・同じ作業員の既存ジョブ（前後の移動余裕を含む。
+        同じ予約の現在の割り当ては除く）と照合し、重なる場合は反映せず False を返す
+        """
+        with self._lock:
+            if not self._still_free(job):
+                return False
+            self.book(job)
+            return True
+
+    def _still_free(self, job: ScheduledJob) -> bool:
+        row = self._rows.get(job.worker_id)
+        if row is None:
+            return False
+        worker = self.workers[row]
+        start = _to_minutes(job.scheduled_time_start)
+        end = _to_minutes(job.scheduled_time_end)
+        if start < _time_to_minutes(worker.available_from) or end > _time_to_minutes(worker.available_to):
+            return False
+
+        buffer = ScheduleOptimizer.TRAVEL_BUFFER_MINUTES
+        count = 0
+        for other in self.index.jobs_for(job.worker_id, job.scheduled_date):
+            if other.booking_id == job.booking_id:
+                continue
+            if start < _to_minutes(other.scheduled_time_end) + buffer and \
+                    _to_minutes(other.scheduled_time_start) < end + buffer:
+                return False
+            count += 1
+        return count < worker.max_jobs_per_day
+
+    def cancel(self, booking_id: str) -> Optional[ScheduledJob]:
+        """キャンセルを反映（前後の余裕が重なるため、その作業員・日付だけ作り直す）"""
+        job = self.index.remove(booking_id)
+        if job is not None:
+            bitmaps = self._bitmaps.get(job.scheduled_date)
+            if bitmaps is not None:
+                bitmaps.pop(job.worker_id, None)
+            job_index = self.job_locations.get(job.scheduled_date)
+            if job_index is not None:
+                job_index.remove(booking_id)
+        return job
+
+    def fitting_starts(self, worker_id: str, date: str, duration_minutes: int) -> int:
+        """
+        duration_minutes の作業を開始できるスロットのビットマップ
+
+        ビットi は スロットi から必要数のスロットが連続して空いていることを表す
+        """
+        free = self.bitmap(worker_id, date)
+        needed = max(1, -(-duration_minutes // self.SLOT_MINUTES))
+
+        # 連続する空きの判定をシフトの倍々で行う
+        fits = free
+        span = 1
+        while span < needed and fits:
+            step = min(span, needed - span)
+            fits &= fits >> step
+            span += step
+        return fits
+
+    def move_worker(self, worker: Worker):
+        """作業員の位置の更新を反映（作業員一覧の該当要素も置き換える）"""
+        row = self._rows.get(worker.worker_id)
+        if row is not None:
+            self.workers[row] = worker
+            self._lat[row] = worker.current_location.latitude
+            self._lon[row] = worker.current_location.longitude
+
+    def workers_near(self, location: Location, radius_km: float) -> List[Worker]:
+        """拠点が半径 radius_km 以内の作業員"""
+        if not self.workers:
+            return []
+        distances = DistanceCalculator.haversine_matrix(
+            np.array([location.latitude]), np.array([location.longitude]),
+            self._lat, self._lon
+        )[0]
+        return [self.workers[i] for i in np.flatnonzero(distances <= radius_km)]
+
+    @classmethod
+    def slot_minutes(cls, bits: int) -> List[int]:
+        """ビットマップの立っているスロットの開始時刻（分）"""
+        minutes = []
+        while bits:
+            low = bits & -bits
+            minutes.append((low.bit_length() - 1) * cls.SLOT_MINUTES)
+            bits ^= low
+        return minutes
+
+
+class WorkerPositions:
+    """
+    作業員の現在位置テーブル（GPS の位置通知の取り込み）
+
+    作業員ごとの最新の緯度経度・通知時刻を行番号で引く配列に持ち、
+    位置通知はまとめて NumPy で反映する（同じ作業員の通知は最新の1件にまとめ、
+    保持しているものより古い通知は捨てる）。
+
+    Worker.current_location は、前回反映した位置から threshold_km 以上離れたときだけ
+    新しい位置に差し替える。それ未満のずれは距離・移動時間の誤差として許容し、
+    計算済みの距離行列や空間索引をそのまま使う。
+    """
+
+    def __init__(self, workers: List[Worker], threshold_km: float = 0.5):
+        self.workers = workers
+        self.threshold_km = threshold_km
+        self._rows = {worker.worker_id: i for i, worker in enumerate(workers)}
+
+        self._lat = np.array([w.current_location.latitude for w in workers], dtype=np.float64)
+        self._lon = np.array([w.current_location.longitude for w in workers], dtype=np.float64)
+        # 通知時刻（UNIX秒。まだ通知がなければ0）
+        self._time = np.zeros(len(workers))
+        # current_location に反映済みの位置
+        self._anchor_lat = self._lat.copy()
+        self._anchor_lon = self._lon.copy()
+
+        self.stats = {"pings": 0, "unknown": 0, "stale": 0, "moved": 0}
+
+    def ingest(
+        self,
+        worker_ids: List[str],
+        latitudes: Iterable[float],
+        longitudes: Iterable[float],
+        timestamps: Iterable[float]
+    ) -> List[Tuple[Worker, Worker]]:
+        """
+        位置通知をまとめて反映する
+
+        Returns:
+            current_location を差し替えた作業員の (変更前, 変更後) の一覧
+        """
+        count = len(worker_ids)
+        self.stats["pings"] += count
+        if not count:
+            return []
+
+        rows = np.fromiter(
+            (self._rows.get(worker_id, -1) for worker_id in worker_ids), dtype=np.int64, count=count
+        )
+        lat = np.asarray(latitudes, dtype=np.float64)
+        lon = np.asarray(longitudes, dtype=np.float64)
+        ts = np.asarray(timestamps, dtype=np.float64)
+
+        # 作業員ごとに通知時刻が最新の1件を残す（未登録の作業員は捨てる）
+        order = np.lexsort((ts, rows))
+        order = order[rows[order] >= 0]
+        self.stats["unknown"] += count - len(order)
+
+        rows = rows[order]
+        last = np.ones(len(rows), dtype=bool)
+        last[:-1] = rows[1:] != rows[:-1]
+        order, rows = order[last], rows[last]
+
+        # 保持している位置より古い通知は捨てる
+        fresh = ts[order] >= self._time[rows]
+        self.stats["stale"] += len(rows) - int(fresh.sum())
+        order, rows = order[fresh], rows[fresh]
+
+        self._lat[rows] = lat[order]
+        self._lon[rows] = lon[order]
+        self._time[rows] = ts[order]
+
+        # 反映済みの位置からのずれ（ハーバサインの要素ごとの計算）
+        lat1, lon1 = np.radians(self._anchor_lat[rows]), np.radians(self._anchor_lon[rows])
+        lat2, lon2 = np.radians(self._lat[rows]), np.radians(self._lon[rows])
+        a = (np.sin((lat2 - lat1) / 2) ** 2 +
+             np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2)
+        drift = 2 * 6371 * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+        moved = []
+        for row in rows[drift >= self.threshold_km].tolist():
+            before = self.workers[row]
+            # 値は検証済みなので検証なしで作る（model_copy より大幅に速い）
+            after = Worker.model_construct(**{
+                **before.__dict__,
+                "current_location": Location.model_construct(
+                    latitude=float(self._lat[row]),
+                    longitude=float(self._lon[row]),
+                    address="現在地"
+                )
+            })
+            self.workers[row] = after
+            self._anchor_lat[row] = self._lat[row]
+            self._anchor_lon[row] = self._lon[row]
+            moved.append((before, after))
+
+        self.stats["moved"] += len(moved)
+        return moved
+
+    def worker(self, worker_id: str) -> Optional[Worker]:
+        row = self._rows.get(worker_id)
+        return self.workers[row] if row is not None else None
+
+    def position(self, worker_id: str) -> Optional[Dict]:
+        """作業員の最新の位置（通知がなければ登録時の位置、reported_at は None）"""
+        row = self._rows.get(worker_id)
+        if row is None:
+            return None
+        reported_at = float(self._time[row])
+        return {
+            "latitude": float(self._lat[row]),
+            "longitude": float(self._lon[row]),
+            "reported_at": reported_at or None,
+            "age_seconds": round(clock.time() - reported_at, 1) if reported_at else None
+        }
+
+
+class ScheduleRepair:
+    """
+    キャンセル・時間変更後の差分再最適化
+
+    変更のあった作業員・日付を dirty として記録し、その分だけを見直す（全体は再計算しない）:
+    - 時間が延びた・移ったジョブと重なるジョブは外して、optimize で割り当て直す
+    - 空きのできた作業員・日付には、同じ日の近くのジョブのうち同じ時刻のまま移した方が
+      MIN_GAIN 以上スコアが上がるものを移す。移した元も dirty になり、
+      1回の run で移すのは max_moves 件まで（残りは次回に持ち越す）
+
+    スコアは _calculate_score を使う。確定済みジョブの希望時刻は、現在の開始時刻とみなす。
+    変更は {"type", "booking_id", "before", "after"} の差分として返す。
+    """
+
+    # 移動を行う最小のスコア改善
+    MIN_GAIN = 5.0
+
+    # 空きに移す候補として見る、作業員の拠点・ジョブ地点ごとの近傍ジョブ数
+    CANDIDATE_JOBS = 30
+
+    def __init__(
+        self,
+        availability: FleetAvailability,
+        matrices: Optional[DistanceMatrixCache] = None,
+        max_moves: int = 20
+    ):
+        self.availability = availability
+        self.max_moves = max_moves
+        self.dirty: set = set()
+
+        # 確定済みスケジュールを直接参照する最適化エンジン。ジョブ地点の空間索引は
+        # FleetAvailability が予約・キャンセルのたびに更新するものを共有する
+        self.optimizer = ScheduleOptimizer(
+            availability.workers, [], matrices or DistanceMatrixCache(), index=availability.index
+        )
+        self.optimizer._job_locations = availability.job_locations
+
+    @staticmethod
+    def _as_booking(job: ScheduledJob) -> BookingRequest:
+        """確定済みジョブを割り当て直し用の予約に戻す（location のあるジョブのみ）"""
+        return BookingRequest(
+            booking_id=job.booking_id,
+            customer_name="",
+            location=job.location,
+            preferred_date=job.scheduled_date,
+            preferred_time=job.scheduled_time_start,
+            estimated_duration_minutes=(
+                _to_minutes(job.scheduled_time_end) - _to_minutes(job.scheduled_time_start)
+            )
+        )
+
+    @staticmethod
+    def _diff(kind: str, before: Optional[ScheduledJob], after: Optional[ScheduledJob]) -> Dict:
+        return {
+            "type": kind,
+            "booking_id": (after or before).booking_id,
+            "before": before,
+            "after": after
+        }
+
+    def cancel(self, booking_id: str) -> List[Dict]:
+        """キャンセルを反映し、空いた作業員・日付を dirty にする"""
+        job = self.availability.cancel(booking_id)
+        if job is None:
+            raise KeyError(booking_id)
+
+        self.dirty.add((job.worker_id, job.scheduled_date))
+        diffs = [self._diff("cancelled", job, None)]
+        diffs += self._refresh_next(job.worker_id, job.scheduled_date, _to_minutes(job.scheduled_time_start))
+        return diffs
+
+    def _rebuild(self, job: ScheduledJob, worker: Worker, date: str, start: int) -> ScheduledJob:
+        """
+        ジョブを作業員・日付・開始時刻に置き直す。location のないジョブは移動距離・時間を
+        計算できないので、担当と時刻だけを替える
+        """
+        if job.location is None:
+            duration = _to_minutes(job.scheduled_time_end) - _to_minutes(job.scheduled_time_start)
+            return job.model_copy(update={
+                "worker_id": worker.worker_id,
+                "scheduled_date": date,
+                "scheduled_time_start": _format_minutes(start),
+                "scheduled_time_end": _format_minutes(start + duration),
+                "travel_time_minutes": 0,
+                "travel_distance_km": 0.0
+            })
+        return self.optimizer._build_job(self._as_booking(job), worker, date, start)
+
+    def _fits(self, worker: Worker, date: str, start: int, end: int) -> bool:
+        """作業員のその日の空きに、start〜end をそのまま入れられるか"""
+        if self.availability.index.count(worker.worker_id, date) >= worker.max_jobs_per_day:
+            return False
+        slots = self.optimizer._find_available_slots(worker, end - start, date)
+        return any(slot_start <= start and end <= slot_end for slot_start, slot_end in slots)
+
+    def _reassign(self, job: ScheduledJob) -> Optional[ScheduledJob]:
+        """
+        外したジョブを、同じ日付・開始時刻のまま別の作業員に割り当て直す
+
+        顧客と約束した時刻は変えない（_absorb と同じ）。入れられる作業員のうち
+        スコアが最も高い作業員に割り当てる。どこにも入らなければ None
+        """
+        optimizer = self.optimizer
+        date = job.scheduled_date
+        start = _to_minutes(job.scheduled_time_start)
+        end = _to_minutes(job.scheduled_time_end)
+        booking = self._as_booking(job) if job.location is not None else None
+
+        best = None
+        for worker in optimizer.workers:
+            if worker.worker_id == job.worker_id or not self._fits(worker, date, start, end):
+                continue
+            score = 0.0 if booking is None else optimizer._calculate_score(
+                worker, date, start, self.availability.index.count(worker.worker_id, date), booking, start
+            )
+            if best is None or score > best[0]:
+                best = (score, worker)
+
+        if best is None:
+            return None
+        return self._rebuild(job, best[1], date, start)
+
+    def _refresh_next(self, worker_id: str, date: str, minute: int) -> List[Dict]:
+        """
+        minute 以降に始まる直近のジョブの移動距離・時間を、現在の直前の位置から計算し直す
+        （直前のジョブが移った・外れた場合）。値が変わったときだけ反映して差分を返す
+        """
+        job = self.availability.index.next_job(worker_id, date, minute)
+        worker = self.optimizer._workers_by_id.get(worker_id)
+        if job is None or job.location is None or worker is None:
+            return []
+
+        refreshed = self.optimizer._build_job(
+            self._as_booking(job), worker, date, _to_minutes(job.scheduled_time_start)
+        )
+        if (refreshed.travel_time_minutes, refreshed.travel_distance_km) == \
+                (job.travel_time_minutes, job.travel_distance_km):
+            return []
+        self.availability.book(refreshed)
+        return [self._diff("updated", job, refreshed)]
+
+    def reschedule(self, booking_id: str, changes: Dict) -> List[Dict]:
+        """
+        作業員・日付・時刻の変更（作業の延長を含む）を反映する
+
+        変更後の時間は作業員の稼働時間内であること（外なら ValueError）。
+        変更後の時間と重なる同じ作業員のジョブは外し、同じ日付・開始時刻のまま
+        別の作業員に割り当て直す。割り当て先がなければ "unassigned" として返す。
+        移した先と元で直後になったジョブは、移動距離・時間を計算し直す。
+        """
+        job = self.availability.index.get(booking_id)
+        if job is None:
+            raise KeyError(booking_id)
+
+        updated = job.model_copy(update=changes)
+        start = _to_minutes(updated.scheduled_time_start)
+        end = _to_minutes(updated.scheduled_time_end)
+        if end <= start:
+            raise ValueError("終了時刻は開始時刻より後にしてください")
+
+        optimizer = self.optimizer
+        worker = optimizer._workers_by_id.get(updated.worker_id)
+        if worker is None:
+            raise ValueError(f"作業員が見つかりません: {updated.worker_id}")
+
+        work_start, work_end = optimizer._shifts[worker.worker_id]
+        if start < work_start or end > work_end:
+            raise ValueError(
+                f"作業員 {worker.worker_id} の稼働時間"
+                f"（{_format_minutes(work_start)}〜{_format_minutes(work_end)}）の範囲外です"
+            )
+
+        # 元の枠は空くので見直し対象
+        self.availability.cancel(booking_id)
+        self.dirty.add((job.worker_id, job.scheduled_date))
+
+        # 変更後の時間（前後の移動余裕を含む）と重なるジョブを外す
+        buffer = ScheduleOptimizer.TRAVEL_BUFFER_MINUTES
+        displaced = [
+            other
+            for other in self.availability.index.jobs_for(updated.worker_id, updated.scheduled_date)
+            if _to_minutes(other.scheduled_time_start) < end + buffer
+            and _to_minutes(other.scheduled_time_end) > start - buffer
+        ]
+        for other in displaced:
+            self.availability.cancel(other.booking_id)
+
+        updated = self._rebuild(updated, worker, updated.scheduled_date, start)
+        self.availability.book(updated)
+        diffs = [self._diff("updated", job, updated)]
+
+        for other in displaced:
+            moved = self._reassign(other)
+            if moved is None:
+                diffs.append(self._diff("unassigned", other, None))
+                continue
+            self.availability.book(moved)
+            diffs.append(self._diff("moved", other, moved))
+
+        # 直前のジョブが変わった、移した先と元の直後のジョブ
+        diffs += self._refresh_next(updated.worker_id, updated.scheduled_date, end)
+        diffs += self._refresh_next(job.worker_id, job.scheduled_date, _to_minutes(job.scheduled_time_start))
+        return diffs
+
+    def run(self) -> List[Dict]:
+        """dirty な作業員・日付の空きに近くのジョブを移す（max_moves 件まで）"""
+        diffs = []
+        while self.dirty and len(diffs) < self.max_moves:
+            key = min(self.dirty)
+            self.dirty.discard(key)
+
+            moved = self._absorb(*key)
+            if moved is None:
+                continue
+
+            before, after = moved
+            diffs.append(self._diff("moved", before, after))
+            # 同じ作業員にさらに入る可能性と、移した元の空き
+            self.dirty.add(key)
+            self.dirty.add((before.worker_id, before.scheduled_date))
+
+        return diffs
+
+    def _absorb(self, worker_id: str, date: str) -> Optional[Tuple[ScheduledJob, ScheduledJob]]:
+        """
+        作業員のその日の空きに、移すとスコアが最も上がる近くのジョブを1件移す
+
+        移すジョブの開始時刻は変えない（顧客と約束した時刻のまま担当だけを替える）
+        """
+        optimizer = self.optimizer
+        index = self.availability.index
+        worker = optimizer._workers_by_id.get(worker_id)
+        if worker is None:
+            return None
+
+        job_count = index.count(worker_id, date)
+        if job_count >= worker.max_jobs_per_day:
+            return None
+
+        # 拠点とその日のジョブ地点の近くにあるジョブだけを候補にする
+        anchors = [worker.current_location] + [
+            job.location for job in index.jobs_for(worker_id, date) if job.location
+        ]
+        candidates = set()
+        for anchor in anchors:
+            for booking_id, _ in optimizer._job_index(date).nearest(anchor, k=self.CANDIDATE_JOBS):
+                candidates.add(booking_id)
+
+        best = None
+        for booking_id in sorted(candidates):
+            job = index.get(booking_id)
+            donor = optimizer._workers_by_id.get(job.worker_id)
+            if job.worker_id == worker_id or donor is None:
+                continue
+
+            booking = self._as_booking(job)
+            start = _to_minutes(job.scheduled_time_start)
+            end = start + booking.estimated_duration_minutes
+
+            # 同じ時刻に入れられる空きがあるか
+            slots = optimizer._find_available_slots(worker, booking.estimated_duration_minutes, date)
+            if not any(slot_start <= start and end <= slot_end for slot_start, slot_end in slots):
+                continue
+
+            gain = (
+                optimizer._calculate_score(worker, date, start, job_count, booking, start) -
+                optimizer._calculate_score(
+                    donor, date, start, index.count(donor.worker_id, date) - 1, booking, start
+                )
+            )
+            if gain >= self.MIN_GAIN and (best is None or gain > best[0]):
+                best = (gain, job, booking, start)
+
+        if best is None:
+            return None
+
+        _, job, booking, start = best
+        self.availability.cancel(job.booking_id)
+        moved = optimizer._build_job(booking, worker, date, start)
+        self.availability.book(moved)
+        return job, moved
+
+
+class AssignmentFeed:
+    """
+    割り当て変更の配信（Server-Sent Events 用）
+
+    購読者ごとの asyncio.Queue に差分を配る。直近 history 件は保持しておき、
+    再接続時に Last-Event-ID 以降を再送する。キューがあふれた購読者は切断し、
+    再接続で追いつかせる。
+    """
+
+    def __init__(self, history: int = 1000, queue_size: int = 1000):
+        self.queue_size = queue_size
+        self._events = deque(maxlen=history)
+        self._next_id = 1
+        self._subscribers: set = set()
+
+    def publish(self, diffs: List[Dict]):
+        for diff in diffs:
+            event = {"id": self._next_id, **jsonable_encoder(diff)}
+            self._next_id += 1
+            self._events.append(event)
+
+            for queue in list(self._subscribers):
+                try:
+                    queue.put_nowait(event)
+                except asyncio.QueueFull:
+                    self._disconnect(queue)
+
+    def _disconnect(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(None)
+
+    def subscribe(self, last_event_id: Optional[int] = None) -> asyncio.Queue:
+        queue = asyncio.Queue(self.queue_size)
+        if last_event_id is not None:
+            for event in self._events:
+                if event["id"] > last_event_id:
+                    queue.put_nowait(event)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+
+
+class ReminderWheel:
+    """
+    リマインド用の階層型タイマーホイール（1分単位）
+
+    SLOTS 個のスロットを持つ段を LEVELS 段重ね、段 k の1スロットは SLOTS^k 分を表す
+    （64分・約68時間・約182日・約32年）。期限が近づくと上の段のスロットを下の段へ移し、
+    最下段のスロットの時刻になったら発火する。
+
+    予約ごとに KINDS 個の枠をまとめて確保し、スロットは枠番号の双方向リストでつなぐ。
+    登録・取り消し・時刻変更はどれも O(1)。枠ごとの状態は array の配列に持つため、
+    100万件規模でもリマインド1件あたり数十バイトで済む。
+    """
+
+    BITS = 6
+    SLOTS = 1 << BITS
+    LEVELS = 4
+    KINDS = 3
+
+    # 期限を過ぎた枠をつなぐリスト（LEVELS 段のスロットの後ろ）
+    READY = LEVELS * SLOTS
+    UNLINKED = -1
+
+    def __init__(self, now: int, initial_blocks: int = 1024):
+        # 次に処理する分（1970-01-01 からの経過分）
+        self._tick = now
+        self._heads = [-1] * (self.READY + 1)
+        # 段ごとの空でないスロットのビットマスク（次に処理が必要な時刻まで飛ばすため）
+        self._occupied = [0] * self.LEVELS
+
+        size = initial_blocks * self.KINDS
+        self._due = array("q", bytes(8 * size))
+        self._next = array("i", [-1]) * size
+        self._prev = array("i", [-1]) * size
+        self._slot = array("i", [self.UNLINKED]) * size
+
+        self._blocks: Dict[str, int] = {}
+        self._owners: List[Optional[str]] = [None] * initial_blocks
+        self._free = list(range(initial_blocks - 1, -1, -1))
+        self._pending = 0
+
+    def __len__(self) -> int:
+        return self._pending
+
+    def __contains__(self, booking_id: str) -> bool:
+        return booking_id in self._blocks
+
+    # ---- 枠の確保 ----
+
+    def _allocate(self, booking_id: str) -> int:
+        if not self._free:
+            blocks = len(self._owners)
+            size = blocks * self.KINDS
+            self._due.extend(array("q", bytes(8 * size)))
+            self._next.extend(array("i", [-1]) * size)
+            self._prev.extend(array("i", [-1]) * size)
+            self._slot.extend(array("i", [self.UNLINKED]) * size)
+            self._owners.extend([None] * blocks)
+            self._free = list(range(2 * blocks - 1, blocks - 1, -1))
+
+        block = self._free.pop()
+        self._blocks[booking_id] = block
+        self._owners[block] = booking_id
+        return block
+
+    def _release(self, block: int):
+        del self._blocks[self._owners[block]]
+        self._owners[block] = None
+        self._free.append(block)
+
+    # ---- スロットのリスト操作 ----
+
+    def _slot_for(self, due: int) -> int:
+        delta = due - self._tick
+        if delta < 0:
+            return self.READY
+        for level in range(self.LEVELS):
+            if delta < 1 << (self.BITS * (level + 1)):
+                return level * self.SLOTS + ((due >> (self.BITS * level)) & (self.SLOTS - 1))
+
+        # 最上段の範囲を超える期限は、最上段の最後のスロットに置いて繰り下げ時に置き直す
+        level = self.LEVELS - 1
+        horizon = self._tick + (1 << (self.BITS * self.LEVELS)) - 1
+        return level * self.SLOTS + ((horizon >> (self.BITS * level)) & (self.SLOTS - 1))
+
+    def _link(self, entry: int, due: int):
+        slot = self._slot_for(due)
+        head = self._heads[slot]
+        self._due[entry] = due
+        self._slot[entry] = slot
+        self._prev[entry] = -1
+        self._next[entry] = head
+        if head >= 0:
+            self._prev[head] = entry
+        self._heads[slot] = entry
+        if slot < self.READY:
+            self._occupied[slot >> self.BITS] |= 1 << (slot & (self.SLOTS - 1))
+        self._pending += 1
+
+    def _unlink(self, entry: int) -> bool:
+        slot = self._slot[entry]
+        if slot == self.UNLINKED:
+            return False
+
+        prev, nxt = self._prev[entry], self._next[entry]
+        if prev >= 0:
+            self._next[prev] = nxt
+        else:
+            self._heads[slot] = nxt
+            if nxt < 0 and slot < self.READY:
+                self._occupied[slot >> self.BITS] &= ~(1 << (slot & (self.SLOTS - 1)))
+        if nxt >= 0:
+            self._prev[nxt] = prev
+
+        self._slot[entry] = self.UNLINKED
+        self._pending -= 1
+        return True
+
+    def _take(self, slot: int) -> List[int]:
+        """スロットの枠をすべて外して返す"""
+        entries = []
+        entry = self._heads[slot]
+        while entry >= 0:
+            entries.append(entry)
+            self._slot[entry] = self.UNLINKED
+            entry = self._next[entry]
+        self._heads[slot] = -1
+        if slot < self.READY:
+            self._occupied[slot >> self.BITS] &= ~(1 << (slot & (self.SLOTS - 1)))
+        self._pending -= len(entries)
+        return entries
+
+    def _next_event(self) -> Optional[int]:
+        """最下段の発火か上の段の繰り下げが次に必要になる時刻（なければ None）"""
+        tick = self._tick
+        mask = (1 << self.SLOTS) - 1
+        earliest = None
+
+        for level in range(self.LEVELS):
+            bits = self._occupied[level]
+            if not bits:
+                continue
+            shift = self.BITS * level
+            # この段で次に区切りを迎える区間（最下段は現在の分）から空でないスロットを探す
+            first = -(-tick >> shift)
+            offset = first & (self.SLOTS - 1)
+            rotated = ((bits >> offset) | (bits << (self.SLOTS - offset))) & mask
+            at = (first + (rotated & -rotated).bit_length() - 1) << shift
+            if earliest is None or at < earliest:
+                earliest = at
+
+        return earliest
+
+    # ---- 公開 API ----
+
+    def set(self, booking_id: str, kind: int, due: Optional[int]):
+        """予約の kind 番目のリマインドを due（分）に設定（None なら取り消し）"""
+        block = self._blocks.get(booking_id)
+        if block is None:
+            if due is None:
+                return
+            block = self._allocate(booking_id)
+
+        entry = block * self.KINDS + kind
+        self._unlink(entry)
+        if due is not None:
+            self._link(entry, due)
+        elif self._idle(block):
+            self._release(block)
+
+    def schedule(self, booking_id: str, dues: List[Optional[int]]):
+        """予約のリマインドをまとめて設定（登録済みなら置き換える）"""
+        for kind, due in enumerate(dues):
+            self.set(booking_id, kind, due)
+
+    def cancel(self, booking_id: str):
+        """予約のリマインドをすべて取り消す"""
+        block = self._blocks.get(booking_id)
+        if block is None:
+            return
+        for kind in range(self.KINDS):
+            self._unlink(block * self.KINDS + kind)
+        self._release(block)
+
+    def _idle(self, block: int) -> bool:
+        base = block * self.KINDS
+        return all(self._slot[base + kind] == self.UNLINKED for kind in range(self.KINDS))
+
+    def advance(self, now: int) -> List[Tuple[str, int, int]]:
+        """
+        now（分）までに期限の来たリマインドを取り出す
+
+        Returns:
+            [(booking_id, kind, 期限), ...]（期限順）
+        """
+        fired = self._take(self.READY)
+
+        while self._tick <= now:
+            # 何もない分は飛ばす
+            tick = self._next_event()
+            if tick is None or tick > now:
+                self._tick = now + 1
+                break
+            self._tick = tick
+
+            # 上の段から、この時刻で区切りを迎えるスロットを下の段へ置き直す
+            for level in range(self.LEVELS - 1, 0, -1):
+                if tick & ((1 << (self.BITS * level)) - 1) == 0:
+                    slot = level * self.SLOTS + ((tick >> (self.BITS * level)) & (self.SLOTS - 1))
+                    for entry in self._take(slot):
+                        self._link(entry, self._due[entry])
+
+            fired.extend(self._take(tick & (self.SLOTS - 1)))
+            self._tick += 1
+
+        result = [
+            (self._owners[entry // self.KINDS], entry % self.KINDS, self._due[entry])
+            for entry in fired
+        ]
+        # 残りのリマインドがなくなった予約の枠を解放する
+        for entry in fired:
+            block = entry // self.KINDS
+            if self._owners[block] is not None and self._idle(block):
+                self._release(block)
+
+        result.sort(key=lambda item: item[2])
+        return result
+
+
+class ReminderSender:
+    """リマインド送信の共通インターフェース"""
+
+    async def send(self, reminders: List[Dict]):
+        """
+        リマインドをまとめて送信する（失敗した場合は例外を送出し、まとめて再送される）
+        """
+        raise NotImplementedError
+
+
+class FileReminderSender(ReminderSender):
+    """
+    リマインドを JSON Lines でファイル（"-" なら標準出力）に書き出す
+
+    実際の SMS・メール送信の代わりに、開発・検証用に使う
+    """
+
+    def __init__(self, path: str = "-"):
+        self.path = path
+
+    async def send(self, reminders: List[Dict]):
+        lines = "".join(json.dumps(reminder, ensure_ascii=False) + "\n" for reminder in reminders)
+        if self.path == "-":
+            sys.stdout.write(lines)
+            sys.stdout.flush()
+        else:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(lines)
+
+
+def load_reminder_sender() -> ReminderSender:
+    """環境変数からリマインドの送信先を選ぶ（SCHEDULER_REMINDER_OUTPUT、既定は標準出力）"""
+    return FileReminderSender(os.getenv("SCHEDULER_REMINDER_OUTPUT", "-"))
+
+
+class ReminderDispatcher:
+    """
+    確定済みジョブのリマインド送信（自動リマインド送信）
+
+    ジョブごとに前日（開始24時間前）・2時間前・出発時（開始時刻から移動時間を引いた時刻、
+    最低 ON_THE_WAY_LEAD_MINUTES 分前）の3件をタイマーホイールに登録する。
+    割り当ての変更は apply で差分ごとに反映する（時刻変更・キャンセルは O(1)）。
+    ストアからは当日から horizon_days 日先までのジョブを日付ごとに読み込む。
+
+    1つのタスクが1分ごとに期限の来たリマインドを取り出し、batch_size 件ずつ
+    sender に渡す。送信に失敗したものは RETRY_MINUTES 分後に再送する。
+    登録時点で期限を過ぎているリマインドは送らない。
+    """
+
+    KINDS = ("day_before", "two_hours_before", "on_the_way")
+    LEADS_MINUTES = (24 * 60, 120)
+    ON_THE_WAY_LEAD_MINUTES = 15
+    RETRY_MINUTES = 5
+
+    EPOCH = datetime(1970, 1, 1)
+
+    def __init__(self, store, sender: ReminderSender, batch_size: int = 500, horizon_days: int = 2):
+        self.store = store
+        self.sender = sender
+        self.batch_size = batch_size
+        self.horizon_days = horizon_days
+        self.wheel = ReminderWheel(self.now_minute())
+        self.stats = {"sent": 0, "failed": 0, "skipped": 0}
+
+        self._loaded_until: Optional[str] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def now_minute(cls) -> int:
+        """現在時刻（1970-01-01 からの経過分、ローカル時刻）"""
+        return int((datetime.now() - cls.EPOCH).total_seconds() // 60)
+
+    @classmethod
+    def _format_minute(cls, minute: int) -> str:
+        return (cls.EPOCH + timedelta(minutes=minute)).strftime("%Y-%m-%dT%H:%M")
+
+    def dues(self, job: ScheduledJob) -> List[Optional[int]]:
+        """ジョブのリマインドの期限（分）。過ぎているものは None"""
+        day = datetime.strptime(job.scheduled_date, "%Y-%m-%d")
+        start = int((day - self.EPOCH).total_seconds() // 60) + _to_minutes(job.scheduled_time_start)
+        dues = [start - lead for lead in self.LEADS_MINUTES]
+        dues.append(start - max(job.travel_time_minutes, self.ON_THE_WAY_LEAD_MINUTES))
+
+        now = self.now_minute()
+        return [due if due >= now else None for due in dues]
+
+    def schedule(self, job: ScheduledJob):
+        self.wheel.schedule(job.booking_id, self.dues(job))
+
+    def cancel(self, booking_id: str):
+        self.wheel.cancel(booking_id)
+
+    def apply(self, diffs: List[Dict]):
+        """割り当ての差分（ScheduleRepair._diff の形式）を反映"""
+        for diff in diffs:
+            if diff["after"] is not None:
+                self.schedule(diff["after"])
+            else:
+                self.cancel(diff["booking_id"])
+
+    def load_horizon(self):
+        """当日から horizon_days 日先までの未読み込みの日付のジョブを登録"""
+        today = datetime.now()
+        for offset in range(self.horizon_days + 1):
+            date = (today + timedelta(days=offset)).strftime("%Y-%m-%d")
+            if self._loaded_until is not None and date <= self._loaded_until:
+                continue
+            for job in self.store.jobs_on(date):
+                self.schedule(job)
+            self._loaded_until = date
+
+    def _build(self, booking_id: str, kind: int, due: int) -> Optional[Dict]:
+        job = self.store.get(booking_id)
+        if job is None:
+            return None
+        return {
+            "booking_id": booking_id,
+            "type": self.KINDS[kind],
+            "due_at": self._format_minute(due),
+            "worker_id": job.worker_id,
+            "scheduled_date": job.scheduled_date,
+            "scheduled_time_start": job.scheduled_time_start,
+            "scheduled_time_end": job.scheduled_time_end,
+            "address": job.location.address if job.location else None
+        }
+
+    async def dispatch(self, now: Optional[int] = None) -> int:
+        """期限の来たリマインドを batch_size 件ずつ送信し、送信件数を返す"""
+        now = self.now_minute() if now is None else now
+        fired = self.wheel.advance(now)
+
+        sent = 0
+        for i in range(0, len(fired), self.batch_size):
+            chunk = []
+            reminders = []
+            for booking_id, kind, due in fired[i:i + self.batch_size]:
+                reminder = self._build(booking_id, kind, due)
+                if reminder is None:
+                    self.stats["skipped"] += 1
+                else:
+                    chunk.append((booking_id, kind))
+                    reminders.append(reminder)
+            if not reminders:
+                continue
+
+            try:
+                await self.sender.send(reminders)
+            except Exception:
+                # まとめて再送する（その間に変更・キャンセルされたものは apply で置き換わる）
+                self.stats["failed"] += len(chunk)
+                for booking_id, kind in chunk:
+                    self.wheel.set(booking_id, kind, now + self.RETRY_MINUTES)
+                continue
+
+            sent += len(reminders)
+
+        self.stats["sent"] += sent
+        return sent
+
+    async def run(self):
+        """1分ごとに送信する（毎分0秒付近に起きる）"""
+        while True:
+            self.load_horizon()
+            await self.dispatch()
+            await asyncio.sleep(60 - datetime.now().second + 0.05)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+class DayRouteOptimizer:
+    """
+    日次一括ルート最適化エンジン
+
+    1日分の全予約と作業員を、時間枠付き容量制約VRPとしてOR-Toolsで一括で解く。
+    - 作業員の稼働時間（available_from〜available_to）
+    - 1日あたりの最大件数（max_jobs_per_day）
+    - 作業時間（estimated_duration_minutes）
+    - 顧客希望時間（preferred_time、前後の許容幅を超えた分はペナルティ）
+    """
+
+    # 希望時間からのずれ1分あたりのペナルティ（m換算）
+    # _calculate_score の重み（1時間のずれ=10点、1km=2点）に合わせて 5km/時間 ≒ 83m/分
+    PREFERRED_TIME_PENALTY_PER_MINUTE = 83
+
+    # 予約を割り当てない場合のペナルティ（m換算）
+    DROP_PENALTY = 1_000_000
+    URGENT_DROP_PENALTY = 10_000_000
+
+    DAY_MINUTES = 24 * 60
+
+    # 局所探索で考慮する近傍地点数
+    NEIGHBORS = 40
+
+    def __init__(
+        self,
+        workers: List[Worker],
+        bookings: List[BookingRequest],
+        date: str,
+        preferred_window_minutes: int = 60,
+        time_limit_seconds: float = 5.0,
+        backend: Optional[TravelTimeBackend] = None
+    ):
+        self.workers = workers
+        self.backend = backend or HaversineTravelTime()
+        self.bookings = bookings
+        self.date = date
+        self.preferred_window_minutes = preferred_window_minutes
+        self.time_limit_seconds = time_limit_seconds
+
+    def _build_matrices(self) -> Tuple[np.ndarray, np.ndarray]:
+        """全地点間の距離（m）と移動時間（分）の行列を作成"""
+        locations = (
+            [worker.current_location for worker in self.workers] +
+            [booking.location for booking in self.bookings]
+        )
+        lat = np.array([loc.latitude for loc in locations])
+        lon = np.array([loc.longitude for loc in locations])
+
+        distance_km = DistanceCalculator.haversine_matrix(lat, lon, lat, lon)
+        travel_minutes = self.backend.matrix(lat, lon, lat, lon)
+
+        return (distance_km * 1000).astype(np.int64), travel_minutes.astype(np.int64)
+
+    def solve(self) -> DayOptimizationResponse:
+        """VRPを解いて作業員ごとのルートを返す"""
+        num_workers = len(self.workers)
+        num_nodes = num_workers + len(self.bookings)
+
+        started = clock.time()
+
+        if num_workers == 0 or not self.bookings:
+            return self._build_response(None, None, None, None, None, started)
+
+        distance_m, travel_minutes = self._build_matrices()
+
+        service = np.zeros(num_nodes, dtype=np.int64)
+        service[num_workers:] = [b.estimated_duration_minutes for b in self.bookings]
+
+        # 帰社は考慮しない（作業員の拠点への移動はコスト0、作業時間のみ計上）
+        arc_cost = distance_m.copy()
+        arc_cost[:, :num_workers] = 0
+        transit_time = travel_minutes + service[:, None]
+        transit_time[:, :num_workers] = service[:, None]
+
+        depots = list(range(num_workers))
+        manager = pywrapcp.RoutingIndexManager(num_nodes, num_workers, depots, depots)
+        routing = pywrapcp.RoutingModel(manager)
+
+        cost_callback = routing.RegisterTransitMatrix(arc_cost.tolist())
+        routing.SetArcCostEvaluatorOfAllVehicles(cost_callback)
+
+        # 件数制約
+        demand_callback = routing.RegisterUnaryTransitVector(
+            [0] * num_workers + [1] * len(self.bookings)
+        )
+        routing.AddDimensionWithVehicleCapacity(
+            demand_callback,
+            0,
+            [worker.max_jobs_per_day for worker in self.workers],
+            True,
+            "Jobs"
+        )
+
+        # 時間制約（待機を許可）
+        time_callback = routing.RegisterTransitMatrix(transit_time.tolist())
+        routing.AddDimension(
+            time_callback,
+            self.DAY_MINUTES,
+            self.DAY_MINUTES,
+            False,
+            "Time"
+        )
+        time_dimension = routing.GetDimensionOrDie("Time")
+
+        for vehicle, worker in enumerate(self.workers):
+            work_start = _time_to_minutes(worker.available_from)
+            work_end = _time_to_minutes(worker.available_to)
+            time_dimension.CumulVar(routing.Start(vehicle)).SetRange(work_start, work_end)
+            time_dimension.CumulVar(routing.End(vehicle)).SetRange(work_start, work_end)
+
+        for offset, booking in enumerate(self.bookings):
+            node = num_workers + offset
+            index = manager.NodeToIndex(node)
+
+            if booking.preferred_time:
+                preferred = _to_minutes(booking.preferred_time)
+                time_dimension.SetCumulVarSoftLowerBound(
+                    index,
+                    max(0, preferred - self.preferred_window_minutes),
+                    self.PREFERRED_TIME_PENALTY_PER_MINUTE
+                )
+                time_dimension.SetCumulVarSoftUpperBound(
+                    index,
+                    preferred + self.preferred_window_minutes,
+                    self.PREFERRED_TIME_PENALTY_PER_MINUTE
+                )
+
+            penalty = self.URGENT_DROP_PENALTY if booking.urgency == "high" else self.DROP_PENALTY
+            routing.AddDisjunction([index], penalty)
+
+        for vehicle in range(num_workers):
+            routing.AddVariableMinimizedByFinalizer(
+                time_dimension.CumulVar(routing.Start(vehicle))
+            )
+            routing.AddVariableMinimizedByFinalizer(
+                time_dimension.CumulVar(routing.End(vehicle))
+            )
+
+        search_parameters = pywrapcp.DefaultRoutingSearchParameters()
+        search_parameters.first_solution_strategy = (
+            routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC
+        )
+        search_parameters.local_search_metaheuristic = (
+            routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH
+        )
+        search_parameters.time_limit.FromMilliseconds(max(1, int(self.time_limit_seconds * 1000)))
+        # 近傍を近い地点に絞り、数千件規模でも1回の探索が時間内に収まるようにする
+        search_parameters.ls_operator_neighbors_ratio = min(1.0, self.NEIGHBORS / num_nodes)
+        search_parameters.ls_operator_min_neighbors = self.NEIGHBORS
+        operators = search_parameters.local_search_operators
+        disabled = optional_boolean_pb2.BOOL_FALSE
+        operators.use_global_cheapest_insertion_path_lns = disabled
+        operators.use_local_cheapest_insertion_path_lns = disabled
+        operators.use_relocate_path_global_cheapest_insertion_insert_unperformed = disabled
+        operators.use_global_cheapest_insertion_visit_types_lns = disabled
+        operators.use_local_cheapest_insertion_visit_types_lns = disabled
+        # ルートごとのLPによる時刻最適化は大規模時に支配的になるため使わない
+        search_parameters.disable_scheduling_beware_this_may_degrade_performance = True
+
+        # 大規模な日でも初期解の構築で時間切れにならないよう、貪欲法の初期解から探索する
+        routing.CloseModelWithParameters(search_parameters)
+        initial_routes = self._initial_routes(travel_minutes, service)
+        initial_solution = routing.solver().Assignment()
+
+        if routing.RoutesToAssignment(initial_routes, True, True, initial_solution):
+            solution = routing.SolveFromAssignmentWithParameters(
+                initial_solution, search_parameters
+            )
+        else:
+            solution = routing.SolveWithParameters(search_parameters)
+
+        return self._build_response(
+            manager, routing, solution, distance_m, travel_minutes, started
+        )
+
+    def _initial_routes(
+        self,
+        travel_minutes: np.ndarray,
+        service: np.ndarray
+    ) -> List[List[int]]:
+        """
+        貪欲法で初期ルートを作成
+
+        緊急度・希望時間順に予約を並べ、その時点で移動時間が最短の
+        作業員のルート末尾に追加する（全作業員分をNumPyでまとめて評価）
+        """
+        num_workers = len(self.workers)
+
+        current_node = np.arange(num_workers)
+        current_time = np.array([_time_to_minutes(w.available_from) for w in self.workers])
+        work_end = np.array([_time_to_minutes(w.available_to) for w in self.workers])
+        remaining = np.array([w.max_jobs_per_day for w in self.workers])
+        routes: List[List[int]] = [[] for _ in range(num_workers)]
+
+        def order(offset: int):
+            booking = self.bookings[offset]
+            preferred = _to_minutes(booking.preferred_time) if booking.preferred_time else self.DAY_MINUTES
+            return (booking.urgency != "high", preferred)
+
+        for offset in sorted(range(len(self.bookings)), key=order):
+            node = num_workers + offset
+            booking = self.bookings[offset]
+
+            arrival = current_time + travel_minutes[current_node, node]
+            if booking.preferred_time:
+                earliest = _to_minutes(booking.preferred_time) - self.preferred_window_minutes
+                arrival = np.maximum(arrival, earliest)
+            finish = arrival + service[node]
+
+            feasible = (remaining > 0) & (finish <= work_end)
+            if not feasible.any():
+                continue
+
+            travel = np.where(feasible, travel_minutes[current_node, node], np.iinfo(np.int64).max)
+            vehicle = int(np.argmin(travel))
+
+            routes[vehicle].append(node)
+            current_node[vehicle] = node
+            current_time[vehicle] = finish[vehicle]
+            remaining[vehicle] -= 1
+
+        return routes
+
+    def _build_response(
+        self,
+        manager,
+        routing,
+        solution,
+        distance_m: Optional[np.ndarray],
+        travel_minutes: Optional[np.ndarray],
+        started: float
+    ) -> DayOptimizationResponse:
+        """解をルート・ScheduledJobに変換"""
+        num_workers = len(self.workers)
+        routes = []
+        assigned = set()
+
+        if solution is not None:
+            time_dimension = routing.GetDimensionOrDie("Time")
+
+            for vehicle, worker in enumerate(self.workers):
+                jobs = []
+                route_distance = 0
+                route_time = 0
+
+                index = routing.Start(vehicle)
+                prev_node = manager.IndexToNode(index)
+                index = solution.Value(routing.NextVar(index))
+
+                while not routing.IsEnd(index):
+                    node = manager.IndexToNode(index)
+                    booking = self.bookings[node - num_workers]
+                    start = solution.Min(time_dimension.CumulVar(index))
+                    leg_distance = int(distance_m[prev_node, node])
+                    leg_time = int(travel_minutes[prev_node, node])
+
+                    jobs.append(ScheduledJob(
+                        booking_id=booking.booking_id,
+                        worker_id=worker.worker_id,
+                        scheduled_date=self.date,
+                        scheduled_time_start=_format_minutes(start),
+                        scheduled_time_end=_format_minutes(start + booking.estimated_duration_minutes),
+                        travel_time_minutes=leg_time,
+                        travel_distance_km=round(leg_distance / 1000, 2)
+                    ))
+                    assigned.add(booking.booking_id)
+                    route_distance += leg_distance
+                    route_time += leg_time
+
+                    prev_node = node
+                    index = solution.Value(routing.NextVar(index))
+
+                routes.append(WorkerRoute(
+                    worker_id=worker.worker_id,
+                    jobs=jobs,
+                    total_travel_distance_km=round(route_distance / 1000, 2),
+                    total_travel_time_minutes=route_time
+                ))
+
+        metadata = {
+            "time_limit_ms": int(self.time_limit_seconds * 1000),
+            "elapsed_ms": round((clock.time() - started) * 1000, 2),
+            "search_complete": True
+        }
+        if routing is not None:
+            status = routing.status()
+            metadata["solver_status"] = routing_enums_pb2.RoutingSearchStatus.Value.Name(status)
+            # GLSは時間切れまで改善を続けるため、最適性が証明された場合のみ完了とみなす
+            metadata["search_complete"] = (
+                status == routing_enums_pb2.RoutingSearchStatus.ROUTING_OPTIMAL
+            )
+            if solution is not None:
+                metadata["objective"] = solution.ObjectiveValue()
+
+        return DayOptimizationResponse(
+            date=self.date,
+            routes=routes,
+            unassigned_booking_ids=[
+                b.booking_id for b in self.bookings if b.booking_id not in assigned
+            ],
+            total_travel_distance_km=round(
+                sum(route.total_travel_distance_km for route in routes), 2
+            ),
+            total_travel_time_minutes=sum(
+                route.total_travel_time_minutes for route in routes
+            ),
+            metadata=metadata
+        )
+
+
+def load_workers() -> List[Worker]:
+    """作業員一覧を取得"""
+    # TODO: 実際のサービスではDBから取得
+    # ダミーデータ
+    return [
+        Worker(
+            worker_id="worker-001",
+            name="田中",
+            current_location=Location(
+                latitude=35.6812,
+                longitude=139.7671,
+                address="東京都渋谷区"
+            ),
+            available_from=time(9, 0),
+            available_to=time(18, 0),
+            max_jobs_per_day=4
+        ),
+        Worker(
+            worker_id="worker-002",
+            name="佐藤",
+            current_location=Location(
+                latitude=35.6895,
+                longitude=139.6917,
+                address="東京都新宿区"
+            ),
+            available_from=time(9, 0),
+            available_to=time(18, 0),
+            max_jobs_per_day=4
+        )
+    ]
+
+
+class SolverOverloadedError(Exception):
+    """最適化の待ち行列が上限に達している"""
+
+
+class SolverPool:
+    """
+    最適化実行プール
+
+    CPU負荷の高い最適化をイベントループの外（プロセスプール、またはGILを
+    解放するソルバー向けのスレッドプール）で実行する。
+    - 実行中＋待機中の件数が上限に達したら SolverOverloadedError で即座に拒否
+    - リクエストごとの期限（asyncio.TimeoutError）
+    - 同じ内容の実行中リクエストは1回の計算結果を共有
+    """
+
+    def __init__(
+        self,
+        max_workers: Optional[int] = None,
+        max_pending: int = 64,
+        timeout_seconds: float = 10.0,
+        use_threads: bool = False
+    ):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_pending = max_pending
+        self.timeout_seconds = timeout_seconds
+        self.use_threads = use_threads
+        self._executor: Optional[Executor] = None
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        # 計算した件数、実行中の同じ計算に合流した件数、上限で拒否した件数
+        self.stats = {"computed": 0, "shared": 0, "rejected": 0}
+
+    @property
+    def pending(self) -> int:
+        """実行中＋待機中の計算数"""
+        return len(self._in_flight)
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.use_threads:
+                self._executor = ThreadPoolExecutor(self.max_workers)
+            else:
+                self._executor = ProcessPoolExecutor(self.max_workers)
+        return self._executor
+
+    @staticmethod
+    def request_key(*parts) -> str:
+        """
+        リクエスト内容から合流用のキーを作成
+
+        イベントループ上で計算するため、作業員・確定済みジョブの一覧ではなく、
+        リクエストの内容と状態の版（_state_version）から作る
+        """
+        payload = json.dumps(jsonable_encoder(parts), sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    async def run(self, key: str, fn, *args, timeout: Optional[float] = None):
+        """
+        fn(*args) をプールで実行して結果を返す
+
+        同じ key の計算が実行中ならそれを待つ。期限切れになっても計算自体は
+        続行され、合流している他のリクエストはその結果を受け取る。
+        """
+        loop = asyncio.get_running_loop()
+        return await self.join(
+            key, lambda: loop.run_in_executor(self._get_executor(), fn, *args), timeout=timeout
+        )
+
+    def admit(self, key: str):
+        """
+        key の計算を受け付けられるか確かめる（上限に達していて合流先もなければ SolverOverloadedError）
+
+        引数の準備に時間がかかる場合は、準備の前に呼んで拒否されるリクエストの負担を減らす
+        """
+        if key not in self._in_flight and len(self._in_flight) >= self.max_pending:
+            self.stats["rejected"] += 1
+            raise SolverOverloadedError(
+                f"最適化の待ち行列が上限（{self.max_pending}件）に達しています"
+            )
+
+    async def join(self, key: str, start, timeout: Optional[float] = None):
+        """
+        start() が返す計算を run と同じ受付制御（件数の上限・合流・期限）のもとで待つ
+
+        リージョン分割モードのように、このプールの外で計算する最適化にも使う。
+        """
+        shared = self._in_flight.get(key)
+
+        if shared is None:
+            self.admit(key)
+            shared = asyncio.ensure_future(start())
+            self._in_flight[key] = shared
+            shared.add_done_callback(lambda _: self._in_flight.pop(key, None))
+            self.stats["computed"] += 1
+        else:
+            self.stats["shared"] += 1
+
+        return await asyncio.wait_for(
+            asyncio.shield(shared),
+            timeout if timeout is not None else self.timeout_seconds
+        )
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+class Histogram:
+    """Prometheus のヒストグラム（バケットごとの件数・合計・件数）"""
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        # バケットの上限は「以下」（le）
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class SchedulerMetrics:
+    """
+    /metrics で公開する計測値（Prometheus テキスト形式）
+
+    最適化はプール内のプロセスで実行されるため、段階別の所要時間・件数・キャッシュの
+    参照回数は探索状況（last_search["stages"]）として受け取り、このプロセスで集計する。
+    他のコンポーネントの累計値は公開時に set で写す。
+    """
+
+    SECONDS_BUCKETS = (
+        0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+    )
+    COUNT_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+    # 名前 -> (種類, 説明, ヒストグラムのバケット)
+    FAMILIES = {
+        "scheduler_request_seconds": (
+            "histogram", "HTTPリクエストの処理時間（秒）", SECONDS_BUCKETS
+        ),
+        "scheduler_stage_seconds": (
+            "histogram", "最適化1回あたりの段階別の所要時間（秒）", SECONDS_BUCKETS
+        ),
+        "scheduler_search_items": (
+            "histogram", "最適化1回あたりの件数（候補の作業員・スロット探索・スコアを計算した候補）", COUNT_BUCKETS
+        ),
+        "scheduler_searches_total": (
+            "counter", "最適化の実行回数（complete=false は期限で打ち切り）", None
+        ),
+        "scheduler_cache_lookups_total": ("counter", "キャッシュの参照回数", None),
+        "scheduler_cache_hit_ratio": ("gauge", "キャッシュのヒット率", None),
+        "scheduler_solver_pending": ("gauge", "最適化プールの実行中＋待機中の計算数", None),
+        "scheduler_solver_rejected_total": ("counter", "待ち行列の上限で拒否した最適化の件数", None),
+        "scheduler_gps_pings_total": ("counter", "位置通知の件数", None),
+        "scheduler_reminders_total": ("counter", "リマインドの送信結果", None),
+        "scheduler_region_events_total": ("counter", "リージョン分割モードのイベント数", None),
+    }
+
+    def __init__(self):
+        # 名前 -> ラベルの組 -> 値（ヒストグラムは Histogram）
+        self._values: Dict[str, Dict[Tuple[Tuple[str, str], ...], object]] = {
+            name: {} for name in self.FAMILIES
+        }
+
+    @staticmethod
+    def _labels(labels: Dict[str, str]) -> Tuple[Tuple[str, str], ...]:
+        return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def observe(self, name: str, value: float, **labels):
+        series = self._values[name]
+        key = self._labels(labels)
+        histogram = series.get(key)
+        if histogram is None:
+            histogram = series[key] = Histogram(self.FAMILIES[name][2])
+        histogram.observe(value)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        series = self._values[name]
+        key = self._labels(labels)
+        series[key] = series.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels):
+        self._values[name][self._labels(labels)] = value
+
+    @staticmethod
+    def merge_stages(reports: List[Dict]) -> Dict:
+        """複数の探索（リージョンごとなど）の段階別の計測を合算"""
+        merged: Dict = {"seconds": {}, "counts": {}, "caches": {}}
+        for report in reports:
+            for section in ("seconds", "counts"):
+                for key, value in report.get(section, {}).items():
+                    merged[section][key] = merged[section].get(key, 0) + value
+            for cache, (hits, misses) in report.get("caches", {}).items():
+                total = merged["caches"].setdefault(cache, [0, 0])
+                total[0] += hits
+                total[1] += misses
+        return merged
+
+    def record_search(self, kind: str, search: Dict) -> Optional[Dict]:
+        """
+        探索状況から段階別の計測を取り出して集計する（応答の metadata には含めない）
+
+        合流したリクエストは同じ探索状況を共有するため、集計は最初の1回だけになる
+        """
+        stages = search.pop("stages", None)
+        if stages is None:
+            return None
+
+        self.inc("scheduler_searches_total", kind=kind,
+                 complete=str(search.get("search_complete", True)).lower())
+        for stage, seconds in stages["seconds"].items():
+            self.observe("scheduler_stage_seconds", seconds, kind=kind, stage=stage)
+        for item, count in stages["counts"].items():
+            self.observe("scheduler_search_items", count, kind=kind, item=item)
+        for cache, (hits, misses) in stages["caches"].items():
+            self.inc("scheduler_cache_lookups_total", hits, cache=cache, result="hit")
+            self.inc("scheduler_cache_lookups_total", misses, cache=cache, result="miss")
+        return stages
+
+    @staticmethod
+    def _format(name: str, labels: Tuple[Tuple[str, str], ...], value: float) -> str:
+        if labels:
+            text = ",".join(
+                '{}="{}"'.format(key, label.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+                for key, label in labels
+            )
+            name = f"{name}{{{text}}}"
+        return f"{name} {value!r}" if isinstance(value, float) else f"{name} {value}"
+
+    def render(self) -> str:
+        # ヒット率は参照回数から求める
+        lookups: Dict[str, List[float]] = {}
+        for labels, value in self._values["scheduler_cache_lookups_total"].items():
+            label = dict(labels)
+            lookups.setdefault(label["cache"], [0, 0])[label["result"] == "miss"] += value
+        for cache, (hits, misses) in lookups.items():
+            if hits + misses:
+                self.set("scheduler_cache_hit_ratio", round(hits / (hits + misses), 4), cache=cache)
+
+        lines = []
+        for name, (kind, help_text, _) in self.FAMILIES.items():
+            series = self._values[name]
+            if not series:
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+            for labels, value in sorted(series.items()):
+                if kind != "histogram":
+                    lines.append(self._format(name, labels, value))
+                    continue
+
+                cumulative = 0
+                for bound, count in zip(value.buckets + (float("inf"),), value.counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(float(bound))
+                    lines.append(self._format(f"{name}_bucket", labels + (("le", le),), cumulative))
+                lines.append(self._format(f"{name}_sum", labels, value.sum))
+                lines.append(self._format(f"{name}_count", labels, value.count))
+
+        return "\n".join(lines) + "\n"
+
+
+class SamplingProfiler:
+    """
+    1リクエスト分のサンプリングプロファイラ
+
+    SIGPROF のタイマー（CPU時間で interval 秒ごと）で実行中のスタックを記録し、
+    flamegraph.pl・speedscope にそのまま渡せる collapsed 形式（"関数;関数;... 回数"）で返す。
+    スタックは with に入ったフレームから下だけを記録する。
+    シグナルはメインスレッドでしか受け取れないため、プロファイルを指定したリクエストの
+    最適化はプールに送らずこのプロセスで直接実行する（その間イベントループは止まる）。
+    """
+
+    def __init__(self, interval: float = 0.001):
+        self.interval = interval
+        self.samples: Dict[Tuple[str, ...], int] = {}
+        self._root = None
+        self._previous = None
+
+    @staticmethod
+    def available() -> bool:
+        return hasattr(signal, "setitimer") and threading.current_thread() is threading.main_thread()
+
+    def _sample(self, signum, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            if frame is self._root:
+                break
+            frame = frame.f_back
+        key = tuple(reversed(stack))
+        self.samples[key] = self.samples.get(key, 0) + 1
+
+    def __enter__(self):
+        self._root = sys._getframe(1)
+        self._previous = signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        return self
+
+    def __exit__(self, *exc_info):
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, self._previous or signal.SIG_DFL)
+        self._root = None
+
+    def collapsed(self) -> str:
+        return "".join(
+            f"{';'.join(stack)} {count}\n"
+            for stack, count in sorted(self.samples.items(), key=lambda item: -item[1])
+        )
+
+
+class RegionPartitioner:
+    """
+    作業員の拠点による地域分割（k-means）
+
+    緯度経度を km 単位の平面座標に近似して k-means でリージョン中心を求める。
+    地点は最も近い中心のリージョンに属し、2番目に近い中心との距離の差が
+    border_km 以下の地点は境界付近として隣のリージョンも候補にする。
+    """
+
+    def __init__(self, regions: int, border_km: float = 10.0, iterations: int = 30, seed: int = 0):
+        self.regions = regions
+        self.border_km = border_km
+        self.iterations = iterations
+        self.seed = seed
+        self.centers = np.empty((0, 2))
+        self._lon_scale = 111.32
+
+    def _project(self, lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+        return np.column_stack([np.asarray(lat) * 111.32, np.asarray(lon) * self._lon_scale])
+
+    def fit(self, workers: List[Worker]) -> np.ndarray:
+        """作業員をリージョンに分け、作業員ごとのリージョン番号を返す"""
+        lat = np.array([w.current_location.latitude for w in workers])
+        lon = np.array([w.current_location.longitude for w in workers])
+        self._lon_scale = 111.32 * math.cos(math.radians(float(lat.mean())))
+        points = self._project(lat, lon)
+        k = max(1, min(self.regions, len(points)))
+
+        # k-means++ で初期中心を選ぶ（seed 固定で結果を再現できるようにする）
+        rng = np.random.default_rng(self.seed)
+        centers = [points[rng.integers(len(points))]]
+        for _ in range(1, k):
+            d2 = ((points[:, None, :] - np.array(centers)[None, :, :]) ** 2).sum(axis=2).min(axis=1)
+            total = d2.sum()
+            centers.append(points[rng.choice(len(points), p=d2 / total)] if total > 0 else points[0])
+        centers = np.array(centers)
+
+        labels = np.zeros(len(points), dtype=np.int64)
+        for _ in range(self.iterations):
+            d2 = ((points[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2)
+            labels = d2.argmin(axis=1)
+            updated = centers.copy()
+            for region in range(k):
+                members = points[labels == region]
+                if len(members):
+                    updated[region] = members.mean(axis=0)
+                else:
+                    # 空になったリージョンは、中心から最も遠い地点で作り直す
+                    updated[region] = points[d2.min(axis=1).argmax()]
+            if np.allclose(updated, centers):
+                break
+            centers = updated
+
+        self.centers = centers
+        return ((points[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2).argmin(axis=1)
+
+    def locate(self, lat: np.ndarray, lon: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        地点ごとの (リージョン, 隣のリージョン)
+
+        境界付近でなければ（またはリージョンが1つなら）隣のリージョンは -1
+        """
+        points = self._project(lat, lon)
+        distances = np.sqrt(((points[:, None, :] - self.centers[None, :, :]) ** 2).sum(axis=2))
+        order = np.argsort(distances, axis=1)
+        primary = order[:, 0]
+        if distances.shape[1] < 2:
+            return primary, np.full(len(primary), -1)
+
+        secondary = order[:, 1]
+        rows = np.arange(len(primary))
+        margin = distances[rows, secondary] - distances[rows, primary]
+        return primary, np.where(margin <= self.border_km, secondary, -1)
+
+
+class ShardedScheduler:
+    """
+    リージョン分割した最適化（リージョンごとの常駐プロセス）
+
+    作業員を RegionPartitioner でリージョンに分け、リージョンごとに1プロセスの
+    プールを持つ。各プロセスは起動時に受け取ったそのリージョンの作業員と、
+    確定済みジョブの索引・空間索引・距離行列を保持し続けるため、
+    リクエストごとに送るのは予約と差分だけで済む。
+
+    - 確定済みジョブは日付ごとに、最初に必要になったときにストアから送る。
+      以降の変更（apply）と作業員の移動（move_workers）も差分で送る。
+      プロセスごとのプールは1並列なので、送った順に反映される。最適化の前にそれまでの
+      同期の完了を確認し、失敗していれば（プロセスの異常終了を含む）プロセスを作り直して
+      送信済みの日付を送り直す
+    - 単一予約は属するリージョンで最適化し、境界付近なら隣のリージョンも並列に
+      評価して上位候補をまとめる
+    - 一括割り当ては各リージョンで並列に行った後、境界付近の予約のうち未割り当てか
+      直前の地点から遠いものを隣のリージョンと比べて、スコアの高い方に割り当て直す
+      （境界の調整）
+    """
+
+    # _calculate_score で距離スコアが満点になる距離（km）
+    FULL_SCORE_KM = 10.0
+
+    def __init__(
+        self,
+        workers: List[Worker],
+        store,
+        regions: int,
+        border_km: float = 10.0,
+        timeout_seconds: float = 10.0,
+        use_threads: bool = False
+    ):
+        self.store = store
+        self.timeout_seconds = timeout_seconds
+        self.use_threads = use_threads
+        self.partitioner = RegionPartitioner(regions, border_km)
+
+        labels = self.partitioner.fit(workers)
+        self.regions = len(self.partitioner.centers)
+        self.worker_region = {worker.worker_id: int(label) for worker, label in zip(workers, labels)}
+        self._members = [
+            [worker for worker, label in zip(workers, labels) if label == region]
+            for region in range(self.regions)
+        ]
+
+        self._executors: List[Optional[Executor]] = [None] * self.regions
+        # リージョンごとの、確定済みジョブを送った日付・最後に送った同期・同期の失敗（プロセスの
+        # 異常終了を含む）の有無・プロセスの世代（作り直す前の同期の失敗を数えないため）
+        self._loaded: List[set] = [set() for _ in range(self.regions)]
+        self._last_sync: List[Optional[Future]] = [None] * self.regions
+        self._broken = [False] * self.regions
+        self._generations = [0] * self.regions
+        self._locks = [asyncio.Lock() for _ in range(self.regions)]
+        self.stats = {"border_bookings": 0, "reassigned": 0, "sync_errors": 0, "restarts": 0}
+
+    def _executor(self, region: int) -> Executor:
+        executor = self._executors[region]
+        if executor is None:
+            pool = ThreadPoolExecutor if self.use_threads else ProcessPoolExecutor
+            executor = pool(1, initializer=_init_shard, initargs=(region, self._members[region]))
+            self._executors[region] = executor
+        return executor
+
+    def _mark_broken(self, region: int, generation: int):
+        if generation == self._generations[region]:
+            self._broken[region] = True
+            self.stats["sync_errors"] += 1
+
+    def _send(self, region: int, fn, *args):
+        """
+        状態の同期を送る（完了は _ready が実行前に待つ。失敗したらリージョンを作り直す）
+
+        プロセスごとのプールは1並列なので、最後に送った同期が終われば、それまでの同期も終わっている。
+        """
+        generation = self._generations[region]
+        try:
+            future = self._executor(region).submit(fn, region, *args)
+        except BrokenExecutor:
+            self._mark_broken(region, generation)
+            return
+
+        # 完了の通知はプールの管理スレッドで呼ばれるので、状態の更新はイベントループに戻して行う
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+
+        def done(f):
+            if f.cancelled() or f.exception() is not None:
+                if loop is None:
+                    self._mark_broken(region, generation)
+                elif not loop.is_closed():
+                    loop.call_soon_threadsafe(self._mark_broken, region, generation)
+
+        future.add_done_callback(done)
+        self._last_sync[region] = future
+
+    async def _call(self, region: int, fn, *args):
+        generation = self._generations[region]
+        try:
+            future = self._executor(region).submit(fn, region, *args)
+            return await asyncio.wait_for(asyncio.wrap_future(future), self.timeout_seconds)
+        except BrokenExecutor:
+            self._mark_broken(region, generation)
+            raise
+
+    def _restart(self, region: int) -> set:
+        """リージョンのプロセスを作り直し、送り直す必要のある日付を返す"""
+        executor = self._executors[region]
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+        self._executors[region] = None
+        self._generations[region] += 1
+        self._broken[region] = False
+        self._last_sync[region] = None
+        dates, self._loaded[region] = self._loaded[region], set()
+        self.stats["restarts"] += 1
+        return dates
+
+    async def _ready(self, region: int, dates: List[str]):
+        """
+        リージョンのプロセスの状態を揃える
+
+        送った同期の完了を待ち、失敗していればプロセスを作り直して送信済みの日付を送り直す。
+        まだ送っていない日付の確定済みジョブも送り、完了を確認する（失敗したら RuntimeError）。
+        """
+        async with self._locks[region]:
+            await self._wait_synced(region)
+            missing = set(dates) - self._loaded[region]
+            if self._broken[region]:
+                missing |= self._restart(region)
+            if not missing:
+                return
+
+            for date in sorted(missing):
+                self._loaded[region].add(date)
+                self._send(region, _shard_update, self._by_region(self.store.jobs_on(date)).get(region, []), [])
+            await self._wait_synced(region)
+            if self._broken[region]:
+                raise RuntimeError(f"リージョン {region} の確定済みジョブの同期に失敗しました")
+
+    async def _solve(self, region: int, dates: List[str], fn, *args):
+        """状態を揃えてから実行する（プロセスが異常終了していたら、作り直して1回だけやり直す）"""
+        for attempt in range(2):
+            await self._ready(region, dates)
+            try:
+                return await self._call(region, fn, *args)
+            except BrokenExecutor:
+                if attempt:
+                    raise
+
+    async def _wait_synced(self, region: int):
+        future = self._last_sync[region]
+        if future is None or self._broken[region]:
+            return
+        try:
+            await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), self.timeout_seconds)
+        except asyncio.TimeoutError:
+            raise
+        except Exception:
+            # 失敗は完了時のコールバックで _broken に記録される
+            pass
+        if self._last_sync[region] is future:
+            self._last_sync[region] = None
+
+    def _by_region(self, jobs: Iterable[ScheduledJob]) -> Dict[int, List[ScheduledJob]]:
+        grouped: Dict[int, List[ScheduledJob]] = {}
+        for job in jobs:
+            region = self.worker_region.get(job.worker_id)
+            if region is not None:
+                grouped.setdefault(region, []).append(job)
+        return grouped
+
+    @staticmethod
+    def _dates(start_date: str, days: int) -> List[str]:
+        first_day = datetime.strptime(start_date, "%Y-%m-%d")
+        return [(first_day + timedelta(days=offset)).strftime("%Y-%m-%d") for offset in range(days)]
+
+    def apply(self, diffs: List[Dict]):
+        """割り当ての差分を、送信済みの日付の分だけ各リージョンに反映"""
+        removed: Dict[int, List[str]] = {}
+        added: Dict[int, List[ScheduledJob]] = {}
+        for diff in diffs:
+            before, after = diff["before"], diff["after"]
+            if before is not None:
+                region = self.worker_region.get(before.worker_id)
+                if region is not None and before.scheduled_date in self._loaded[region]:
+                    removed.setdefault(region, []).append(before.booking_id)
+            if after is not None:
+                region = self.worker_region.get(after.worker_id)
+                if region is not None and after.scheduled_date in self._loaded[region]:
+                    added.setdefault(region, []).append(after)
+
+        for region in set(removed) | set(added):
+            self._send(region, _shard_update, added.get(region, []), removed.get(region, []))
+
+    def move_workers(self, workers: List[Worker]):
+        """
+        作業員の位置の更新を反映（所属リージョンは変えない）
+
+        作り直したプロセスも最新の位置から始まるよう、起動時に渡す作業員も置き換える。
+        """
+        grouped: Dict[int, List[Worker]] = {}
+        for worker in workers:
+            region = self.worker_region.get(worker.worker_id)
+            if region is not None:
+                grouped.setdefault(region, []).append(worker)
+        for region, moved in grouped.items():
+            latest = {worker.worker_id: worker for worker in moved}
+            self._members[region] = [latest.get(worker.worker_id, worker) for worker in self._members[region]]
+            if self._executors[region] is not None:
+                self._send(region, _shard_move_workers, moved)
+
+    def _locate(self, bookings: List[BookingRequest]) -> Tuple[np.ndarray, np.ndarray]:
+        return self.partitioner.locate(
+            np.array([b.location.latitude for b in bookings]),
+            np.array([b.location.longitude for b in bookings])
+        )
+
+    @staticmethod
+    def _merge_search(searches: List[Dict], regions: List[int]) -> Dict:
+        """リージョンごとの探索状況をまとめる（段階別の計測は合算する）"""
+        stages = [search.pop("stages") for search in searches if "stages" in search]
+        return {
+            "search_complete": all(search.get("search_complete", True) for search in searches),
+            "elapsed_ms": max((search.get("elapsed_ms", 0) for search in searches), default=0),
+            "regions": {str(region): search for region, search in zip(regions, searches)},
+            "stages": SchedulerMetrics.merge_stages(stages)
+        }
+
+    async def optimize(
+        self,
+        booking: BookingRequest,
+        date: str,
+        max_days: Optional[int],
+        top_k: int,
+        candidate_workers: Optional[int] = None,
+        deadline: Optional[float] = None
+    ) -> Tuple[List[Tuple[ScheduledJob, float]], Dict]:
+        """単一予約の最適化（境界付近なら隣のリージョンと比べる）"""
+        primary, secondary = self._locate([booking])
+        regions = [int(primary[0])] + ([int(secondary[0])] if secondary[0] >= 0 else [])
+        if len(regions) > 1:
+            self.stats["border_bookings"] += 1
+
+        dates = self._dates(date, ScheduleOptimizer.DEFAULT_HORIZON_DAYS if max_days is None else max_days)
+        results = await asyncio.gather(*(
+            self._solve(
+                region, dates, _shard_solve_booking,
+                booking, date, max_days, top_k, candidate_workers, deadline, [booking.booking_id], []
+            )
+            for region in regions
+        ))
+
+        options = sorted(
+            (option for region_options, _ in results for option in region_options),
+            key=lambda option: option[1],
+            reverse=True
+        )[:top_k]
+        return options, self._merge_search([search for _, search in results], regions)
+
+    async def optimize_batch(
+        self,
+        bookings: List[BookingRequest],
+        date: str,
+        max_passes: int,
+        candidate_workers: Optional[int] = None,
+        deadline: Optional[float] = None
+    ) -> Tuple[List[ScheduledJob], List[str], Dict]:
+        """
+        複数予約の一括割り当て
+
+        リージョンごとに並列に割り当てた後、境界付近の予約は両側のリージョンで
+        その予約だけを評価し直し、スコアの高い方に割り当てる（booking_id 順）
+        """
+        exclude = [booking.booking_id for booking in bookings]
+        primary, secondary = self._locate(bookings)
+
+        grouped: Dict[int, List[BookingRequest]] = {}
+        for booking, region in zip(bookings, primary.tolist()):
+            grouped.setdefault(region, []).append(booking)
+
+        regions = sorted(grouped)
+        results = await asyncio.gather(*(
+            self._solve(
+                region, [date], _shard_solve_batch,
+                grouped[region], date, max_passes, candidate_workers, deadline, exclude
+            )
+            for region in regions
+        ))
+
+        # リージョンごとの割り当て（境界の調整では、これを確定前のジョブとして重ねて評価する）
+        pending: Dict[int, Dict[str, ScheduledJob]] = {}
+        unassigned: set = set()
+        for region, (assignments, missing, _) in zip(regions, results):
+            pending[region] = {job.booking_id: job for job in assignments}
+            unassigned.update(missing)
+
+        # 境界付近の予約のうち、割り当てられなかったものと、直前の地点から距離スコアが
+        # 満点の範囲を超えて離れたもの（隣のリージョンの方が近い可能性がある）を見直す
+        border = sorted(
+            (
+                (booking, int(region), int(neighbor))
+                for booking, region, neighbor in zip(bookings, primary.tolist(), secondary.tolist())
+                if neighbor >= 0 and (
+                    booking.booking_id not in pending[region] or
+                    pending[region][booking.booking_id].travel_distance_km > self.FULL_SCORE_KM
+                )
+            ),
+            key=lambda item: item[0].booking_id
+        )
+        self.stats["border_bookings"] += len(border)
+
+        for booking, region, neighbor in border:
+            pending.setdefault(neighbor, {})
+            current = pending[region].pop(booking.booking_id, None)
+
+            # 両側で、この予約以外の割り当てを重ねた状態から1件だけ評価する
+            sides = [region, neighbor]
+            options = await asyncio.gather(*(
+                self._solve(
+                    side, [date], _shard_solve_booking,
+                    booking, date, 1, 1, candidate_workers, deadline,
+                    exclude, list(pending[side].values())
+                )
+                for side in sides
+            ))
+
+            best = None
+            for side, (side_options, _) in zip(sides, options):
+                if side_options and (best is None or side_options[0][1] > best[1][1]):
+                    best = (side, side_options[0])
+
+            if best is None:
+                # どちらにも空きがなければ、元の割り当てを残す
+                if current is not None:
+                    pending[region][booking.booking_id] = current
+                continue
+
+            side, (job, _) = best
+            pending[side][booking.booking_id] = job
+            unassigned.discard(booking.booking_id)
+            if side != region:
+                self.stats["reassigned"] += 1
+
+        assignments = [job for region in sorted(pending) for job in pending[region].values()]
+        search = self._merge_search([search for _, _, search in results], regions)
+        search["border_bookings"] = len(border)
+        return assignments, sorted(unassigned), search
+
+    def shutdown(self):
+        for region, executor in enumerate(self._executors):
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
+                self._executors[region] = None
+
+
+def _solve_booking(
+    workers: List[Worker],
+    existing_jobs: List[ScheduledJob],
+    booking: BookingRequest,
+    date: str,
+    max_days: Optional[int],
+    top_k: int,
+    candidate_workers: Optional[int] = None,
+    deadline: Optional[float] = None
+) -> Tuple[List[Tuple[ScheduledJob, float]], Dict]:
+    """
+    プール内で実行する単一予約の最適化（距離行列はプロセスごとに再利用）
+
+    Returns:
+        (上位候補, 探索状況)
+    """
+    optimizer = ScheduleOptimizer(workers, existing_jobs, distance_matrices, candidate_workers)
+    options = optimizer.optimize_horizon(
+        booking, date, max_days=max_days, top_k=top_k, deadline=deadline
+    )
+    return options, optimizer.last_search
+
+
+def _solve_batch(
+    workers: List[Worker],
+    existing_jobs: List[ScheduledJob],
+    bookings: List[BookingRequest],
+    date: str,
+    max_passes: int,
+    candidate_workers: Optional[int] = None,
+    deadline: Optional[float] = None
+) -> Tuple[List[ScheduledJob], List[str], Dict]:
+    """
+    プール内で実行する複数予約の一括割り当て
+
+    Returns:
+        (割り当て結果, 未割り当ての予約ID, 探索状況)
+    """
+    optimizer = ScheduleOptimizer(workers, existing_jobs, distance_matrices, candidate_workers)
+    assignments, unassigned = optimizer.optimize_batch(
+        bookings, date, max_passes=max_passes, deadline=deadline
+    )
+    return assignments, unassigned, optimizer.last_search
+
+
+def _solve_day(
+    workers: List[Worker],
+    bookings: List[BookingRequest],
+    date: str,
+    preferred_window_minutes: int,
+    time_limit_seconds: float
+) -> DayOptimizationResponse:
+    """プール内で実行する日次一括最適化"""
+    optimizer = DayRouteOptimizer(
+        workers,
+        bookings,
+        date,
+        preferred_window_minutes=preferred_window_minutes,
+        time_limit_seconds=time_limit_seconds,
+        backend=travel_time_backend
+    )
+    return optimizer.solve()
+
+
+# リージョンごとの常駐状態（ShardedScheduler のプロセス内。スレッドで実行する場合は全リージョン分）
+_shard_states: Dict[int, Tuple[FleetAvailability, ScheduleOptimizer]] = {}
+
+
+def _init_shard(region: int, workers: List[Worker]):
+    """リージョンのプロセスの初期化（作業員は起動時に1回だけ受け取る）"""
+    availability = FleetAvailability(workers)
+    optimizer = ScheduleOptimizer(workers, [], distance_matrices, index=availability.index)
+    optimizer._job_locations = availability.job_locations
+    _shard_states[region] = (availability, optimizer)
+
+
+def _shard_update(region: int, added: List[ScheduledJob], removed: List[str]):
+    """確定済みジョブの差分を反映"""
+    availability, _ = _shard_states[region]
+    for booking_id in removed:
+        availability.cancel(booking_id)
+    for job in added:
+        availability.book(job)
+
+
+def _shard_move_workers(region: int, workers: List[Worker]):
+    """作業員の位置の更新を反映"""
+    availability, optimizer = _shard_states[region]
+    for worker in workers:
+        before = optimizer._workers_by_id.get(worker.worker_id)
+        availability.move_worker(worker)
+        optimizer.move_worker(worker)
+        if before is not None:
+            optimizer.matrices.forget(before.current_location)
+
+
+@contextmanager
+def _shard_overlay(availability: FleetAvailability, exclude: List[str], pending: List[ScheduledJob]):
+    """
+    exclude の予約を外し、確定前の pending を加えた状態で評価する（終わったら元に戻す）
+    """
+    removed = [job for job in map(availability.cancel, exclude) if job is not None]
+    for job in pending:
+        availability.book(job)
+    try:
+        yield
+    finally:
+        for job in pending:
+            availability.cancel(job.booking_id)
+        for job in removed:
+            availability.book(job)
+
+
+def _shard_solve_booking(
+    region: int,
+    booking: BookingRequest,
+    date: str,
+    max_days: Optional[int],
+    top_k: int,
+    candidate_workers: Optional[int],
+    deadline: Optional[float],
+    exclude: List[str],
+    pending: List[ScheduledJob]
+) -> Tuple[List[Tuple[ScheduledJob, float]], Dict]:
+    """リージョン内での単一予約の最適化"""
+    availability, optimizer = _shard_states[region]
+    optimizer.candidate_workers = candidate_workers or ScheduleOptimizer.CANDIDATE_WORKERS
+    with _shard_overlay(availability, exclude, pending):
+        options = optimizer.optimize_horizon(
+            booking, date, max_days=max_days, top_k=top_k, deadline=deadline
+        )
+    return options, optimizer.last_search
+
+
+def _shard_solve_batch(
+    region: int,
+    bookings: List[BookingRequest],
+    date: str,
+    max_passes: int,
+    candidate_workers: Optional[int],
+    deadline: Optional[float],
+    exclude: List[str]
+) -> Tuple[List[ScheduledJob], List[str], Dict]:
+    """リージョン内での複数予約の一括割り当て"""
+    availability, optimizer = _shard_states[region]
+    optimizer.candidate_workers = candidate_workers or ScheduleOptimizer.CANDIDATE_WORKERS
+    with _shard_overlay(availability, exclude, []):
+        assignments, unassigned = optimizer.optimize_batch(
+            bookings, date, max_passes=max_passes, deadline=deadline
+        )
+    return assignments, unassigned, optimizer.last_search
+
+
+# 移動時間バックエンド（道路グラフは mmap で共有されるため、プール内のプロセスでも再利用）
+travel_time_backend = load_travel_time_backend()
+
+# 日付ごとの距離行列（リクエストをまたいで再利用）
+distance_matrices = DistanceMatrixCache(
+    travel_time_backend,
+    max_dates=int(os.getenv("SCHEDULER_DISTANCE_MATRIX_DATES", str(DistanceMatrixCache.MAX_DATES))),
+    max_points=int(os.getenv("SCHEDULER_DISTANCE_MATRIX_POINTS", str(DistanceMatrixCache.MAX_POINTS)))
+)
+
+# 最適化実行プール
+solver_pool = SolverPool(
+    max_workers=int(os.getenv("SCHEDULER_SOLVER_WORKERS", "0")) or None,
+    max_pending=int(os.getenv("SCHEDULER_SOLVER_MAX_PENDING", "64")),
+    timeout_seconds=float(os.getenv("SCHEDULER_SOLVER_TIMEOUT_SECONDS", "10")),
+    use_threads=os.getenv("SCHEDULER_SOLVER_EXECUTOR", "process") == "thread"
+)
+
+# 確定済みスケジュール（起動時にスナップショット＋WALから復元）
+schedule_store = ScheduleStore(
+    os.getenv("SCHEDULER_STATE_DIR", "scheduler-state"),
+    snapshot_every=int(os.getenv("SCHEDULER_SNAPSHOT_EVERY", "10000")),
+    fsync=os.getenv("SCHEDULER_STATE_FSYNC", "1") == "1"
+)
+
+# 作業員の空き状況（予約・キャンセル時に差分更新し、ストアに永続化）
+fleet_availability = FleetAvailability(load_workers(), schedule_store)
+
+# リージョン分割モード（SCHEDULER_REGIONS が2以上のとき、リージョンごとの常駐プロセスで最適化）
+sharded_scheduler = (
+    ShardedScheduler(
+        fleet_availability.workers,
+        schedule_store,
+        regions=int(os.getenv("SCHEDULER_REGIONS", "0")),
+        border_km=float(os.getenv("SCHEDULER_REGION_BORDER_KM", "10")),
+        timeout_seconds=solver_pool.timeout_seconds,
+        use_threads=solver_pool.use_threads
+    )
+    if int(os.getenv("SCHEDULER_REGIONS", "0")) > 1 else None
+)
+
+# 作業員の現在位置（GPS の位置通知で更新。作業員一覧は FleetAvailability と共有）
+worker_positions = WorkerPositions(
+    fleet_availability.workers,
+    threshold_km=float(os.getenv("SCHEDULER_GPS_THRESHOLD_KM", "0.5"))
+)
+
+
+# キャンセル・変更後の差分再最適化と、割り当て変更の配信
+schedule_repair = ScheduleRepair(
+    fleet_availability,
+    distance_matrices,
+    max_moves=int(os.getenv("SCHEDULER_REPAIR_MAX_MOVES", "20"))
+)
+assignment_feed = AssignmentFeed()
+
+# 確定済みジョブのリマインド送信（前日・2時間前・出発時）
+reminder_dispatcher = ReminderDispatcher(
+    schedule_store,
+    load_reminder_sender(),
+    batch_size=int(os.getenv("SCHEDULER_REMINDER_BATCH_SIZE", "500"))
+)
+
+
+# /metrics で公開する計測値と、リクエスト単位のプロファイラ（SCHEDULER_PROFILING=1 のときだけ
+# 受け付ける。プロファイル中はイベントループが止まるので、時間予算を上限で切り詰める）
+scheduler_metrics = SchedulerMetrics()
+PROFILING_ENABLED = os.getenv("SCHEDULER_PROFILING", "0") == "1"
+PROFILE_INTERVAL_SECONDS = float(os.getenv("SCHEDULER_PROFILE_INTERVAL_MS", "1")) / 1000
+PROFILE_TIME_LIMIT_MS = int(os.getenv("SCHEDULER_PROFILE_TIME_LIMIT_MS", "2000"))
+
+
+def _profiling_requested(profile: bool, header: Optional[str]) -> bool:
+    """?profile=true または X-Scheduler-Profile ヘッダでプロファイルを指定したか"""
+    if profile or (header or "").lower() in ("1", "true", "yes"):
+        if not PROFILING_ENABLED:
+            raise HTTPException(
+                status_code=403, detail="プロファイルは無効です（SCHEDULER_PROFILING=1 で有効化）"
+            )
+        if not SamplingProfiler.available():
+            raise HTTPException(status_code=501, detail="この環境ではプロファイラを利用できません")
+        return True
+    return False
+
+
+# 確定時にほかのリクエストの確定と重なった場合に探索し直す回数の上限と、やり直しで求める候補数
+BOOKING_ATTEMPTS = 3
+BOOKING_RETRY_TOP_K = 10
+
+
+def _positive_constraint(constraints: Dict, name: str, default: Optional[int]) -> Optional[int]:
+    """constraints の1以上の整数の指定（省略時は default、それ以外の値は 400）"""
+    value = constraints.get(name)
+    if value is None:
+        return default
+    if isinstance(value, bool) or not isinstance(value, int) or value < 1:
+        raise HTTPException(status_code=400, detail=f"constraints.{name} は1以上の整数で指定してください")
+    return value
+
+
+def _positive_number_constraint(constraints: Dict, name: str, default: Optional[float]) -> Optional[float]:
+    """constraints の正の数の指定（小数も可。省略時は default、それ以外の値は 400）"""
+    value = constraints.get(name)
+    if value is None:
+        return default
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not 0 < value < math.inf:
+        raise HTTPException(status_code=400, detail=f"constraints.{name} は正の数で指定してください")
+    return value
+
+
+def _profile_time_limit(time_limit_ms: Optional[int]) -> int:
+    """プロファイルするリクエストの時間予算（ms、PROFILE_TIME_LIMIT_MS まで）"""
+    return min(time_limit_ms or PROFILE_TIME_LIMIT_MS, PROFILE_TIME_LIMIT_MS)
+
+
+async def _run_profiled(key: str, fn, *args):
+    """
+    fn(*args) をこのプロセスで直接実行し、(結果, collapsed 形式のプロファイル) を返す
+
+    実行中はイベントループが止まるため、プールと同じ受付制御（待ち行列の上限）を通す。
+    """
+    async def run():
+        with SamplingProfiler(PROFILE_INTERVAL_SECONDS) as profiler:
+            result = fn(*args)
+        return result, profiler.collapsed()
+
+    return await solver_pool.join(key, run)
+
+
+def _state_version() -> Tuple[int, int]:
+    """確定済みジョブと作業員の位置の版（合流用のキーに含め、状態が変われば別の計算にする）"""
+    return schedule_store.version, worker_positions.stats["moved"]
+
+
+def _publish_changes(diffs: List[Dict]):
+    """割り当ての変更を SSE の購読者に配信し、リマインド・リージョンの常駐状態に反映する"""
+    assignment_feed.publish(diffs)
+    reminder_dispatcher.apply(diffs)
+    if sharded_scheduler is not None:
+        sharded_scheduler.apply(diffs)
+
+
+def _existing_jobs(start_date: str, days: int, exclude: Iterable[str] = ()) -> List[ScheduledJob]:
+    """開始日から days 日分の確定済みジョブ（再割り当てする予約は除く）"""
+    exclude = set(exclude)
+    first_day = datetime.strptime(start_date, "%Y-%m-%d")
+    return [
+        job
+        for offset in range(days)
+        for job in schedule_store.jobs_on((first_day + timedelta(days=offset)).strftime("%Y-%m-%d"))
+        if job.booking_id not in exclude
+    ]
+
+
+def _search_scope(
+    booking: BookingRequest,
+    start_date: str,
+    days: int,
+    candidate_workers: Optional[int],
+    nearby: bool
+) -> Tuple[List[Worker], List[ScheduledJob]]:
+    """
+    単一予約の最適化でソルバーに渡す作業員と、その探索期間の確定済みジョブ
+
+    nearby なら、各日で予約地点に近い作業員（拠点・その日のジョブ地点が近い順に、
+    optimize_horizon が探索範囲を1回広げるまでに評価する candidate_workers×4 人）に絞り、
+    そのジョブだけを渡す（探索期間の全ジョブをリクエストごとにコピーしてプロセスへ送らない）。
+    同じ予約の再最適化なら現在の割り当ては除く
+    """
+    # 位置通知の反映で要素が差し替わるため、その時点の一覧を渡す
+    workers = list(fleet_availability.workers)
+    if not nearby:
+        return workers, _existing_jobs(start_date, days, exclude=[booking.booking_id])
+
+    first_day = datetime.strptime(start_date, "%Y-%m-%d")
+    dates = [(first_day + timedelta(days=offset)).strftime("%Y-%m-%d") for offset in range(days)]
+    limit = (candidate_workers or ScheduleOptimizer.CANDIDATE_WORKERS) * 4
+
+    # 作業員・ジョブ地点の空間索引はメインプロセスの ScheduleRepair のものを共有している
+    optimizer = schedule_repair.optimizer
+    chosen = {
+        worker.worker_id
+        for date in dates
+        for worker in optimizer._nearest_workers(booking.location, date, limit)
+    }
+    workers = [worker for worker in workers if worker.worker_id in chosen]
+    jobs = [
+        job
+        for date in dates
+        for worker in workers
+        for job in schedule_store.jobs_for(worker.worker_id, date)
+        if job.booking_id != booking.booking_id
+    ]
+    return workers, jobs
+
+
+@app.post("/api/internal/scheduler/optimize", response_model=OptimizationResponse)
+async def optimize_schedule(
+    request: OptimizationRequest,
+    profile: bool = False,
+    x_scheduler_profile: Optional[str] = Header(None)
+):
+    """
+    スケジュール最適化API
+
+    新規予約を最適な作業員・時間に割り当て
+
+    SCHEDULER_PROFILING=1 のとき、?profile=true（または X-Scheduler-Profile: 1）を付けると、
+    このリクエストの最適化を時間予算 PROFILE_TIME_LIMIT_MS まででサンプリングプロファイラ付きで
+    実行し、metadata.profile に collapsed 形式のスタック、
+    metadata.stages に段階別の計測を入れて返す
+    """
+    profiling = _profiling_requested(profile, x_scheduler_profile)
+
+    constraints = request.constraints or {}
+    max_days = _positive_constraint(constraints, "max_horizon_days", ScheduleOptimizer.DEFAULT_HORIZON_DAYS)
+    top_k = _positive_constraint(constraints, "top_k", 3)
+    candidate_workers = _positive_constraint(constraints, "candidate_workers", None)
+    time_limit_ms = _positive_constraint(constraints, "time_limit_ms", None)
+
+    try:
+        if profiling:
+            time_limit_ms = _profile_time_limit(time_limit_ms)
+
+        # 時間予算は待ち行列での待ち時間も含めて受付時刻から数える
+        deadline = clock.time() + time_limit_ms / 1000 if time_limit_ms else None
+
+        # 探索中にほかのリクエストが同じ時間帯を確定した場合は、残りの候補を試し、
+        # すべて重なっていれば最新の状態で探索し直す（同時に探索し直すリクエスト同士が
+        # 同じ候補を取り合わないよう、やり直しでは BOOKING_RETRY_TOP_K 件まで候補を求める）
+        for attempt in range(BOOKING_ATTEMPTS):
+            search_top_k = top_k if attempt == 0 else max(top_k, BOOKING_RETRY_TOP_K)
+
+            # 最適化実行（探索期間内の上位候補を取得）
+            search_args = (request.new_booking, request.date, max_days, search_top_k, candidate_workers)
+            if sharded_scheduler is not None and not profiling:
+                # リージョンのプロセスが確定済みジョブを常駐させているので、ジョブは送らない
+                # （待ち行列の上限と同じ内容のリクエストの合流はプールと共通）
+                options, search = await solver_pool.join(
+                    SolverPool.request_key("optimize-sharded", time_limit_ms, _state_version(), *search_args),
+                    lambda: sharded_scheduler.optimize(*search_args, deadline)
+                )
+            else:
+                # 近くの作業員とそのジョブだけを渡し、その範囲に空きがなければ全作業員で探索し直す
+                for nearby in (True, False):
+                    key = SolverPool.request_key(
+                        "optimize-profile" if profiling else "optimize",
+                        time_limit_ms, nearby, _state_version(), *search_args
+                    )
+                    solver_pool.admit(key)
+                    workers, existing_jobs = _search_scope(
+                        request.new_booking, request.date, max_days, candidate_workers, nearby
+                    )
+                    args = (workers, existing_jobs, *search_args)
+
+                    if profiling:
+                        (options, search), profile_stacks = await _run_profiled(
+                            key, _solve_booking, *args, deadline
+                        )
+                    else:
+                        options, search = await solver_pool.run(key, _solve_booking, *args, deadline)
+                    if options or len(workers) == len(fleet_availability.workers):
+                        break
+            stages = scheduler_metrics.record_search("optimize", search)
+
+            if not options:
+                raise NoCapacityError(request.new_booking.booking_id, request.date, max_days)
+
+            # 割り当てを確定（dry_run なら候補を返すだけ）
+            if constraints.get("dry_run"):
+                optimal_job, score = options[0]
+                break
+
+            # 予約し直しなら try_book が置き換える前の割り当て（配信・リージョンから外す）
+            previous = fleet_availability.index.get(request.new_booking.booking_id)
+            booked = next((option for option in options if fleet_availability.try_book(option[0])), None)
+            if booked is not None:
+                optimal_job, score = booked
+                await schedule_store.sync()
+                _publish_changes([ScheduleRepair._diff("assigned", previous, optimal_job)])
+                break
+        else:
+            raise BookingConflictError(request.new_booking.booking_id)
+
+        # 割り当てた作業員のその日のスケジュールを構築（確定済みの最新の状態から）
+        all_jobs = sorted(
+            [
+                job for job in fleet_availability.index.jobs_for(optimal_job.worker_id, optimal_job.scheduled_date)
+                if job.booking_id != optimal_job.booking_id
+            ] + [optimal_job],
+            key=lambda job: _to_minutes(job.scheduled_time_start)
+        )
+
+        # 統計計算
+        total_distance = sum(job.travel_distance_km for job in all_jobs)
+        total_travel_time = sum(job.travel_time_minutes for job in all_jobs)
+        efficiency_score = score / 100.0
+
+        metadata = {
+            "score": round(score, 2),
+            "time_limit_ms": time_limit_ms,
+            **search
+        }
+        if profiling:
+            metadata.update(stages=stages, profile=profile_stacks)
+
+        return OptimizationResponse(
+            optimal_schedule=all_jobs,
+            efficiency_score=round(efficiency_score, 2),
+            total_travel_distance_km=round(total_distance, 2),
+            total_travel_time_minutes=total_travel_time,
+            alternatives=[job for job, _ in options if job is not optimal_job][:top_k - 1],
+            metadata=metadata
+        )
+
+    except (NoCapacityError, BookingConflictError) as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+    except SolverOverloadedError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="最適化が期限内に完了しませんでした")
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/api/internal/scheduler/optimize-batch", response_model=BatchOptimizationResponse)
+async def optimize_batch(
+    request: BatchOptimizationRequest,
+    profile: bool = False,
+    x_scheduler_profile: Optional[str] = Header(None)
+):
+    """
+    一括割り当てAPI
+
+    まとめて届いた予約を指定日の既存スケジュールに割り当てる
+    （割り当てられなかった予約は unassigned_booking_ids で返す）。
+    プロファイルの指定は optimize と同じ
+    """
+    profiling = _profiling_requested(profile, x_scheduler_profile)
+
+    constraints = request.constraints or {}
+    candidate_workers = _positive_constraint(constraints, "candidate_workers", None)
+    time_limit_ms = _positive_constraint(constraints, "time_limit_ms", None)
+    max_passes = _positive_constraint(constraints, "max_passes", 20)
+
+    try:
+        if profiling:
+            time_limit_ms = _profile_time_limit(time_limit_ms)
+
+        # 時間予算は待ち行列での待ち時間も含めて受付時刻から数える
+        deadline = clock.time() + time_limit_ms / 1000 if time_limit_ms else None
+
+        # 探索中にほかのリクエストの確定と重なった予約は、最新の状態で探索し直す
+        # （BOOKING_ATTEMPTS 回で割り当てられなければ未割り当てとして返す）
+        pending = request.bookings
+        assignments: List[ScheduledJob] = []
+        unassigned: List[str] = []
+        conflicts = 0
+        for _ in range(BOOKING_ATTEMPTS):
+            batch = (pending, request.date, max_passes, candidate_workers)
+
+            if sharded_scheduler is not None and not profiling:
+                # リージョンのプロセスが確定済みジョブを常駐させているので、ジョブは送らない
+                solved, missed, search = await solver_pool.join(
+                    SolverPool.request_key("optimize-batch-sharded", time_limit_ms, _state_version(), *batch),
+                    lambda: sharded_scheduler.optimize_batch(*batch, deadline)
+                )
+            else:
+                key = SolverPool.request_key(
+                    "optimize-batch-profile" if profiling else "optimize-batch",
+                    time_limit_ms, _state_version(), *batch
+                )
+                solver_pool.admit(key)
+                # 位置通知の反映で要素が差し替わるため、その時点の一覧を渡す
+                args = (
+                    list(fleet_availability.workers),
+                    _existing_jobs(request.date, 1, exclude=[booking.booking_id for booking in pending]),
+                    *batch
+                )
+
+                if profiling:
+                    (solved, missed, search), profile_stacks = await _run_profiled(
+                        key, _solve_batch, *args, deadline
+                    )
+                else:
+                    solved, missed, search = await solver_pool.run(key, _solve_batch, *args, deadline)
+            stages = scheduler_metrics.record_search("batch", search)
+            unassigned.extend(missed)
+
+            # 割り当てを確定（dry_run なら候補を返すだけ）
+            if constraints.get("dry_run"):
+                assignments.extend(solved)
+                break
+
+            # 予約し直しなら try_book が置き換える前の割り当て（配信・リージョンから外す）
+            previous = {job.booking_id: fleet_availability.index.get(job.booking_id) for job in solved}
+            booked = [job for job in solved if fleet_availability.try_book(job)]
+            assignments.extend(booked)
+            await schedule_store.sync()
+            _publish_changes([
+                ScheduleRepair._diff("assigned", previous[job.booking_id], job) for job in booked
+            ])
+
+            conflicted = {job.booking_id for job in solved} - {job.booking_id for job in booked}
+            if not conflicted:
+                break
+            conflicts += len(conflicted)
+            pending = [booking for booking in pending if booking.booking_id in conflicted]
+        else:
+            unassigned.extend(booking.booking_id for booking in pending)
+
+        metadata = {"time_limit_ms": time_limit_ms, "booking_conflicts": conflicts, **search}
+        if profiling:
+            metadata.update(stages=stages, profile=profile_stacks)
+
+        return BatchOptimizationResponse(
+            date=request.date,
+            assignments=assignments,
+            unassigned_booking_ids=unassigned,
+            total_travel_distance_km=round(sum(job.travel_distance_km for job in assignments), 2),
+            total_travel_time_minutes=sum(job.travel_time_minutes for job in assignments),
+            metadata=metadata
+        )
+
+    except SolverOverloadedError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="最適化が期限内に完了しませんでした")
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/api/internal/scheduler/optimize-day", response_model=DayOptimizationResponse)
+async def optimize_day(request: DayOptimizationRequest):
+    """
+    日次一括最適化API
+
+    指定日の全予約を作業員全員に一括で割り当て、作業員ごとの巡回ルートを返す
+    """
+    constraints = request.constraints or {}
+    time_limit_seconds = _positive_number_constraint(constraints, "time_limit_seconds", 5.0)
+    time_limit_ms = _positive_constraint(constraints, "time_limit_ms", None)
+    if time_limit_ms is not None:
+        time_limit_seconds = time_limit_ms / 1000
+    preferred_window_minutes = _positive_constraint(constraints, "preferred_window_minutes", 60)
+
+    try:
+        args = (
+            request.workers,
+            request.bookings,
+            request.date,
+            preferred_window_minutes,
+            time_limit_seconds
+        )
+
+        # ソルバーの制限時間にモデル構築分の余裕を持たせて待つ
+        return await solver_pool.run(
+            SolverPool.request_key("optimize-day", *args),
+            _solve_day,
+            *args,
+            timeout=max(solver_pool.timeout_seconds, time_limit_seconds * 2)
+        )
+
+    except SolverOverloadedError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="最適化が期限内に完了しませんでした")
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/v1/availability")
+async def get_availability(
+    latitude: float,
+    longitude: float,
+    duration_minutes: int = Query(120, gt=0),
+    radius_km: float = 20.0,
+    start_date: Optional[str] = None,
+    days: int = Query(14, ge=1, le=31)
+):
+    """
+    空き枠検索API
+
+    指定地点の近くの作業員について、duration_minutes の作業を開始できる
+    日付・時刻を返す（最適化は行わず、空き状況ビットマップから求める）。
+    過ぎた日付と、今日のすでに過ぎた開始時刻は返さない
+    """
+    try:
+        location = Location(latitude=latitude, longitude=longitude, address="")
+        workers = fleet_availability.workers_near(location, radius_km)
+        now = datetime.now()
+        today = now.strftime("%Y-%m-%d")
+        first_day = datetime.strptime(start_date, "%Y-%m-%d") if start_date else now
+
+        dates = []
+        for offset in range(days):
+            date = (first_day + timedelta(days=offset)).strftime("%Y-%m-%d")
+            if date < today:
+                continue
+            earliest = now.hour * 60 + now.minute if date == today else 0
+
+            # 開始時刻ごとに対応可能な作業員数を集計
+            counts: Dict[int, int] = {}
+            for worker in workers:
+                if fleet_availability.index.count(worker.worker_id, date) >= worker.max_jobs_per_day:
+                    continue
+                fits = fleet_availability.fitting_starts(worker.worker_id, date, duration_minutes)
+                for minute in FleetAvailability.slot_minutes(fits):
+                    if minute >= earliest:
+                        counts[minute] = counts.get(minute, 0) + 1
+
+            if counts:
+                dates.append({
+                    "date": date,
+                    "slots": [
+                        {"start_time": _format_minutes(minute), "available_workers": count}
+                        for minute, count in sorted(counts.items())
+                    ]
+                })
+
+        return {
+            "duration_minutes": duration_minutes,
+            "radius_km": radius_km,
+            "candidate_workers": len(workers),
+            "dates": dates
+        }
+
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/api/v1/workers/{worker_id}/schedule")
 async def get_worker_schedule(worker_id: str, date: str):
     """
-    作業員の日次スケジュールを取得
+    作業員の日次スケジュールを取得（メモリ上の索引から返す）
     """
-    # TODO: DBから取得
     return {
         "worker_id": worker_id,
         "date": date,
-        "assignments": []
+        "assignments": schedule_store.jobs_for(worker_id, date)
+    }
+
+
+@app.post("/api/v1/workers/locations")
+async def ingest_worker_locations(batch: LocationBatch):
+    """
+    作業員の位置通知の取り込み（複数作業員分をまとめて受け付ける）
+
+    位置が SCHEDULER_GPS_THRESHOLD_KM 以上動いた作業員だけ、空間索引と
+    距離行列のキャッシュを更新する（通知ごとのスコア再計算は行わない）
+    """
+    received_at = clock.time()
+    pings = batch.pings
+    moved = worker_positions.ingest(
+        [ping.worker_id for ping in pings],
+        [ping.latitude for ping in pings],
+        [ping.longitude for ping in pings],
+        [received_at if ping.timestamp is None else ping.timestamp for ping in pings]
+    )
+
+    for before, after in moved:
+        fleet_availability.move_worker(after)
+        schedule_repair.optimizer.move_worker(after)
+        distance_matrices.forget(before.current_location)
+
+    if sharded_scheduler is not None and moved:
+        sharded_scheduler.move_workers([after for _, after in moved])
+
+    return {"accepted": len(pings), "moved_workers": len(moved)}
+
+
+@app.get("/api/v1/workers/{worker_id}/eta")
+async def get_worker_eta(worker_id: str, date: Optional[str] = None, at: Optional[str] = None):
+    """
+    作業員の次のジョブへの到着予定（現在位置からの移動時間で計算）
+
+    date（YYYY-MM-DD）・at（HH:MM）を省略した場合は現在の日時を基準にする
+    """
+    worker = worker_positions.worker(worker_id)
+    if worker is None:
+        raise HTTPException(status_code=404, detail=f"作業員が見つかりません: {worker_id}")
+
+    now = datetime.now()
+    date = date or now.strftime("%Y-%m-%d")
+    try:
+        minute = _to_minutes(at) if at else now.hour * 60 + now.minute
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"時刻の形式が不正です: {at}")
+
+    response = {
+        "worker_id": worker_id,
+        "date": date,
+        "position": worker_positions.position(worker_id),
+        "next_job": None
+    }
+
+    # 終了していない最初のジョブ
+    job = next(
+        (
+            job for job in schedule_store.jobs_for(worker_id, date)
+            if _to_minutes(job.scheduled_time_end) > minute
+        ),
+        None
+    )
+    if job is None:
+        return response
+
+    start = _to_minutes(job.scheduled_time_start)
+    next_job = {
+        "booking_id": job.booking_id,
+        "scheduled_time_start": job.scheduled_time_start,
+        "in_progress": start <= minute
     }
 
+    if job.location and start > minute:
+        matrix = distance_matrices.for_date(date)
+        travel = matrix.travel_time(worker.current_location, job.location)
+        next_job.update({
+            "travel_distance_km": round(matrix.distance(worker.current_location, job.location), 2),
+            "travel_time_minutes": travel,
+            "eta": _format_minutes(minute + travel),
+            "delay_minutes": max(0, minute + travel - start)
+        })
+
+    response["next_job"] = next_job
+    return response
+
+
+@app.post("/api/v1/bookings/{booking_id}/cancel")
+async def cancel_booking(booking_id: str):
+    """
+    キャンセルAPI
+
+    ジョブを削除し、空いた枠に近くのジョブを移して改善する。変更は差分で返し、配信もする
+    """
+    try:
+        changes = schedule_repair.cancel(booking_id)
+        changes += schedule_repair.run()
+
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"予約が見つかりません: {booking_id}")
+
+    await schedule_store.sync()
+    _publish_changes(changes)
+    return {"booking_id": booking_id, "changes": changes}
+
+
+@app.post("/api/v1/bookings/{booking_id}/reschedule")
+async def reschedule_booking(booking_id: str, request: RescheduleRequest):
+    """
+    変更API（作業員・日付・時刻の変更、作業の延長）
+
+    重なったジョブは割り当て直し、空いた枠には近くのジョブを移す。変更は差分で返し、配信もする
+    """
+    try:
+        changes = schedule_repair.reschedule(booking_id, request.model_dump(exclude_none=True))
+        changes += schedule_repair.run()
+
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"予約が見つかりません: {booking_id}")
+
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    await schedule_store.sync()
+    _publish_changes(changes)
+    return {"booking_id": booking_id, "changes": changes}
+
+
+@app.get("/api/v1/schedule/events")
+async def stream_schedule_events(
+    worker_id: Optional[str] = None,
+    date: Optional[str] = None,
+    last_event_id: Optional[str] = Header(None)
+):
+    """
+    割り当て変更の配信（Server-Sent Events）
+
+    worker_id・date を指定すると、変更前後のどちらかが該当する差分だけを送る。
+    再接続時は Last-Event-ID 以降の差分を再送する
+    """
+    try:
+        after_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Last-Event-ID が不正です: {last_event_id}")
+    queue = assignment_feed.subscribe(after_id)
+
+    def matches(event: Dict) -> bool:
+        jobs = [job for job in (event["before"], event["after"]) if job]
+        return (
+            (worker_id is None or any(job["worker_id"] == worker_id for job in jobs)) and
+            (date is None or any(job["scheduled_date"] == date for job in jobs))
+        )
+
+    async def events():
+        try:
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    # 接続維持のコメント行
+                    yield ": keep-alive\n\n"
+                    continue
+
+                # 配信が追いつかず切断された
+                if event is None:
+                    break
+
+                if matches(event):
+                    data = json.dumps(event, ensure_ascii=False)
+                    yield f"id: {event['id']}\nevent: assignment\ndata: {data}\n\n"
+        finally:
+            assignment_feed.unsubscribe(queue)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.on_event("startup")
+def open_schedule_store():
+    # プール内のプロセスでは開かない（WAL への書き込みはこのプロセスだけ）
+    schedule_store.open()
+
+
+@app.on_event("startup")
+async def start_reminder_dispatcher():
+    reminder_dispatcher.start()
+
+
+@app.on_event("shutdown")
+async def stop_reminder_dispatcher():
+    await reminder_dispatcher.stop()
+
+
+@app.on_event("shutdown")
+def shutdown_solver_pool():
+    solver_pool.shutdown()
+    if sharded_scheduler is not None:
+        sharded_scheduler.shutdown()
+    schedule_store.close()
+
+
+@app.middleware("http")
+async def measure_requests(request: Request, call_next):
+    """リクエストの処理時間をルート（パスのテンプレート）ごとに集計"""
+    started = clock.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    scheduler_metrics.observe(
+        "scheduler_request_seconds",
+        clock.perf_counter() - started,
+        method=request.method,
+        route=getattr(route, "path", "unmatched"),
+        status=response.status_code
+    )
+    return response
+
+
+@app.get("/metrics")
+async def metrics():
+    """
+    Prometheus 形式の計測値
+
+    最適化の段階別の所要時間・件数、キャッシュのヒット率、各コンポーネントの累計。
+    計測値・累計はイベントループ上で更新されるので、読み出しもイベントループで行う
+    （同期関数にするとスレッドプールで実行され、更新中の辞書を走査してしまう）
+    """
+    m = scheduler_metrics
+    m.set("scheduler_solver_pending", solver_pool.pending)
+    m.set("scheduler_solver_rejected_total", solver_pool.stats["rejected"])
+    m.set("scheduler_cache_lookups_total", solver_pool.stats["shared"], cache="solver_pool", result="hit")
+    m.set("scheduler_cache_lookups_total", solver_pool.stats["computed"], cache="solver_pool", result="miss")
+    for result, count in worker_positions.stats.items():
+        m.set("scheduler_gps_pings_total", count, result=result)
+    for result, count in reminder_dispatcher.stats.items():
+        m.set("scheduler_reminders_total", count, result=result)
+    if sharded_scheduler is not None:
+        for event, count in sharded_scheduler.stats.items():
+            m.set("scheduler_region_events_total", count, event=event)
+
+    return PlainTextResponse(m.render(), media_type="text/plain; version=0.0.4")
+
 
 @app.get("/health")
 def health_check():
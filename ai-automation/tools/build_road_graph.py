@@ -0,0 +1,226 @@
+"""
+道路グラフ前処理ツール
+
+ノードと有向辺のCSVから Contraction Hierarchies を構築し、スケジューラが
+mmap で読み込むバイナリ形式（scheduler-service.py の RoadGraph）で書き出す。
+
+    nodes.csv: id,lat,lon
+    edges.csv: from,to,seconds[,oneway]   （oneway 省略時は一方通行）
+
+    python tools/build_road_graph.py nodes.csv edges.csv road_graph.bin
+    ROAD_GRAPH_PATH=road_graph.bin python prototypes/scheduler-service.py
+"""
+
+import argparse
+import csv
+import heapq
+import math
+import struct
+import time
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+# ファイル形式（scheduler-service.py の RoadGraph と揃える）
+MAGIC = b"ZRG1"
+VERSION = 1
+HEADER = struct.Struct("<4sIIIIIdd")
+
+# セル座標をキーにまとめる際のオフセット（負の座標に対応）
+CELL_OFFSET = 1 << 20
+
+
+def cell_key(i: int, j: int) -> int:
+    return (i + CELL_OFFSET) * (CELL_OFFSET * 2) + (j + CELL_OFFSET)
+
+
+class RoadGraphBuilder:
+    """
+    道路グラフの前処理（オフライン）
+
+    ノード座標と有向辺（所要秒数）から Contraction Hierarchies を構築し、
+    スケジューラの RoadGraph の形式で書き出す。ノードの縮約順は edge difference による遅延更新。
+    """
+
+    # 証人探索で確定させるノード数の上限（超えたらショートカットを追加）
+    WITNESS_SETTLE_LIMIT = 64
+
+    def __init__(self, lats: List[float], lons: List[float], cell_km: float = 0.5):
+        self.lats = list(lats)
+        self.lons = list(lons)
+        self.cell_km = cell_km
+        n = len(self.lats)
+        self._out: List[Dict[int, float]] = [dict() for _ in range(n)]
+        self._in: List[Dict[int, float]] = [dict() for _ in range(n)]
+
+    def add_edge(self, u: int, v: int, seconds: float, oneway: bool = True):
+        """有向辺を追加（oneway=False なら逆方向も）"""
+        for a, b in ((u, v),) if oneway else ((u, v), (v, u)):
+            if a != b and seconds < self._out[a].get(b, float("inf")):
+                self._out[a][b] = seconds
+                self._in[b][a] = seconds
+
+    def _witness(self, source: int, excluded: int, limit: float, contracted) -> Dict[int, float]:
+        """excluded を通らない source からの最短距離（limit まで、件数制限付き）"""
+        best = {source: 0.0}
+        heap = [(0.0, source)]
+        settled = 0
+        while heap and settled < self.WITNESS_SETTLE_LIMIT:
+            d, u = heapq.heappop(heap)
+            if d > best.get(u, float("inf")) or d > limit:
+                continue
+            settled += 1
+            for v, w in self._out[u].items():
+                if v == excluded or contracted[v]:
+                    continue
+                nd = d + w
+                if nd < best.get(v, float("inf")):
+                    best[v] = nd
+                    heapq.heappush(heap, (nd, v))
+        return best
+
+    def _shortcuts(self, v: int, contracted) -> List[Tuple[int, int, float]]:
+        """v を縮約する際に必要なショートカット"""
+        shortcuts = []
+        outgoing = [(w, c) for w, c in self._out[v].items() if not contracted[w]]
+        if not outgoing:
+            return shortcuts
+        max_out = max(c for _, c in outgoing)
+
+        for u, cu in self._in[v].items():
+            if contracted[u]:
+                continue
+            witness = self._witness(u, v, cu + max_out, contracted)
+            for w, cw in outgoing:
+                if w != u and witness.get(w, float("inf")) > cu + cw:
+                    shortcuts.append((u, w, cu + cw))
+        return shortcuts
+
+    def build(self) -> Tuple[List[int], List[Tuple[int, int, float]]]:
+        """縮約順位と、全ての辺（元の辺＋ショートカット）を返す"""
+        n = len(self.lats)
+        contracted = [False] * n
+        deleted_neighbors = [0] * n
+        rank = [0] * n
+        edges = {(u, v): w for u in range(n) for v, w in self._out[u].items()}
+
+        def priority(v):
+            degree = sum(1 for u in self._in[v] if not contracted[u]) + \
+                sum(1 for w in self._out[v] if not contracted[w])
+            return len(self._shortcuts(v, contracted)) - degree + deleted_neighbors[v]
+
+        heap = [(priority(v), v) for v in range(n)]
+        heapq.heapify(heap)
+        order = 0
+
+        while heap:
+            _, v = heapq.heappop(heap)
+            if contracted[v]:
+                continue
+
+            # 遅延更新: 優先度を再計算し、次点より悪ければ戻す
+            current = priority(v)
+            if heap and current > heap[0][0]:
+                heapq.heappush(heap, (current, v))
+                continue
+
+            for u, w, cost in self._shortcuts(v, contracted):
+                if cost < self._out[u].get(w, float("inf")):
+                    self._out[u][w] = cost
+                    self._in[w][u] = cost
+                    edges[(u, w)] = cost
+
+            contracted[v] = True
+            rank[v] = order
+            order += 1
+            for neighbor in list(self._in[v]) + list(self._out[v]):
+                deleted_neighbors[neighbor] += 1
+
+        return rank, [(u, v, w) for (u, v), w in edges.items()]
+
+    def write(self, path: str) -> Tuple[int, int]:
+        """CHを構築して RoadGraph 形式で書き出し、(上向き辺数, 下向き辺数) を返す"""
+        n = len(self.lats)
+        rank, edges = self.build()
+
+        up: List[List[Tuple[int, float]]] = [[] for _ in range(n)]
+        down: List[List[Tuple[int, float]]] = [[] for _ in range(n)]
+        for u, v, w in edges:
+            if rank[u] < rank[v]:
+                up[u].append((v, w))
+            else:
+                down[v].append((u, w))
+
+        def csr(adjacency):
+            offsets = np.zeros(n + 1, dtype="<u4")
+            offsets[1:] = np.cumsum([len(a) for a in adjacency])
+            targets = np.array([t for a in adjacency for t, _ in a], dtype="<u4")
+            weights = np.array([w for a in adjacency for _, w in a], dtype="<f4")
+            return offsets, targets, weights
+
+        lat = np.array(self.lats, dtype="<f8")
+        lon = np.array(self.lons, dtype="<f8")
+
+        # 最寄りノード検索用のグリッド
+        lat_step = self.cell_km / 111.32
+        lon_step = self.cell_km / (111.32 * math.cos(math.radians(float(np.mean(lat)) if n else 35.7)))
+        keys = np.array([
+            cell_key(int(math.floor(a / lat_step)), int(math.floor(b / lon_step)))
+            for a, b in zip(self.lats, self.lons)
+        ], dtype="<i8")
+        cell_nodes = np.argsort(keys, kind="stable").astype("<u4")
+        cell_keys, counts = np.unique(keys[cell_nodes], return_counts=True)
+        cell_offsets = np.zeros(len(cell_keys) + 1, dtype="<u4")
+        cell_offsets[1:] = np.cumsum(counts)
+
+        up_csr = csr(up)
+        down_csr = csr(down)
+
+        with open(path, "wb") as f:
+            f.write(HEADER.pack(
+                MAGIC, VERSION, n,
+                len(up_csr[1]), len(down_csr[1]), len(cell_keys),
+                lat_step, lon_step
+            ))
+            for array in (lat, lon, *up_csr, *down_csr, cell_keys.astype("<i8"), cell_offsets, cell_nodes):
+                f.write(b"\0" * (-f.tell() % 8))
+                f.write(array.tobytes())
+
+        return len(up_csr[1]), len(down_csr[1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("nodes", type=Path)
+    parser.add_argument("edges", type=Path)
+    parser.add_argument("output", type=Path)
+    parser.add_argument("--cell-km", type=float, default=0.5)
+    args = parser.parse_args()
+
+    ids = {}
+    lats, lons = [], []
+    with open(args.nodes, newline="") as f:
+        for row in csv.DictReader(f):
+            ids[row["id"]] = len(lats)
+            lats.append(float(row["lat"]))
+            lons.append(float(row["lon"]))
+
+    builder = RoadGraphBuilder(lats, lons, cell_km=args.cell_km)
+    num_edges = 0
+    with open(args.edges, newline="") as f:
+        for row in csv.DictReader(f):
+            oneway = row.get("oneway", "1") not in ("0", "false", "no")
+            builder.add_edge(ids[row["from"]], ids[row["to"]], float(row["seconds"]), oneway=oneway)
+            num_edges += 1
+
+    started = time.perf_counter()
+    num_up, num_down = builder.write(str(args.output))
+    print(
+        f"nodes={len(lats)} edges={num_edges} up={num_up} down={num_down} "
+        f"built in {time.perf_counter() - started:.1f}s -> {args.output}"
+    )
+
+
+if __name__ == "__main__":
+    main()
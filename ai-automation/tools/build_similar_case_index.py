@@ -0,0 +1,70 @@
+"""
+類似事例の索引の構築ツール
+
+過去の診断と、そのとき送った対策提案の JSON Lines から、AI診断サービスが
+起動時に mmap で読み込む類似事例の索引（SimilarCaseIndex）を作る。既存の索引には追加する。
+
+    cases.jsonl: {"symptoms": {...}, "recommendations": [...], "urgency": "high", "legal_risk": "medium"}
+                 （urgency・legal_risk を省略した場合は診断サービスの判定表で求める）
+
+    python tools/build_similar_case_index.py cases.jsonl similar-cases/
+    SIMILAR_CASE_INDEX_PATH=similar-cases python prototypes/ai-diagnosis-service.py
+"""
+
+import argparse
+import importlib.util
+import json
+import sys
+import time
+from pathlib import Path
+
+DEFAULT_SERVICE = Path(__file__).resolve().parent.parent / "prototypes" / "ai-diagnosis-service.py"
+
+
+def load_service(path: Path, name: str):
+    """ハイフン付きファイル名のサービスをモジュールとして読み込む"""
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("cases", type=Path)
+    parser.add_argument("output", type=Path)
+    parser.add_argument("--service", type=Path, default=DEFAULT_SERVICE)
+    args = parser.parse_args()
+
+    service = load_service(args.service, "ai_diagnosis_service")
+    index = service.SimilarCaseIndex(path=str(args.output), compact_every=None)
+
+    started = time.perf_counter()
+    added = skipped = 0
+    with open(args.cases, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            case = json.loads(line)
+            symptoms = service.Symptoms(**case["symptoms"])
+            urgency = case.get("urgency") or service.DiagnosisEngine.assess_urgency(symptoms)
+            legal_risk = case.get("legal_risk") or service.DiagnosisEngine.assess_legal_risk(symptoms)
+            if not case.get("recommendations"):
+                skipped += 1
+                continue
+            index.add(symptoms, urgency, legal_risk, case["recommendations"])
+            added += 1
+
+    index.compact()
+    summary = index.summary()
+    index.close()
+    print(
+        f"{added} 件を追加（対策提案なし {skipped} 件）、索引は {summary['cases']} 件: "
+        f"{time.perf_counter() - started:.1f}秒",
+        file=sys.stderr
+    )
+
+
+if __name__ == "__main__":
+    main()
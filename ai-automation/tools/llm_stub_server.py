@@ -0,0 +1,179 @@
+"""
+OpenAI API のスタブサーバー
+
+AI診断サービスの OpenAI API 呼び出し（LLMClient）をオフラインで試すための、
+/v1/chat/completions だけを持つサーバー。応答時間・遅い応答の割合・エラーの割合を指定でき、
+実行中も /stub/config で変えられる（障害の発生と復旧を再現する）。
+"stream": true の呼び出しには、応答時間の後に数文字ずつ token_ms 間隔で SSE の差分を返す。
+
+    python tools/llm_stub_server.py --latency-ms 800 --jitter-ms 300 --slow-rate 0.05 --error-rate 0.02
+    OPENAI_API_BASE=http://127.0.0.1:8099/v1 OPENAI_API_KEY=stub python prototypes/ai-diagnosis-service.py
+
+    # 障害を起こす / 戻す
+    curl -X POST http://127.0.0.1:8099/stub/config -H "Content-Type: application/json" -d '{"error_rate": 1.0}'
+    curl -X POST http://127.0.0.1:8099/stub/config -H "Content-Type: application/json" -d '{"error_rate": 0.0}'
+
+    # 受けた呼び出しの件数・同時実行数の最大・接続数
+    curl http://127.0.0.1:8099/stub/stats
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from typing import Dict
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+RECOMMENDATIONS = [
+    "騒音の発生日時・内容・大きさを1週間記録する",
+    "管理会社に記録を添えて文書で申し入れを行う",
+    "防音マットや遮音カーテンで室内の対策を行う",
+    "専門業者に騒音測定を依頼し、客観的なデータを取得する",
+    "測定結果をもとに弁護士や自治体の相談窓口に相談する",
+]
+
+app = FastAPI(title="OpenAI API Stub")
+
+# 応答の設定（/stub/config で変更できる）
+config: Dict = {
+    "latency_ms": 300.0,      # 応答時間の中央値
+    "jitter_ms": 100.0,       # 応答時間のばらつき（正規分布の標準偏差）
+    "slow_rate": 0.0,         # 遅い応答の割合
+    "slow_ms": 5000.0,        # 遅い応答で加える時間
+    "error_rate": 0.0,        # エラーを返す割合
+    "error_status": 500,      # エラーの HTTP ステータス
+    "token_ms": 30.0,         # ストリーミングの差分の間隔
+}
+
+stats: Dict = {
+    "requests": 0,
+    "errors": 0,
+    "slow": 0,
+    "in_flight": 0,
+    "max_in_flight": 0,
+}
+connections = set()
+rnd = random.Random()
+
+
+def _content() -> str:
+    count = rnd.randint(3, 5)
+    return "\n".join(f"{i}. {text}" for i, text in enumerate(RECOMMENDATIONS[:count], start=1))
+
+
+def _completion(model: str) -> Dict:
+    content = _content()
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex[:24]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop",
+        }],
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+    }
+
+
+async def _stream(model: str):
+    """chat.completion.chunk の SSE（最初の差分は role、最後は finish_reason と [DONE]）"""
+    completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+
+    def chunk(delta: Dict, finish_reason=None) -> str:
+        data = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+        return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+    yield chunk({"role": "assistant"})
+    content = _content()
+    for start in range(0, len(content), 4):
+        await asyncio.sleep(config["token_ms"] / 1000)
+        yield chunk({"content": content[start:start + 4]})
+    yield chunk({}, "stop")
+    yield "data: [DONE]\n\n"
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    stats["requests"] += 1
+    stats["in_flight"] += 1
+    stats["max_in_flight"] = max(stats["max_in_flight"], stats["in_flight"])
+    if request.client is not None:
+        connections.add((request.client.host, request.client.port))
+
+    try:
+        latency = max(0.0, rnd.gauss(config["latency_ms"], config["jitter_ms"]))
+        if rnd.random() < config["slow_rate"]:
+            stats["slow"] += 1
+            latency += config["slow_ms"]
+        await asyncio.sleep(latency / 1000)
+
+        if rnd.random() < config["error_rate"]:
+            stats["errors"] += 1
+            return JSONResponse(
+                status_code=int(config["error_status"]),
+                content={"error": {"message": "stub error", "type": "server_error", "param": None, "code": None}}
+            )
+        if body.get("stream"):
+            return StreamingResponse(_stream(body.get("model", "gpt-4")), media_type="text/event-stream")
+        return _completion(body.get("model", "gpt-4"))
+    finally:
+        stats["in_flight"] -= 1
+
+
+@app.get("/stub/config")
+def get_config():
+    return config
+
+
+@app.post("/stub/config")
+async def update_config(request: Request):
+    """指定した項目だけ変更する（不明な項目は無視）"""
+    updates = await request.json()
+    for key, value in updates.items():
+        if key in config:
+            config[key] = type(config[key])(value)
+    return config
+
+
+@app.get("/stub/stats")
+def get_stats():
+    return {**stats, "connections": len(connections)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency-ms", type=float, default=config["latency_ms"])
+    parser.add_argument("--jitter-ms", type=float, default=config["jitter_ms"])
+    parser.add_argument("--slow-rate", type=float, default=config["slow_rate"])
+    parser.add_argument("--slow-ms", type=float, default=config["slow_ms"])
+    parser.add_argument("--error-rate", type=float, default=config["error_rate"])
+    parser.add_argument("--error-status", type=int, default=config["error_status"])
+    parser.add_argument("--token-ms", type=float, default=config["token_ms"])
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    for key in config:
+        config[key] = getattr(args, key)
+    rnd.seed(args.seed)
+
+    import uvicorn
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()